@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+"""Benchmark Alice's payload builders and API routes.
+
+Microbenchmarks time the functions that build request bodies and transcripts.
+Route benchmarks send requests through the app with every upstream call answered
+by a local stand-in server (see `src/api/replay.py`), so they measure Alice alone.
+
+Run from the repository root, and compare the results across commits with:
+
+    python benchmarks/bench.py --output before.json
+    python benchmarks/bench.py --output after.json --compare before.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import timeit
+
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+from werkzeug.serving import WSGIRequestHandler, make_server
+
+from app import app
+from src.api import replay
+from src.api.orders import Order
+from src.api.partner import Referral
+from src.api.utils import format_request_and_response, format_request_as_curl
+from src.api.vault import Vault
+
+ORDER_ID = "5O190127TN364715T"
+SETUP_TOKEN_ID = "5C991763VB2781612"
+
+PARTNER_OPTIONS = {
+    "partner-id": "PARTNER0000001",
+    "partner-client-id": "benchmark-client-id",
+    "partner-secret": "benchmark-secret",
+    "partner-bn-code": "BENCHMARK_BN_CODE",
+    "merchant-id": "MERCHANT000001",
+}
+
+ORDER_OPTIONS = PARTNER_OPTIONS | {
+    "intent": "CAPTURE",
+    "payment-source": "paypal",
+    "item-price": "100.00",
+    "item-tax": "7.50",
+    "item-category": "PHYSICAL_GOODS",
+    "include-shipping-address": "true",
+    "include-shipping-options": "true",
+    "partner-fee": "1.25",
+    "shipping-preference": "GET_FROM_FILE",
+    "user-action": "PAY_NOW",
+}
+
+VAULT_OPTIONS = PARTNER_OPTIONS | {
+    "payment-source": "card",
+    "vault-level": "MERCHANT",
+    "cardholder-name": "Jane Doe",
+    "billing-address-line-1": "2211 N First St",
+    "billing-address-admin-area-1": "CA",
+    "billing-address-admin-area-2": "San Jose",
+    "billing-address-postal-code": "95131",
+    "billing-address-country-code": "US",
+    "3ds-preference": "SCA_WHEN_REQUIRED",
+}
+
+REFERRAL_OPTIONS = PARTNER_OPTIONS | {
+    "product": "ppcp",
+    "vault-level": "MERCHANT",
+    "country-code": "US",
+    "feature-payment": "PAYMENT",
+    "feature-refund": "REFUND",
+    "feature-partner-fee": "PARTNER_FEE",
+}
+
+# Responses served by the stand-in server, by route.
+UPSTREAM_RESPONSES = {
+    "POST /v1/oauth2/token": (
+        200,
+        {"access_token": "A21AAbenchmark", "token_type": "Bearer", "expires_in": 32400},
+    ),
+    "POST /v2/checkout/orders": (
+        201,
+        {"id": ORDER_ID, "status": "CREATED", "links": []},
+    ),
+    "POST /v2/checkout/orders/{id}/capture": (
+        201,
+        {
+            "id": ORDER_ID,
+            "status": "COMPLETED",
+            "purchase_units": [
+                {"payments": {"captures": [{"id": "3C679366HH908993F"}]}}
+            ],
+        },
+    ),
+    "POST /v3/vault/setup-tokens": (
+        201,
+        {"id": SETUP_TOKEN_ID, "status": "PAYER_ACTION_REQUIRED", "links": []},
+    ),
+}
+
+
+def measure(func, repeat=5):
+    """Return timings (in microseconds per call) of `func`, like `timeit` does."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    per_call = [t / number * 1e6 for t in timer.repeat(repeat=repeat, number=number)]
+    return {
+        "number": number,
+        "repeat": repeat,
+        "best_us": round(min(per_call), 3),
+        "median_us": round(statistics.median(per_call), 3),
+    }
+
+
+def build_sample_response():
+    """Return a realistic upstream response, as the transcript formatters receive it."""
+    body = Order(**ORDER_OPTIONS).build_purchase_unit()
+    prepared = requests.Request(
+        "POST",
+        f"{app.config['ENDPOINT_PREFIX']}/v2/checkout/orders",
+        headers={
+            "Authorization": "Bearer A21AAbenchmark",
+            "Content-Type": "application/json",
+            "PayPal-Request-Id": "1234567890",
+        },
+        json={"intent": "CAPTURE", "purchase_units": [body]},
+    ).prepare()
+
+    response = requests.Response()
+    response.status_code = 201
+    response.reason = "Created"
+    response.headers["Content-Type"] = "application/json"
+    response.headers["PayPal-Debug-Id"] = "f0123456789ab"
+    _, body = UPSTREAM_RESPONSES["POST /v2/checkout/orders"]
+    response._content = json.dumps(body).encode("utf-8")
+    response.request = prepared
+    return response
+
+
+def run_microbenchmarks():
+    with app.test_request_context():
+        order = Order(**ORDER_OPTIONS)
+        referral = Referral(**REFERRAL_OPTIONS)
+        vault = Vault(**VAULT_OPTIONS)
+        response = build_sample_response()
+
+        benchmarks = {
+            "Order.build_purchase_unit": order.build_purchase_unit,
+            "Order.build_payment_source_for_create": order.build_payment_source_for_create,
+            "Referral.build_operations": referral.build_operations,
+            "Vault.build_payment_source": lambda: vault.build_payment_source("setup"),
+            "format_request_and_response": lambda: format_request_and_response(
+                response
+            ).render(("human", "curl")),
+            "format_request_as_curl": lambda: format_request_as_curl(response.request),
+        }
+        results = dict()
+        for name, func in benchmarks.items():
+            results[name] = measure(func)
+            print(f"{name}: {results[name]['median_us']} us", file=sys.stderr)
+        return results
+
+
+class QuietRequestHandler(WSGIRequestHandler):
+    def log_request(self, *args, **kwargs):
+        pass
+
+
+def start_stand_in_server(latency):
+    recordings = [
+        {
+            "method": route.split()[0],
+            "path": route.split()[1],
+            "body_key": "",
+            "route": route,
+            "status": status,
+            "headers": json.dumps({"Content-Type": "application/json"}),
+            "body": json.dumps(body).encode("utf-8"),
+            "latency": 0,
+            "recorded_at": 0,
+        }
+        for route, (status, body) in UPSTREAM_RESPONSES.items()
+    ]
+    stand_in = replay.create_stand_in_app(recordings, latency)
+    server = make_server(
+        "127.0.0.1", 0, stand_in, threaded=True, request_handler=QuietRequestHandler
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_route_benchmark(path, body, requests_count, concurrency):
+    """Send `requests_count` requests to the route, `concurrency` at a time."""
+
+    def send(_):
+        client = app.test_client()
+        start = time.perf_counter()
+        response = client.post(path, json=body)
+        latency = time.perf_counter() - start
+        return latency, response.status_code < 400
+
+    for _ in range(min(concurrency, 10)):  # Warm up (e.g., cache an access token).
+        send(None)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(requests_count)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    quantiles = statistics.quantiles(latencies, n=100, method="inclusive")
+    return {
+        "requests": requests_count,
+        "concurrency": concurrency,
+        "errors": sum(not ok for _, ok in results),
+        "rps": round(requests_count / elapsed, 1),
+        "p50_ms": round(quantiles[49], 3),
+        "p95_ms": round(quantiles[94], 3),
+        "p99_ms": round(quantiles[98], 3),
+    }
+
+
+def run_route_benchmarks(requests_count, concurrency, upstream_latency):
+    server = start_stand_in_server(upstream_latency)
+    app.config["UPSTREAM_MODE"] = "replay"
+    app.config["UPSTREAM_REPLAY_URL"] = f"http://127.0.0.1:{server.server_port}"
+    app.config["HTTP_POOL_MAXSIZE"] = max(concurrency, 10)
+
+    routes = {
+        "/api/orders/": ORDER_OPTIONS,
+        "/api/orders/<id>/capture": ORDER_OPTIONS,
+        "/api/vault/setup-tokens": VAULT_OPTIONS,
+    }
+    results = dict()
+    try:
+        for route, body in routes.items():
+            path = route.replace("<id>", ORDER_ID)
+            results[route] = run_route_benchmark(
+                path, body, requests_count, concurrency
+            )
+            print(
+                f"{route}: {results[route]['rps']} req/s, "
+                f"p50 {results[route]['p50_ms']} ms",
+                file=sys.stderr,
+            )
+    finally:
+        server.shutdown()
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    """Print the change of each result relative to the baseline's."""
+    metrics = {"micro": ("median_us", False), "routes": ("rps", True)}
+    for section, (metric, higher_is_better) in metrics.items():
+        for name, result in results[section].items():
+            try:
+                before = baseline[section][name][metric]
+            except KeyError:
+                continue
+            change = (result[metric] - before) / before * 100
+            better = (change > 0) == higher_is_better
+            label = "better" if better else "worse"
+            print(
+                f"{section:6} {name:40} {metric:9} {before:>12} -> {result[metric]:>12}"
+                f" ({change:+.1f}%, {label})"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--output", help="File to write the JSON results to")
+    parser.add_argument("--compare", help="JSON results of a previous run")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument(
+        "--upstream-latency",
+        default="fixed:0",
+        help="Latency distribution of the stand-in server (see `flask stand-in`)",
+    )
+    parser.add_argument("--skip-routes", action="store_true")
+    args = parser.parse_args()
+
+    # Keep the benchmark's token caches, queues, etc. out of the real instance folder.
+    app.instance_path = tempfile.mkdtemp(prefix="alice-benchmark-")
+    app.config["favicon"] = ""
+
+    results = {
+        "commit": get_commit(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "micro": run_microbenchmarks(),
+        "routes": dict(),
+    }
+    if not args.skip_routes:
+        results["routes"] = run_route_benchmarks(
+            args.requests, args.concurrency, args.upstream_latency
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare:
+        with open(args.compare, "r") as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -10,6 +10,74 @@ class SandboxConfig:
 
     SFTP_HOSTNAME = "reports.sandbox.paypal.com"
 
+    # Reuse OAuth access tokens across requests (and gunicorn workers) until
+    # this many seconds before they expire.
+    ACCESS_TOKEN_CACHE = True
+    ACCESS_TOKEN_REFRESH_MARGIN = 300
+
+    # Reuse client and SDK tokens (which aren't customer-specific) across page
+    # loads for at most this many seconds, well within their lifetime.
+    CLIENT_TOKEN_CACHE = True
+    CLIENT_TOKEN_MAX_AGE = 900
+
+    # Every upstream call goes through one pooled, keep-alive session per worker.
+    # Timeouts are in seconds.
+    HTTP_POOL_CONNECTIONS = 4
+    HTTP_POOL_MAXSIZE = int(os.environ.get("HTTP_POOL_MAXSIZE", "10"))
+    HTTP_CONNECT_TIMEOUT = 5
+    HTTP_READ_TIMEOUT = 30
+
+    # Transient failures are retried (POSTs only with a PayPal-Request-Id) with
+    # exponential backoff and jitter, in seconds. Each route's retries are limited
+    # to a fraction of its requests, plus a minimum.
+    HTTP_RETRIES = 2
+    HTTP_RETRY_BACKOFF = 0.5
+    HTTP_RETRY_MAX_DELAY = 10
+    HTTP_RETRY_BUDGET_RATIO = 0.2
+    HTTP_RETRY_BUDGET_MIN = 10
+
+    # "live" calls the PayPal API, "record" also saves every response, and "replay"
+    # sends every call to the stand-in server (`flask --app app stand-in`) instead.
+    UPSTREAM_MODE = os.environ.get("UPSTREAM_MODE", "live")
+    UPSTREAM_REPLAY_URL = os.environ.get("UPSTREAM_REPLAY_URL", "http://127.0.0.1:8001")
+
+    # The most upstream calls a single batch request may have in flight at once.
+    BATCH_MAX_CONCURRENCY = 16
+
+    # The most payment tokens a purge deletes per second.
+    VAULT_PURGE_RATE = 20
+
+    # Serve static files under fingerprinted names (e.g., "utils.1a2b3c4d5e6f.js"),
+    # precompressed and cached forever. Ignored in debug mode.
+    HASHED_ASSETS = True
+
+    # Webhooks are acknowledged immediately, queued in the instance folder and
+    # verified in batches by background threads (in every worker).
+    WEBHOOK_VERIFY_THREADS = 2
+    WEBHOOK_VERIFY_BATCH_SIZE = 10
+    WEBHOOK_VERIFY_MAX_ATTEMPTS = 3
+    WEBHOOK_POLL_INTERVAL = 5
+
+    # Verify webhook signatures in-process (requires the `cryptography` package)
+    # with certificates downloaded from these hosts, falling back to the API.
+    # Certificates must chain up to a CA in the bundle (by default, certifi's).
+    WEBHOOK_LOCAL_VERIFICATION = True
+    WEBHOOK_CERT_HOSTS = ("paypal.com",)
+    WEBHOOK_CERT_CACHE_TTL = 24 * 60 * 60
+    WEBHOOK_CERT_CA_BUNDLE = os.environ.get("WEBHOOK_CERT_CA_BUNDLE")
+
+    # Monitored sellers are polled (as the configured partner) every MIN_INTERVAL
+    # seconds while onboarding, backing off to MAX_INTERVAL while nothing changes,
+    # and every ONBOARDED_INTERVAL once they can receive payments.
+    SELLER_MONITOR_MIN_INTERVAL = 30
+    SELLER_MONITOR_MAX_INTERVAL = 15 * 60
+    SELLER_MONITOR_ONBOARDED_INTERVAL = 6 * 60 * 60
+    SELLER_MONITOR_BATCH_SIZE = 50
+    SELLER_MONITOR_POLL_INTERVAL = 5
+
+    # How often (in seconds) each worker shares its /metrics histograms.
+    METRICS_FLUSH_INTERVAL = 1
+
 
 class TestingConfig(SandboxConfig):
     DEBUG = False
@@ -20,6 +88,7 @@ class PartnerConfig(TestingConfig):
     PARTNER_SECRET = os.environ.get("PARTNER_SECRET")
     PARTNER_BN_CODE = os.environ.get("PARTNER_BN_CODE")
     PARTNER_ID = os.environ.get("PARTNER_ID")
+    WEBHOOK_ID = os.environ.get("WEBHOOK_ID")
 
 
 class MerchantConfig(TestingConfig):
@@ -1,10 +1,41 @@
+import os
 from multiprocessing import cpu_count
 
 proc_name = "alice"
-workers = 2 * cpu_count() + 1
 bind = "unix:Alice.sock"
 wsgi_app = "app:app"
 
+# Worker profile, selected with the ALICE_WORKER_CLASS environment variable:
+# sync    -> each worker handles one request at a time (the default).
+# gthread -> each worker runs ALICE_THREADS threads sharing one upstream session.
+# gevent  -> each worker runs up to ALICE_WORKER_CONNECTIONS green threads;
+#            requires `python3 -m pip install gevent`.
+worker_class = os.environ.get("ALICE_WORKER_CLASS", "sync")
+match worker_class:
+    case "gthread":
+        workers = cpu_count() + 1
+        threads = int(os.environ.get("ALICE_THREADS", "32"))
+        upstream_concurrency = threads
+    case "gevent":
+        workers = cpu_count()
+        worker_connections = int(os.environ.get("ALICE_WORKER_CONNECTIONS", "500"))
+        upstream_concurrency = worker_connections
+    case _:
+        workers = 2 * cpu_count() + 1
+        upstream_concurrency = 1
+
+# Size each worker's upstream connection pool to its concurrency (see config.py).
+os.environ.setdefault("HTTP_POOL_MAXSIZE", str(max(10, min(upstream_concurrency, 100))))
+
+
+def child_exit(server, worker):
+    """Keep the /metrics counts of a worker that exited (e.g., after max_requests)."""
+    from src.metrics import archive_worker_metrics
+
+    root = os.path.dirname(os.path.abspath(__file__))
+    archive_worker_metrics(os.path.join(root, "instance", "metrics"), worker.pid)
+
+
 accesslog = "access_log.log"
 access_log_format = '{"date_time": "%(t)s", "remote_address": "%(h)s", "referer": "%(f)s", "method": "%(m)s", "url_path": "%(U)s", "status": "%(s)s", "user_agent": "%(a)s", "request_time_in_seconds": "%(L)s"}'
 # Docs: https://docs.gunicorn.org/en/stable/settings.html#access-log-format
@@ -1,14 +1,23 @@
 #!/usr/bin/env python3
+import argparse
+import bisect
+import calendar
+import functools
+import glob
+import itertools
 import json
+import math
+import multiprocessing
+import operator
+import os
 import sqlite3
-import sys
 
-from datetime import datetime, timezone, timedelta
+from datetime import datetime, timezone
 
 
 def get_cols():
     return {
-        "date_time": "timestamp",
+        "date_time": "INTEGER",  # Seconds since the epoch
         "remote_address": "TEXT",
         "referer": "TEXT",
         "method": "TEXT",
@@ -19,51 +28,255 @@ def get_cols():
     }
 
 
-def format_timestamp(timestamp):
-    month_dict = {
-        "Jan": 1,
-        "Feb": 2,
-        "Mar": 3,
-        "Apr": 4,
-        "May": 5,
-        "Jun": 6,
-        "Jul": 7,
-        "Aug": 8,
-        "Sep": 9,
-        "Oct": 10,
-        "Nov": 11,
-        "Dec": 12,
-    }
+MONTHS = {
+    "Jan": 1,
+    "Feb": 2,
+    "Mar": 3,
+    "Apr": 4,
+    "May": 5,
+    "Jun": 6,
+    "Jul": 7,
+    "Aug": 8,
+    "Sep": 9,
+    "Oct": 10,
+    "Nov": 11,
+    "Dec": 12,
+}
+
+
+@functools.lru_cache(maxsize=4096)
+def timestamp_to_epoch(timestamp):
+    """Return the seconds since the epoch of a gunicorn timestamp like "[30/Aug/2023:13:44:38 -0400]".
+
+    The timestamp has a fixed layout, so it's sliced rather than split. Requests
+    arrive many times per second, so recent timestamps are memoized.
+    """
     timestamp = timestamp.removeprefix("[")
-    timestamp = timestamp.removesuffix("]")
-    day, month, year_and_time = timestamp.split("/")
-    year, hour, minute, second_and_offset = year_and_time.split(":")
-    second, offset = second_and_offset.split(" ")
-
-    offset_hours, offset_minutes = offset[:-2], offset[-2:]
-    offset = timezone(
-        timedelta(
-            hours=int(offset_hours),
-            minutes=int(offset_minutes),
+    year = int(timestamp[7:11])
+    month = MONTHS[timestamp[3:6]]
+    day = int(timestamp[0:2])
+    hour = int(timestamp[12:14])
+    minute = int(timestamp[15:17])
+    second = int(timestamp[18:20])
+
+    offset_sign = -1 if timestamp[21] == "-" else 1
+    offset = offset_sign * (int(timestamp[22:24]) * 3600 + int(timestamp[24:26]) * 60)
+
+    return calendar.timegm((year, month, day, hour, minute, second)) - offset
+
+
+def format_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp_to_epoch(timestamp), tz=timezone.utc)
+
+
+# Bump this when the schema changes; older databases are dropped and re-ingested.
+SCHEMA_VERSION = 2
+
+# Rollup tables, by name, and the width of their buckets in seconds.
+ROLLUP_RESOLUTIONS = {
+    "minute": 60,
+    "hour": 60 * 60,
+}
+
+# Upper bounds (in seconds) of the latency histogram buckets, which let percentiles
+# be computed over arbitrary ranges of hourly buckets.
+LATENCY_HISTOGRAM_BOUNDS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    math.inf,
+)
+
+
+def create_table(con):
+    (schema_version,) = con.execute("PRAGMA user_version").fetchone()
+    with con:
+        if schema_version != SCHEMA_VERSION:
+            for table in ["access", "ingest_state", "access_latency_histogram"]:
+                con.execute(f"DROP TABLE IF EXISTS {table}")
+            for name in ROLLUP_RESOLUTIONS:
+                con.execute(f"DROP TABLE IF EXISTS access_rollup_{name}")
+            con.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+        cols = ", ".join([f"{key} {val}" for key, val in get_cols().items()])
+        con.execute(f"CREATE TABLE IF NOT EXISTS access({cols})")
+        con.execute(
+            "CREATE INDEX IF NOT EXISTS access_date_time ON access(date_time)"
         )
-    )
+        con.execute(
+            "CREATE INDEX IF NOT EXISTS access_url_path ON access(url_path, date_time)"
+        )
+        con.execute(
+            "CREATE INDEX IF NOT EXISTS access_status ON access(status, date_time)"
+        )
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS ingest_state(
+                log_file TEXT PRIMARY KEY,
+                inode INTEGER,
+                offset INTEGER
+            )
+        """
+        )
+        for name in ROLLUP_RESOLUTIONS:
+            con.execute(
+                f"""
+                CREATE TABLE IF NOT EXISTS access_rollup_{name}(
+                    bucket INTEGER,
+                    url_path TEXT,
+                    count INTEGER,
+                    error_count INTEGER,
+                    p50 REAL,
+                    p95 REAL,
+                    p99 REAL,
+                    PRIMARY KEY (bucket, url_path)
+                )
+            """
+            )
+        con.execute(
+            """
+            CREATE TABLE IF NOT EXISTS access_latency_histogram(
+                bucket INTEGER,
+                url_path TEXT,
+                le REAL,
+                count INTEGER,
+                PRIMARY KEY (bucket, url_path, le)
+            )
+        """
+        )
+
+
+def percentile(sorted_values, fraction):
+    """Return the nearest-rank percentile of a non-empty, sorted list."""
+    index = max(math.ceil(fraction * len(sorted_values)) - 1, 0)
+    return sorted_values[index]
 
-    kwargs = dict(
-        year=int(year),
-        month=month_dict[month],
-        day=int(day),
-        hour=int(hour),
-        minute=int(minute),
-        second=int(second),
-        tzinfo=offset,
+
+def histogram_bound(latency):
+    return LATENCY_HISTOGRAM_BOUNDS[
+        bisect.bisect_left(LATENCY_HISTOGRAM_BOUNDS, latency)
+    ]
+
+
+def aggregate_rollups(rows):
+    """Return the rollup counts of `rows`, to be added to the tables by `add_rollups`.
+
+    Maps `(name, bucket, url_path)` to `[count, error_count, histogram]`, where the
+    histogram (of hourly buckets only) maps latency bounds to counts.
+    """
+    aggregates = {}
+    for date_time, _, _, _, url_path, status, _, latency in rows:
+        for name, width in ROLLUP_RESOLUTIONS.items():
+            key = (name, date_time - date_time % width, url_path)
+            aggregate = aggregates.get(key)
+            if aggregate is None:
+                aggregate = aggregates[key] = [0, 0, {}]
+            aggregate[0] += 1
+            if status >= 500:
+                aggregate[1] += 1
+            if name == "hour" and latency is not None:
+                histogram = aggregate[2]
+                bound = histogram_bound(latency)
+                histogram[bound] = histogram.get(bound, 0) + 1
+    return aggregates
+
+
+def add_rollups(con, aggregates):
+    """Add the counts of `aggregate_rollups` to the rollups.
+
+    The percentiles of the buckets added to are cleared, to be recomputed by
+    `update_percentiles`. Must be called inside a transaction.
+    """
+    rollups = {name: [] for name in ROLLUP_RESOLUTIONS}
+    histograms = []
+    for (name, bucket, url_path), (count, error_count, histogram) in aggregates.items():
+        rollups[name].append((bucket, url_path, count, error_count))
+        histograms.extend(
+            (bucket, url_path, bound, bound_count)
+            for bound, bound_count in histogram.items()
+        )
+
+    for name, rows in rollups.items():
+        con.executemany(
+            f"""
+            INSERT INTO access_rollup_{name} VALUES (?,?,?,?,NULL,NULL,NULL)
+            ON CONFLICT (bucket, url_path) DO UPDATE SET
+                count = count + excluded.count,
+                error_count = error_count + excluded.error_count,
+                p50 = NULL,
+                p95 = NULL,
+                p99 = NULL
+        """,
+            rows,
+        )
+    con.executemany(
+        """
+        INSERT INTO access_latency_histogram VALUES (?,?,?,?)
+        ON CONFLICT (bucket, url_path, le) DO UPDATE SET
+            count = count + excluded.count
+    """,
+        histograms,
     )
-    my_datetime = datetime(**kwargs)
-    return datetime.fromtimestamp(my_datetime.timestamp(), tz=timezone.utc)
 
 
-def create_table(con):
-    cols = ", ".join([f"{key} {val}" for key, val in get_cols().items()])
-    con.execute(f"CREATE TABLE access({cols})")
+def update_percentiles(con):
+    """Compute the latency percentiles of the buckets added to since they were last computed.
+
+    They're exact, so they're computed from the raw rows, once per ingestion
+    rather than for every chunk.
+    """
+    with con:
+        for name, width in ROLLUP_RESOLUTIONS.items():
+            stale = set(
+                con.execute(
+                    f"SELECT bucket, url_path FROM access_rollup_{name} WHERE p50 IS NULL"
+                )
+            )
+            if not stale:
+                continue
+
+            buckets = [bucket for bucket, _ in stale]
+            res = con.execute(
+                """
+                SELECT
+                    date_time - date_time % ?,
+                    url_path,
+                    request_time_in_seconds
+                FROM
+                    access
+                WHERE
+                    date_time >= ? AND date_time < ?
+                    AND request_time_in_seconds IS NOT NULL
+                ORDER BY
+                    1, 2, 3
+            """,
+                (width, min(buckets), max(buckets) + width),
+            )
+
+            percentiles = []
+            for key, rows in itertools.groupby(res, key=lambda row: row[:2]):
+                if key in stale:
+                    latencies = [row[2] for row in rows]
+                    percentiles.append(
+                        (*[percentile(latencies, q) for q in (0.5, 0.95, 0.99)], *key)
+                    )
+            con.executemany(
+                f"""
+                UPDATE access_rollup_{name} SET p50 = ?, p95 = ?, p99 = ?
+                WHERE bucket = ? AND url_path = ?
+            """,
+                percentiles,
+            )
 
 
 def format_result(result, col_names):
@@ -89,16 +302,20 @@ def format_result(result, col_names):
     return rows_out
 
 
+to_row = operator.itemgetter(*get_cols())
+
+
+def insert_rows_into_table(con, rows):
+    con.executemany("INSERT INTO access VALUES (?,?,?,?,?,?,?,?)", rows)
+
+
 def insert_logs_into_table(con, logs):
-    cols = get_cols().keys()
-    rows = [tuple(log[col_name] for col_name in cols) for log in logs]
-    with con:
-        con.executemany("INSERT INTO access VALUES (?,?,?,?,?,?,?,?)", rows)
+    insert_rows_into_table(con, [to_row(log) for log in logs])
 
 
 def list_data(con):
     cols = {
-        "date_time": "Access time",
+        "datetime(date_time, 'unixepoch')": "Access time",
         "remote_address": "IP Address",
         "referer": "Referer",
         "method": "Method",
@@ -127,8 +344,9 @@ def list_data(con):
 
 def inspect_data_by_date(con):
     cols = {
-        "DATE(date_time)": "Date",
-        "count(*)": "Count",
+        "DATE(bucket, 'unixepoch')": "Date",
+        "SUM(count)": "Count",
+        "SUM(error_count)": "Errors",
     }
     with con:
         res = con.execute(
@@ -136,11 +354,11 @@ def inspect_data_by_date(con):
             SELECT
                 {', '.join(cols.keys())}
             FROM
-                access
+                access_rollup_hour
             GROUP BY
-                DATE(date_time)
+                DATE(bucket, 'unixepoch')
             ORDER BY
-                date_time DESC
+                bucket DESC
         """
         )
     result = list(res.fetchall())
@@ -150,7 +368,7 @@ def inspect_data_by_date(con):
 
 def inspect_data_by_time(con, date="now"):
     cols = {
-        "strftime('%H:%M', date_time)": "Time",
+        "strftime('%H:%M', date_time, 'unixepoch')": "Time",
         # "date_time": "Access time",
         # "remote_address": "IP Address",
         "referer": "Referer",
@@ -167,16 +385,82 @@ def inspect_data_by_time(con, date="now"):
             FROM
                 access
             WHERE
-                DATE(date_time) = DATE('{date}')
+                date_time >= CAST(strftime('%s', DATE(:date)) AS INTEGER)
+                AND date_time < CAST(strftime('%s', DATE(:date, '+1 day')) AS INTEGER)
             ORDER BY
                 date_time DESC
-        """
+        """,
+            {"date": date},
         )
     result = list(res.fetchall())
     formatted_results = format_result(result, col_names=cols.values())
     print("\n".join(formatted_results))
 
 
+def inspect_latency_by_route(con, days=90):
+    """Print each route's request count, error count, and latency percentiles over the last `days` days."""
+    with con:
+        (latest,) = con.execute("SELECT MAX(bucket) FROM access_rollup_hour").fetchone()
+        if latest is None:
+            return
+        since = latest - days * 24 * 60 * 60
+
+        counts = con.execute(
+            """
+            SELECT
+                url_path,
+                SUM(count),
+                SUM(error_count)
+            FROM
+                access_rollup_hour
+            WHERE
+                bucket > ?
+            GROUP BY
+                url_path
+        """,
+            (since,),
+        ).fetchall()
+        histograms = con.execute(
+            """
+            SELECT
+                url_path,
+                le,
+                SUM(count)
+            FROM
+                access_latency_histogram
+            WHERE
+                bucket > ?
+            GROUP BY
+                url_path, le
+            ORDER BY
+                url_path, le
+        """,
+            (since,),
+        ).fetchall()
+
+    percentiles = {}
+    for url_path, rows in itertools.groupby(histograms, key=lambda row: row[0]):
+        rows = list(rows)
+        total = sum(count for _, _, count in rows)
+        route_percentiles = []
+        for q in (0.5, 0.95, 0.99):
+            cumulative = 0
+            for _, le, count in rows:
+                cumulative += count
+                if cumulative >= q * total:
+                    route_percentiles.append(f"<= {le}")
+                    break
+        percentiles[url_path] = route_percentiles
+
+    result = [
+        (url_path, count, error_count, *percentiles.get(url_path, ["", "", ""]))
+        for url_path, count, error_count in sorted(counts, key=lambda row: -row[1])
+    ]
+    col_names = ["Route", "Count", "Errors", "p50 (s)", "p95 (s)", "p99 (s)"]
+    formatted_results = format_result(result, col_names=col_names)
+    print("\n".join(formatted_results))
+
+
 def inspect_data_by_user_agent(con):
     cols = {
         "user_agent": "User Agent",
@@ -200,53 +484,201 @@ def inspect_data_by_user_agent(con):
     print("\n".join(formatted_results))
 
 
-def load_logs(con, log_file):
-    with open(log_file, "r") as f:
-        logs = f.readlines()
-
-    logs_as_dicts = []
-    for log in logs:
-        if not log:
-            continue
-
+def parse_log(log):
+    """Return the log line as a dict, or None if it should be skipped."""
+    if "\\" in log:
         log = log.replace('\\"', "'")
         log = log.replace("\\", "")
+    try:
+        log = json.loads(log)
+    except json.decoder.JSONDecodeError:
+        print(f"JSONDecodeError loading {log}")
+        return None
+
+    if (
+        log["user_agent"]
+        == "Mozilla/4.0 (compatible; MSIE 8.0; Windows NT 5.1; Trident/4.0)"
+        or "Nessus" in log["user_agent"]
+        or "nessus" in log["user_agent"]
+    ):
+        return None
+
+    log["referer"] = log["referer"].removeprefix(
+        "http://partnertools.dev51-test-apps-gpstam.dev51.cbf.dev.paypalinc.com:8000"
+    )
+    log["date_time"] = timestamp_to_epoch(log["date_time"])
+    return log
+
+
+def read_lines(f):
+    """Yield `(line, offset)` for each complete line of the binary file `f`.
+
+    `offset` is the position just past the line. A trailing line without a
+    newline is still being written, so it's left for the next run.
+    """
+    offset = f.tell()
+    for line in f:
+        if not line.endswith(b"\n"):
+            return
+        offset += len(line)
+        yield line.decode("utf-8", errors="replace"), offset
+
+
+def insert_chunk(con, rows, state_key, inode, offset, aggregates=None):
+    """Insert a chunk of rows, add them to the rollups, and record the offset reached.
+
+    `aggregates` are the rows' rollup counts, if they've already been aggregated.
+    """
+    if aggregates is None:
+        aggregates = aggregate_rollups(rows)
+    with con:
+        insert_rows_into_table(con, rows)
+        add_rollups(con, aggregates)
+        con.execute(
+            "INSERT OR REPLACE INTO ingest_state VALUES (?,?,?)",
+            (state_key, inode, offset),
+        )
+
+
+def parse_lines(lines):
+    logs = (parse_log(line) for line in lines if line.strip())
+    return [to_row(log) for log in logs if log is not None]
+
+
+def ingest_file(con, log_file, state_key, offset, inode, chunk_size, processes=1):
+    """Ingest `log_file` from `offset` onward in chunks, recording progress under `state_key`."""
+    if processes > 1:
+        return ingest_file_in_parallel(
+            con, log_file, state_key, offset, inode, processes
+        )
+
+    with open(log_file, "rb") as f:
+        f.seek(offset)
+        lines = read_lines(f)
+        while chunk := list(itertools.islice(lines, chunk_size)):
+            _, offset = chunk[-1]
+            rows = parse_lines(line for line, _ in chunk)
+            insert_chunk(con, rows, state_key, inode, offset)
+    return offset
+
+
+def parse_byte_range(args):
+    """Parse the complete lines that start in [start, end) of `log_file`.
+
+    Returns the parsed rows, their rollup counts (see `aggregate_rollups`), and the
+    offset just past the last line parsed.
+    """
+    log_file, start, end = args
+    with open(log_file, "rb") as f:
+        f.seek(start)
+        if start > 0:
+            # Skip the partial line; it belongs to the previous range.
+            f.seek(start - 1)
+            f.readline()
+
+        offset = f.tell()
+        lines = []
+        for line, line_end in read_lines(f):
+            if offset >= end:
+                break
+            lines.append(line)
+            offset = line_end
+
+    rows = parse_lines(lines)
+    return rows, aggregate_rollups(rows), offset
+
+
+def ingest_file_in_parallel(
+    con, log_file, state_key, offset, inode, processes, range_size=8 * 1024 * 1024
+):
+    """Like `ingest_file`, but parse and aggregate byte ranges of the file on several processes.
+
+    Parsed ranges are inserted, and their rollup counts added, in order, so the
+    recorded offset is always safe to resume from.
+    """
+    end = os.stat(log_file).st_size
+    ranges = [
+        (log_file, start, min(start + range_size, end))
+        for start in range(offset, end, range_size)
+    ]
+    with multiprocessing.Pool(processes) as pool:
+        for rows, aggregates, range_offset in pool.imap(parse_byte_range, ranges):
+            if range_offset > offset:
+                offset = range_offset
+                insert_chunk(con, rows, state_key, inode, offset, aggregates)
+    return offset
+
+
+def find_rotated_log_file(log_file, inode):
+    """Return the path that `log_file` was rotated to, identified by its inode."""
+    for path in glob.glob(f"{log_file}.*"):
         try:
-            log = json.loads(log)
-        except json.decoder.JSONDecodeError:
-            print(f"JSONDecodeError loading {log}")
+            if os.stat(path).st_ino == inode:
+                return path
+        except FileNotFoundError:
             continue
+    return None
 
-        if (
-            log["user_agent"]
-            == "Mozilla/4.0 (compatible; MSIE 8.0; Windows NT 5.1; Trident/4.0)"
-            or "Nessus" in log["user_agent"]
-            or "nessus" in log["user_agent"]
-        ):
-            continue
 
-        log["referer"] = log["referer"].removeprefix(
-            "http://partnertools.dev51-test-apps-gpstam.dev51.cbf.dev.paypalinc.com:8000"
-        )
-        log["date_time"] = format_timestamp(log["date_time"])
-        logs_as_dicts.append(log)
+def load_logs(con, log_file, chunk_size=10_000, processes=1):
+    """Ingest the lines appended to `log_file` since the last run.
 
+    If the log has been rotated since then, the rest of the rotated file (if it
+    can still be found) is ingested first, followed by the new file from the start.
+    With `processes` > 1, lines are parsed on that many processes.
+    """
     create_table(con)
-    insert_logs_into_table(con, logs_as_dicts)
+    state_key = os.path.abspath(log_file)
+    stat = os.stat(log_file)
+
+    row = con.execute(
+        "SELECT inode, offset FROM ingest_state WHERE log_file = ?", (state_key,)
+    ).fetchone()
+    if row is None:
+        offset = 0
+    else:
+        inode, offset = row
+        if inode != stat.st_ino:
+            rotated_log_file = find_rotated_log_file(log_file, inode)
+            if rotated_log_file is not None:
+                ingest_file(
+                    con,
+                    rotated_log_file,
+                    state_key,
+                    offset,
+                    inode,
+                    chunk_size,
+                    processes,
+                )
+            offset = 0
+        elif stat.st_size < offset:
+            # The file was truncated in place.
+            offset = 0
+
+    ingest_file(con, log_file, state_key, offset, stat.st_ino, chunk_size, processes)
+    update_percentiles(con)
 
 
 if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        log_file = sys.argv[1]
-    else:
-        log_file = "access_log.log"
+    parser = argparse.ArgumentParser(
+        description="Ingest and inspect Alice's access log."
+    )
+    parser.add_argument("log_file", nargs="?", default="access_log.log")
+    parser.add_argument("db_file", nargs="?", default="access_log.db")
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="the number of processes to parse the log with (0 for one per core)",
+    )
+    args = parser.parse_args()
 
-    # db_file = "access_log.db"
-    db_file = ":memory:"
-    con = sqlite3.connect(db_file)
+    con = sqlite3.connect(args.db_file)
 
-    load_logs(con, log_file)
+    load_logs(con, args.log_file, processes=args.jobs or os.cpu_count())
     # list_data(con)
     # inspect_data_by_user_agent(con)
     inspect_data_by_date(con)
     # inspect_data_by_time(con)
+    # inspect_latency_by_route(con)
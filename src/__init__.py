@@ -8,9 +8,14 @@ def create_app():
 
     os.makedirs(app.instance_path, exist_ok=True)
 
-    from . import api, routes
+    from . import api, assets, metrics, routes
+
+    app.json = api.utils.JSONProvider(app)
+    assets.init_app(app)
+    metrics.init_app(app)
 
     app.register_blueprint(api.bp)
+    app.cli.add_command(api.replay.stand_in_command)
     app.register_blueprint(routes.bp)
 
     return app
@@ -6,9 +6,12 @@ from . import (
     authorizations,
     billing_agreements,
     captures,
+    flows,
     identity,
+    monitor,
     orders,
     partner,
+    statuses,
     vault,
     webhooks,
 )
@@ -16,8 +19,11 @@ from . import (
 bp.register_blueprint(authorizations.bp)
 bp.register_blueprint(billing_agreements.bp)
 bp.register_blueprint(captures.bp)
+bp.register_blueprint(flows.bp)
 bp.register_blueprint(identity.bp)
+bp.register_blueprint(monitor.bp)
 bp.register_blueprint(orders.bp)
 bp.register_blueprint(partner.bp)
+bp.register_blueprint(statuses.bp)
 bp.register_blueprint(vault.bp)
 bp.register_blueprint(webhooks.bp)
@@ -1,8 +1,8 @@
 import json
-import requests
 
 from flask import Blueprint, request, current_app, jsonify
 
+from . import upstream
 from .identity import build_headers
 from .utils import build_endpoint, format_request_and_response
 
@@ -61,7 +61,7 @@ class Authorization:
             return {"formatted": self.formatted}
 
         endpoint = build_endpoint(f"/v2/payments/authorizations/{self.auth_id}")
-        response = requests.get(endpoint, headers=headers)
+        response = upstream.get(endpoint, headers=headers)
 
         self.formatted["get-auth"] = format_request_and_response(response)
 
@@ -69,6 +69,14 @@ class Authorization:
             "formatted": self.formatted,
             "authHeader": self.auth_header,
         }
+        try:
+            status = response.json()["status"]
+        except Exception as exc:
+            current_app.logger.error(
+                f"Encountered exception unpacking authorization status: {exc}"
+            )
+        else:
+            return_val["authStatus"] = status
         return return_val
 
 
@@ -1,6 +1,5 @@
-import requests
-
 from flask import Blueprint, current_app, jsonify, request
+from . import upstream
 from .utils import build_endpoint, format_request_and_response
 from .identity import build_headers
 
@@ -30,7 +29,7 @@ def get_ba_status(baid):
     )
     formatted = headers.pop("formatted")
 
-    status_response = requests.get(endpoint, headers=headers)
+    status_response = upstream.get(endpoint, headers=headers)
     formatted["ba-status"] = format_request_and_response(status_response)
 
     return_val = {"formatted": formatted}
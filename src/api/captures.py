@@ -1,8 +1,8 @@
 import json
-import requests
 
 from flask import Blueprint, request, current_app, jsonify
 
+from . import upstream
 from .identity import build_headers
 from .utils import build_endpoint, format_request_and_response
 
@@ -61,7 +61,7 @@ class Capture:
             return {"formatted": self.formatted}
 
         endpoint = build_endpoint(f"/v2/payments/captures/{self.capture_id}")
-        response = requests.get(endpoint, headers=headers)
+        response = upstream.get(endpoint, headers=headers)
 
         self.formatted["get-capture"] = format_request_and_response(response)
 
@@ -69,6 +69,14 @@ class Capture:
             "formatted": self.formatted,
             "authHeader": self.auth_header,
         }
+        try:
+            status = response.json()["status"]
+        except Exception as exc:
+            current_app.logger.error(
+                f"Encountered exception unpacking capture status: {exc}"
+            )
+        else:
+            return_val["captureStatus"] = status
         return return_val
 
     def refund(self):
@@ -80,7 +88,7 @@ class Capture:
             return {"formatted": self.formatted}
 
         endpoint = build_endpoint(f"/v2/payments/captures/{self.capture_id}/refund")
-        response = requests.post(endpoint, headers=headers)
+        response = upstream.post(endpoint, headers=headers)
 
         self.formatted["refund-capture"] = format_request_and_response(response)
 
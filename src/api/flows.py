@@ -0,0 +1,175 @@
+import time
+
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    request,
+    stream_with_context,
+)
+
+from .authorizations import Authorization
+from .captures import Capture
+from .orders import Order
+from .partner import Referral
+from .utils import (
+    map_concurrently,
+    parse_concurrency,
+    parse_positive_int,
+    to_ndjson_line,
+)
+from .vault import Vault
+
+bp = Blueprint("flows", __name__, url_prefix="/flows")
+
+
+def create_order(options):
+    return Order(**options).create()
+
+
+def authorize_order(options):
+    return Order(**options).authorize()
+
+
+def capture_order(options):
+    return Order(**options).capture()
+
+
+def get_order(options):
+    return Order(**options).get_details()
+
+
+def get_authorization(options):
+    return Authorization(**({"include-auth-assertion": ""} | options)).get_details()
+
+
+def get_capture(options):
+    return Capture(**({"include-auth-assertion": ""} | options)).get_details()
+
+
+def refund_capture(options):
+    return Capture(**({"include-auth-assertion": ""} | options)).refund()
+
+
+def get_payment_token(options):
+    return Vault(**options).get_payment_token_status()
+
+
+def get_seller(options):
+    return Referral(**options).seller_status()
+
+
+def get_referral(options):
+    return Referral(**options).referral_status()
+
+
+ACTIONS = {
+    "create-order": create_order,
+    "authorize-order": authorize_order,
+    "capture-order": capture_order,
+    "get-order": get_order,
+    "get-authorization": get_authorization,
+    "get-capture": get_capture,
+    "refund-capture": refund_capture,
+    "get-payment-token": get_payment_token,
+    "get-seller": get_seller,
+    "get-referral": get_referral,
+}
+
+# Values extracted from each step's response and passed as options to later steps.
+EXTRACTED_OPTIONS = {
+    "authHeader": "auth-header",
+    "orderId": "order-id",
+    "authId": "auth-id",
+    "captureId": "capture-id",
+}
+
+
+def is_step(step):
+    """Return whether `step` is an action name or a dict with an "action" and "options"."""
+    if isinstance(step, str):
+        return True
+    return (
+        isinstance(step, dict)
+        and isinstance(step.get("action"), str)
+        and isinstance(step.get("options", {}), dict)
+    )
+
+
+def run_flow(steps, options):
+    """Run the steps back-to-back, threading IDs from each response into the next step.
+
+    Each step is an action name or a dict with an "action" and step-specific "options".
+    The flow stops at the first step that raises or whose action is unknown.
+    """
+    options = dict(options)
+    results = []
+    for step in steps:
+        if isinstance(step, str):
+            step = {"action": step}
+
+        action = step["action"]
+        result = {"action": action}
+        results.append(result)
+        try:
+            func = ACTIONS[action]
+        except KeyError:
+            result["error"] = f"Unknown action: {action}"
+            break
+
+        start = time.perf_counter()
+        try:
+            resp = func(options | step.get("options", {}))
+        except Exception as exc:
+            current_app.logger.error(
+                f"Encountered exception in flow step {action}: {exc}"
+            )
+            result["error"] = repr(exc)
+            break
+        finally:
+            result["latencySeconds"] = round(time.perf_counter() - start, 6)
+
+        result |= resp
+        for key, option in EXTRACTED_OPTIONS.items():
+            if resp.get(key):
+                options[option] = resp[key]
+
+    return results
+
+
+@bp.route("/", methods=("POST",))
+def run_flows():
+    """Run a flow (e.g., create -> capture -> refund) one or more times, server-side.
+
+    The body holds the "steps" to run, the number of "iterations" and their
+    "concurrency", and the options shared by every step (partner credentials,
+    intent, etc.). Each iteration's per-step results are streamed as a line of NDJSON.
+    """
+    data = request.get_json()
+    steps = data.pop("steps", None)
+    if not isinstance(steps, list) or not steps or not all(map(is_step, steps)):
+        error = '"steps" must be a non-empty list of action names or steps'
+        return jsonify({"error": error}), 400
+    iterations = parse_positive_int(data.pop("iterations", 1))
+    if iterations is None:
+        return jsonify({"error": '"iterations" must be a positive integer'}), 400
+    concurrency = parse_concurrency(data, default=1)
+    data.pop("concurrency", None)
+    if concurrency is None:
+        return jsonify({"error": '"concurrency" must be a positive integer'}), 400
+
+    current_app.logger.info(f"Running {iterations} iteration(s) of flow {steps}")
+
+    def run(_):
+        return run_flow(steps, data)
+
+    def generate():
+        for index, future in map_concurrently(run, range(iterations), concurrency):
+            try:
+                results = future.result()
+            except Exception as exc:
+                results = [{"error": repr(exc)}]
+            yield to_ndjson_line({"iteration": index, "steps": results})
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
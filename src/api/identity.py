@@ -1,13 +1,14 @@
 import base64
 import json
-import requests
 
 from flask import Blueprint, current_app, jsonify, request
+from . import upstream
 from .utils import (
     build_endpoint,
     format_request_and_response,
     random_decimal_string,
 )
+from .token_cache import fingerprint, get_token_cache
 
 
 bp = Blueprint("identity", __name__, url_prefix="/identity")
@@ -17,10 +18,11 @@ bp = Blueprint("identity", __name__, url_prefix="/identity")
 def get_client_token():
     """Retrieve a client token using the GET /v1/identity/generate-token endpoint.
 
+    Client tokens aren't customer-specific, so they're reused across page loads
+    (see `get_cached_token`) unless `ignore-cache` is passed in the querystring.
+
     Docs: https://developer.paypal.com/docs/multiparty/checkout/advanced/integrate/#link-generateclienttoken
     """
-    endpoint = build_endpoint("/v1/identity/generate-token")
-
     data = request.get_json()
     auth_header = data.get("auth-header") or None
 
@@ -35,6 +37,25 @@ def get_client_token():
     if client_id == current_app.config["FASTLANE_MERCHANT_CLIENT_ID"]:
         secret = current_app.config["FASTLANE_MERCHANT_SECRET"]
 
+    cache_key = ":".join(
+        [
+            client_id,
+            data.get("merchant-id") or "",
+            fingerprint(client_id, secret, bn_code, auth_header),
+        ]
+    )
+    return_val = get_cached_token(
+        "client_tokens",
+        cache_key,
+        lambda: request_client_token(client_id, secret, bn_code, auth_header),
+    )
+    return jsonify(return_val)
+
+
+def request_client_token(client_id, secret, bn_code, auth_header=None):
+    """Request a client token, returning it with its lifetime ("expiresIn")."""
+    endpoint = build_endpoint("/v1/identity/generate-token")
+
     headers = build_headers(
         auth_header=auth_header,
         client_id=client_id,
@@ -50,23 +71,25 @@ def get_client_token():
         return_val["authHeader"] = auth_header
     except KeyError:
         return_val["formatted"] = formatted
-        return jsonify(return_val)
+        return return_val
 
-    response = requests.post(endpoint, headers=headers)
+    response = upstream.post(endpoint, headers=headers)
 
     formatted["client-token"] = format_request_and_response(response)
     return_val["formatted"] = formatted
 
     try:
-        client_token = response.json()["client_token"]
+        response_dict = response.json()
+        client_token = response_dict["client_token"]
     except Exception as exc:
         current_app.logger.error(
             f"Exception encountered when getting client_token: {exc}"
         )
     else:
         return_val["clientToken"] = client_token
+        return_val["expiresIn"] = response_dict.get("expires_in")
     finally:
-        return jsonify(return_val)
+        return return_val
 
 
 @bp.route("/seller-access-token/", methods=("POST",))
@@ -90,7 +113,7 @@ def get_seller_access_token():
         "ignoreCache": True,
     }
 
-    response = requests.post(
+    response = upstream.post(
         endpoint,
         headers=headers,
         data=payload,
@@ -124,7 +147,7 @@ def get_seller_credentials():
         "Authorization": f"Bearer {seller_access_token}",
     }
 
-    response = requests.get(
+    response = upstream.get(
         endpoint,
         headers=headers,
     )
@@ -174,7 +197,7 @@ def get_id_token(customer_id):
     if customer_id:
         data["target_customer_id"] = customer_id
 
-    response = requests.post(
+    response = upstream.post(
         endpoint,
         headers=headers,
         data=data,
@@ -200,10 +223,11 @@ def get_id_token(customer_id):
 
 @bp.route("/sdk-token", methods=("POST",))
 def get_sdk_token():
-    """Request an SDK token using the GET /v1/oauth2/token endpoint."""
-
-    endpoint = build_endpoint("/v1/oauth2/token")
+    """Request an SDK token using the GET /v1/oauth2/token endpoint.
 
+    SDK tokens aren't customer-specific, so they're reused across page loads
+    (see `get_cached_token`) unless `ignore-cache` is passed in the querystring.
+    """
     data = request.get_json()
 
     client_id = data["partner-client-id"]
@@ -216,6 +240,32 @@ def get_sdk_token():
         secret = current_app.config["FASTLANE_MERCHANT_SECRET"]
     merchant_id = data["merchant-id"]
 
+    # 'include-auth-assertion' is passed in a querystring,
+    # so we access with `request.args`.
+    include_auth_assertion = bool(request.args.get("include-auth-assertion"))
+
+    cache_key = ":".join(
+        [
+            client_id,
+            merchant_id,
+            str(include_auth_assertion),
+            fingerprint(client_id, secret),
+        ]
+    )
+    return_val = get_cached_token(
+        "sdk_tokens",
+        cache_key,
+        lambda: request_sdk_token(
+            client_id, secret, merchant_id, include_auth_assertion
+        ),
+    )
+    return jsonify(return_val)
+
+
+def request_sdk_token(client_id, secret, merchant_id, include_auth_assertion=False):
+    """Request an SDK token, returning it with its lifetime ("expiresIn")."""
+    endpoint = build_endpoint("/v1/oauth2/token")
+
     data = {
         "grant_type": "client_credentials",
         # "response_type": "sdk_token", # FB: This is in the LR docs but throws an error!
@@ -227,13 +277,11 @@ def get_sdk_token():
     }
 
     headers = {}
-    if request.args.get("include-auth-assertion"):
-        # 'include-auth-assertion' is passed in a querystring,
-        # so we access with `request.args`.
+    if include_auth_assertion:
         auth_assertion = build_auth_assertion(client_id, merchant_id)
         headers["PayPal-Auth-Assertion"] = auth_assertion
 
-    response = requests.post(
+    response = upstream.post(
         endpoint,
         data=data,
         headers=headers,
@@ -250,11 +298,76 @@ def get_sdk_token():
         current_app.logger.error(f"Exception in get_sdk_token: {exc}")
     else:
         return_val["sdkToken"] = sdk_token
+        return_val["expiresIn"] = response_dict.get("expires_in")
     finally:
-        return jsonify(return_val)
+        return return_val
+
+
+def get_cached_token(name, cache_key, request_token):
+    """Return the result of `request_token`, reusing a cached one if possible.
+
+    `request_token` must return a route's return value, including the token's
+    lifetime as "expiresIn". Results are cached for at most `CLIENT_TOKEN_MAX_AGE`
+    seconds (and never past `ACCESS_TOKEN_REFRESH_MARGIN` seconds before the token
+    expires); a cached result is returned with an empty "formatted".
+    """
+    if not current_app.config["CLIENT_TOKEN_CACHE"] or request.args.get("ignore-cache"):
+        return_val = request_token()
+        return_val.pop("expiresIn", None)
+        return return_val
+
+    cache = get_token_cache(name)
+    formatted = {}
+
+    def refresh():
+        return_val = request_token()
+        formatted.update(return_val.pop("formatted"))
+        expires_in = return_val.pop("expiresIn", None)
+        if not expires_in:
+            # Without a token (e.g., on an error), the result isn't cached.
+            return return_val, 0
+
+        max_age = min(
+            float(expires_in) - current_app.config["ACCESS_TOKEN_REFRESH_MARGIN"],
+            current_app.config["CLIENT_TOKEN_MAX_AGE"],
+        )
+        return return_val, max(max_age, 0)
+
+    return {"formatted": formatted} | cache.get_or_refresh(cache_key, refresh)
 
 
 def get_access_token(client_id, secret):
+    """Return an access token for the given credentials, reusing a cached one if possible.
+
+    Tokens are cached per client ID and secret fingerprint until shortly before they
+    expire, so most calls don't make a request (and return an empty "formatted").
+    """
+    if not current_app.config["ACCESS_TOKEN_CACHE"]:
+        return request_access_token(client_id, secret)
+
+    cache = get_token_cache(
+        "access_tokens",
+        refresh_margin=current_app.config["ACCESS_TOKEN_REFRESH_MARGIN"],
+    )
+    cache_key = f"{client_id}:{fingerprint(client_id, secret)}"
+    formatted = {}
+
+    def refresh():
+        access_token_response = request_access_token(client_id, secret)
+        formatted.update(access_token_response["formatted"])
+        return (
+            access_token_response.get("access_token"),
+            access_token_response.get("expires_in"),
+        )
+
+    return_val = {"formatted": formatted}
+    access_token = cache.get_or_refresh(cache_key, refresh)
+    if access_token is not None:
+        return_val["access_token"] = access_token
+    return return_val
+
+
+def request_access_token(client_id, secret):
     """Request an access token using the /v1/oauth2/token API.
 
     Docs: https://developer.paypal.com/docs/api/reference/get-an-access-token/
@@ -269,7 +382,7 @@ def get_access_token(client_id, secret):
         "ignoreCache": True,
     }
 
-    response = requests.post(
+    response = upstream.post(
         endpoint,
         headers=headers,
         data=data,
@@ -280,11 +393,13 @@ def get_access_token(client_id, secret):
     return_val = {"formatted": formatted}
 
     try:
-        access_token = response.json()["access_token"]
+        response_dict = response.json()
+        access_token = response_dict["access_token"]
     except KeyError as exc:
         current_app.logger.error(f"Encountered a KeyError: {exc}")
     else:
         return_val["access_token"] = access_token
+        return_val["expires_in"] = response_dict.get("expires_in")
     finally:
         return return_val
 
@@ -0,0 +1,428 @@
+import json
+import os
+import threading
+import time
+
+from contextlib import closing
+from flask import Blueprint, current_app, jsonify, request
+
+from . import upstream
+from .partner import Referral, lookup_merchant_id
+from .utils import build_endpoint, connect_instance_db, map_concurrently
+
+bp = Blueprint("monitor", __name__, url_prefix="/monitor")
+
+DATABASE = "monitor.db"
+
+# Each seller's latest merchant integration is kept in `state`; past ones only as
+# the changes between them.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS monitored_sellers (
+    id INTEGER PRIMARY KEY,
+    partner_id TEXT NOT NULL,
+    merchant_id TEXT,
+    tracking_id TEXT,
+    added_at REAL NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    state TEXT,
+    checked_at REAL,
+    changed_at REAL,
+    next_check_at REAL NOT NULL DEFAULT 0,
+    interval REAL,
+    claimed_at REAL,
+    error TEXT,
+    UNIQUE (partner_id, merchant_id),
+    UNIQUE (partner_id, tracking_id)
+);
+CREATE INDEX IF NOT EXISTS monitored_sellers_next_check_at
+    ON monitored_sellers (partner_id, next_check_at);
+CREATE TABLE IF NOT EXISTS seller_changes (
+    seller_id INTEGER NOT NULL,
+    changed_at REAL NOT NULL,
+    changes TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS seller_changes_seller_id
+    ON seller_changes (seller_id, changed_at);
+"""
+
+# Sellers claimed by a worker that died mid-batch are polled again after this many seconds.
+CLAIM_TIMEOUT = 300
+
+_monitor_lock = threading.Lock()
+
+
+def connect():
+    return connect_instance_db(DATABASE, SCHEMA)
+
+
+def flatten(value, prefix=""):
+    """Return the leaves of a JSON value by path, e.g., {"products.0.name": "PPCP"}."""
+    if isinstance(value, dict):
+        items = value.items()
+    elif isinstance(value, list):
+        items = enumerate(value)
+    else:
+        return {prefix: value}
+
+    leaves = dict()
+    for key, child in items:
+        leaves |= flatten(child, f"{prefix}.{key}" if prefix else str(key))
+    return leaves
+
+
+def diff(old, new):
+    """Return the leaves that differ between two JSON values, as {path: [old, new]}."""
+    old, new = flatten(old or {}), flatten(new or {})
+    return {
+        path: [old.get(path), new.get(path)]
+        for path in sorted(old.keys() | new.keys())
+        if old.get(path) != new.get(path)
+    }
+
+
+def next_interval(interval, status, changed):
+    """Return the seconds until the seller's next poll.
+
+    Onboarded sellers are polled rarely, and others less often the longer they go
+    without changing.
+    """
+    if status == "onboarded":
+        return current_app.config["SELLER_MONITOR_ONBOARDED_INTERVAL"]
+    if changed or not interval:
+        return current_app.config["SELLER_MONITOR_MIN_INTERVAL"]
+    return min(interval * 2, current_app.config["SELLER_MONITOR_MAX_INTERVAL"])
+
+
+def get_partner_options():
+    """Return the options of the configured partner, whose sellers are monitored."""
+    return {
+        "partner-id": current_app.config["PARTNER_ID"],
+        "partner-client-id": current_app.config["PARTNER_CLIENT_ID"],
+        "partner-secret": current_app.config["PARTNER_SECRET"],
+        "partner-bn-code": current_app.config["PARTNER_BN_CODE"],
+    }
+
+
+def poll_seller(seller, options):
+    """Return the seller's merchant ID and merchant integration.
+
+    Both are None if the seller was added by tracking ID and hasn't onboarded yet.
+
+    Docs: https://developer.paypal.com/docs/api/partner-referrals/v1/#merchant-integration_status
+    """
+    referral = Referral(
+        **options,
+        **{"merchant-id": seller["merchant_id"], "tracking-id": seller["tracking_id"]},
+    )
+    try:
+        referral.resolve_merchant_id()
+    except KeyError:
+        return None, None
+
+    endpoint = build_endpoint(
+        f"/v1/customer/partners/{referral.partner_id}/merchant-integrations/{referral.merchant_id}"
+    )
+    response = upstream.get(endpoint, headers=referral.build_headers())
+    response.raise_for_status()
+    return referral.merchant_id, response.json()
+
+
+class SellerMonitor:
+    """A background thread that polls the monitored sellers as they come due.
+
+    Every gunicorn worker runs a monitor; a batch of due sellers is claimed in a
+    single transaction, so each seller is polled by one worker at a time. A batch is
+    polled concurrently (up to `BATCH_MAX_CONCURRENCY` at once) with one access token.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wakeup = threading.Event()
+        self.thread = threading.Thread(
+            target=self.run, name="seller-monitor", daemon=True
+        )
+        self.thread.start()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def run(self):
+        with self.app.app_context():
+            while True:
+                try:
+                    batch = self.claim_batch()
+                except Exception as exc:
+                    current_app.logger.error(f"Failed to claim sellers: {exc}")
+                    batch = []
+
+                if not batch:
+                    self.wakeup.wait(current_app.config["SELLER_MONITOR_POLL_INTERVAL"])
+                    self.wakeup.clear()
+                    continue
+
+                try:
+                    self.poll_batch(batch)
+                except Exception as exc:
+                    current_app.logger.error(f"Failed to poll sellers: {exc}")
+
+    def claim_batch(self):
+        """Mark a batch of the partner's due sellers as being polled, and return them."""
+        now = time.time()
+        with closing(connect()) as con:
+            con.execute("BEGIN IMMEDIATE")
+            rows = con.execute(
+                """
+                SELECT * FROM monitored_sellers
+                WHERE partner_id = ? AND next_check_at <= ?
+                    AND (claimed_at IS NULL OR claimed_at < ?)
+                ORDER BY next_check_at
+                LIMIT ?
+                """,
+                (
+                    current_app.config["PARTNER_ID"],
+                    now,
+                    now - CLAIM_TIMEOUT,
+                    current_app.config["SELLER_MONITOR_BATCH_SIZE"],
+                ),
+            ).fetchall()
+            con.executemany(
+                "UPDATE monitored_sellers SET claimed_at = ? WHERE id = ?",
+                [(now, row["id"]) for row in rows],
+            )
+            con.execute("COMMIT")
+        return rows
+
+    def poll_batch(self, batch):
+        options = get_partner_options()
+        try:
+            options["auth-header"] = Referral(**options).build_headers()[
+                "Authorization"
+            ]
+        except Exception as exc:
+            current_app.logger.error(
+                f"Failed to get an access token for sellers: {exc}"
+            )
+
+        def poll(seller):
+            return poll_seller(seller, options)
+
+        results = []
+        for index, future in map_concurrently(
+            poll, batch, current_app.config["BATCH_MAX_CONCURRENCY"]
+        ):
+            seller = batch[index]
+            try:
+                merchant_id, integration = future.result()
+            except Exception as exc:
+                current_app.logger.error(
+                    f"Failed to poll seller {seller['merchant_id'] or seller['tracking_id']}: {exc}"
+                )
+                results.append((seller, seller["merchant_id"], None, repr(exc)))
+            else:
+                results.append((seller, merchant_id, integration, None))
+
+        self.save_results(results)
+
+    def save_results(self, results):
+        """Update each seller's state, recording what changed since the last poll."""
+        now = time.time()
+        with closing(connect()) as con:
+            con.execute("BEGIN IMMEDIATE")
+            for seller, merchant_id, integration, error in results:
+                state = seller["state"]
+                status = seller["status"]
+                changes = None
+                if integration is not None:
+                    changes = diff(state and json.loads(state), integration)
+                    state = json.dumps(integration)
+                    if integration.get("payments_receivable"):
+                        status = "onboarded"
+                    else:
+                        status = "pending"
+                if changes:
+                    con.execute(
+                        "INSERT INTO seller_changes VALUES (?, ?, ?)",
+                        (seller["id"], now, json.dumps(changes)),
+                    )
+
+                if merchant_id and not seller["merchant_id"]:
+                    # The seller may have been added by merchant ID too.
+                    self.merge_duplicate(con, seller, merchant_id)
+
+                interval = next_interval(seller["interval"], status, bool(changes))
+                con.execute(
+                    """
+                    UPDATE monitored_sellers
+                    SET merchant_id = ?, status = ?, state = ?, checked_at = ?,
+                        changed_at = ?, next_check_at = ?, interval = ?,
+                        claimed_at = NULL, error = ?
+                    WHERE id = ?
+                    """,
+                    (
+                        merchant_id,
+                        status,
+                        state,
+                        now,
+                        now if changes else seller["changed_at"],
+                        now + interval,
+                        interval,
+                        error,
+                        seller["id"],
+                    ),
+                )
+            con.execute("COMMIT")
+
+    def merge_duplicate(self, con, seller, merchant_id):
+        """Fold the seller monitored by `merchant_id` (if any) into `seller`."""
+        duplicate = con.execute(
+            "SELECT id FROM monitored_sellers WHERE partner_id = ? AND merchant_id = ?",
+            (seller["partner_id"], merchant_id),
+        ).fetchone()
+        if duplicate is None:
+            return
+        con.execute(
+            "UPDATE seller_changes SET seller_id = ? WHERE seller_id = ?",
+            (seller["id"], duplicate["id"]),
+        )
+        con.execute("DELETE FROM monitored_sellers WHERE id = ?", (duplicate["id"],))
+
+
+def get_seller_monitor():
+    """Return this worker's seller monitor, starting its thread (e.g., after a fork)."""
+    extension = current_app.extensions.setdefault("alice_monitor", dict())
+    pid = os.getpid()
+    with _monitor_lock:
+        if extension.get("pid") != pid:
+            extension["monitor"] = SellerMonitor(current_app._get_current_object())
+            extension["pid"] = pid
+    return extension["monitor"]
+
+
+@bp.route("/sellers", methods=("POST",))
+def add_sellers():
+    """Start monitoring the sellers with the given "merchant-ids" and/or "tracking-ids".
+
+    Sellers are polled as the configured partner (`PARTNER_ID`). Sellers that are
+    already monitored are left as they are.
+    """
+    partner_id = current_app.config["PARTNER_ID"]
+    if partner_id is None:
+        return jsonify({"error": "No PARTNER_ID configured"}), 400
+
+    data = request.get_json()
+    now = time.time()
+    rows = [
+        (partner_id, merchant_id, None, now)
+        for merchant_id in data.get("merchant-ids", [])
+    ]
+    for tracking_id in data.get("tracking-ids", []):
+        merchant_id = lookup_merchant_id(partner_id, tracking_id)
+        rows.append((partner_id, merchant_id, tracking_id, now))
+
+    with closing(connect()) as con:
+        con.execute("BEGIN IMMEDIATE")
+        total_changes = con.total_changes
+        con.executemany(
+            """
+            INSERT OR IGNORE INTO monitored_sellers
+                (partner_id, merchant_id, tracking_id, added_at)
+            VALUES (?, ?, ?, ?)
+            """,
+            rows,
+        )
+        added = con.total_changes - total_changes
+        con.execute("COMMIT")
+
+    get_seller_monitor().notify()
+    return jsonify({"added": added}), 202
+
+
+@bp.route("/sellers", methods=("GET",))
+def list_sellers():
+    """Return the current state of every monitored seller, oldest first.
+
+    Filter with the `status` (pending, onboarded) querystring parameter.
+    """
+    query = "SELECT * FROM monitored_sellers WHERE partner_id = ?"
+    params = [current_app.config["PARTNER_ID"]]
+    if status := request.args.get("status"):
+        query += " AND status = ?"
+        params.append(status)
+    query += " ORDER BY added_at, id"
+
+    with closing(connect()) as con:
+        rows = con.execute(query, params).fetchall()
+
+    # Resume polling after a restart, even if no sellers are added.
+    get_seller_monitor()
+    return jsonify({"sellers": [to_seller_dict(row) for row in rows]})
+
+
+def find_seller(con, seller_id):
+    """Return the monitored seller with the given merchant or tracking ID."""
+    return con.execute(
+        """
+        SELECT * FROM monitored_sellers
+        WHERE partner_id = ? AND (merchant_id = ? OR tracking_id = ?)
+        """,
+        (current_app.config["PARTNER_ID"], seller_id, seller_id),
+    ).fetchone()
+
+
+@bp.route("/sellers/<seller_id>", methods=("GET",))
+def get_seller(seller_id):
+    """Return the seller's current state and its changes, oldest first."""
+    with closing(connect()) as con:
+        row = find_seller(con, seller_id)
+        if row is None:
+            return jsonify({"error": f"No monitored seller {seller_id}"}), 404
+        changes = con.execute(
+            """
+            SELECT changed_at, changes FROM seller_changes
+            WHERE seller_id = ? ORDER BY changed_at
+            """,
+            (row["id"],),
+        ).fetchall()
+
+    return jsonify(
+        to_seller_dict(row)
+        | {
+            "changes": [
+                {
+                    "changedAt": change["changed_at"],
+                    "changes": json.loads(change["changes"]),
+                }
+                for change in changes
+            ]
+        }
+    )
+
+
+@bp.route("/sellers/<seller_id>", methods=("DELETE",))
+def remove_seller(seller_id):
+    """Stop monitoring the seller, forgetting its changes."""
+    with closing(connect()) as con:
+        con.execute("BEGIN IMMEDIATE")
+        row = find_seller(con, seller_id)
+        if row is not None:
+            con.execute("DELETE FROM seller_changes WHERE seller_id = ?", (row["id"],))
+            con.execute("DELETE FROM monitored_sellers WHERE id = ?", (row["id"],))
+        con.execute("COMMIT")
+
+    if row is None:
+        return jsonify({"error": f"No monitored seller {seller_id}"}), 404
+    return jsonify({"deleted": True})
+
+
+def to_seller_dict(row):
+    return {
+        "merchantId": row["merchant_id"],
+        "trackingId": row["tracking_id"],
+        "status": row["status"],
+        "addedAt": row["added_at"],
+        "checkedAt": row["checked_at"],
+        "changedAt": row["changed_at"],
+        "nextCheckAt": row["next_check_at"],
+        "error": row["error"],
+        "integration": row["state"] and json.loads(row["state"]),
+    }
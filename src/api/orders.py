@@ -1,11 +1,25 @@
+import itertools
 import json
-import requests
 
-from flask import Blueprint, request, current_app, jsonify
+from flask import (
+    Blueprint,
+    Response,
+    request,
+    current_app,
+    jsonify,
+    stream_with_context,
+)
 
+from . import upstream
 from .identity import build_headers
-from .utils import build_endpoint, format_request_and_response
-
+from .utils import (
+    build_endpoint,
+    format_request_and_response,
+    map_concurrently,
+    parse_positive_int,
+    prepare_batch,
+    to_ndjson_line,
+)
 
 bp = Blueprint("orders", __name__, url_prefix="/orders")
 
@@ -23,11 +37,17 @@ def default_shipping_address():
     }
 
 
+# Purchase unit templates, keyed by `Order.purchase_unit_template_key`.
+purchase_unit_templates = dict()
+PURCHASE_UNIT_TEMPLATE_CACHE_SIZE = 1024
+
+
 class Order:
     def __init__(self, **kwargs):
         self._set_partner_config(kwargs)
         self.order_id = kwargs.get("order-id") or None  # Coerce to None if empty
         self.auth_id = kwargs.get("auth-id")
+        self.capture_id = None
 
         self.auth_header = kwargs.get("auth-header")
         self.payment_source_type = kwargs.get("payment-source", None)
@@ -192,12 +212,11 @@ class Order:
         if self.include_shipping_options:
             shipping_options = [self.build_shipping_option()]
             shipping["options"] = shipping_options
-            self.breakdown["shipping"] = self.to_amount_dict(self.shipping_cost)
 
         return shipping
 
-    def build_line_item(self):
-        """Return the line item object for the order.
+    def build_line_item_template(self):
+        """Return the line item object for the order, without its amounts.
 
         Docs: https://developer.paypal.com/docs/api/orders/v2/#definition-item
         """
@@ -214,17 +233,24 @@ class Order:
             case _:
                 raise ValueError
 
-        unit_amount = self.to_amount_dict(self.item_price)
         item = {
             "name": name,
             "quantity": 1,
-            "unit_amount": unit_amount,
         }
-        self.breakdown["item_total"] = unit_amount
-
         if self.item_category is not None:
             item["category"] = self.item_category
 
+        return item
+
+    def build_line_item(self, item_template):
+        """Return the line item object for the order, recording its amounts in the breakdown.
+
+        Docs: https://developer.paypal.com/docs/api/orders/v2/#definition-item
+        """
+        unit_amount = self.to_amount_dict(self.item_price)
+        item = item_template | {"unit_amount": unit_amount}
+        self.breakdown["item_total"] = unit_amount
+
         if self.item_tax:
             tax_amount = self.to_amount_dict(self.item_tax)
             item["tax"] = tax_amount
@@ -232,8 +258,29 @@ class Order:
 
         return item
 
-    def build_purchase_unit(self):
-        """Return the purchase unit object for the order.
+    def purchase_unit_template_key(self):
+        """Return the options that the purchase unit template depends on."""
+        return (
+            self.include_payee,
+            self.merchant_id,
+            self.reference_id,
+            self.custom_id,
+            self.soft_descriptor,
+            self.include_custom_purchase_unit_field,
+            self.custom_purchase_unit_key,
+            self.custom_purchase_unit_value,
+            self.intent,
+            self.disbursement_mode,
+            self.partner_fee,
+            self.partner_id,
+            self.currency_code,
+            self.include_shipping_address,
+            self.include_shipping_options,
+            self.item_category,
+        )
+
+    def build_purchase_unit_template(self):
+        """Return the purchase unit object for the order and its line item, without their amounts.
 
         Docs: https://developer.paypal.com/docs/api/orders/v2/#definition-purchase_unit
         """
@@ -279,7 +326,31 @@ class Order:
         if shipping:
             purchase_unit["shipping"] = shipping
 
-        purchase_unit["items"] = [self.build_line_item()]
+        return purchase_unit, self.build_line_item_template()
+
+    def build_purchase_unit(self):
+        """Return the purchase unit object for the order.
+
+        The parts that don't depend on the amounts are compiled once per set of
+        options and shared between orders, so they must not be mutated.
+
+        Docs: https://developer.paypal.com/docs/api/orders/v2/#definition-purchase_unit
+        """
+        key = self.purchase_unit_template_key()
+        try:
+            purchase_unit_template, item_template = purchase_unit_templates[key]
+        except KeyError:
+            template = self.build_purchase_unit_template()
+            if len(purchase_unit_templates) >= PURCHASE_UNIT_TEMPLATE_CACHE_SIZE:
+                purchase_unit_templates.clear()
+            purchase_unit_templates[key] = template
+            purchase_unit_template, item_template = template
+
+        purchase_unit = dict(purchase_unit_template)
+        if self.include_shipping_options:
+            self.breakdown["shipping"] = self.to_amount_dict(self.shipping_cost)
+
+        purchase_unit["items"] = [self.build_line_item(item_template)]
         total_price = round(
             sum(float(cost["value"]) for cost in self.breakdown.values()), 2
         )
@@ -458,7 +529,7 @@ class Order:
         if payment_source:
             data["payment_source"] = payment_source
 
-        response = requests.post(
+        response = upstream.post(
             endpoint,
             headers=headers,
             json=data,
@@ -539,7 +610,7 @@ class Order:
         if payment_instruction:
             data["payment_instruction"] = payment_instruction
 
-        response = requests.post(endpoint, headers=headers, json=data)
+        response = upstream.post(endpoint, headers=headers, json=data)
         self.formatted["capture-order"] = format_request_and_response(response)
         return_val = {
             "formatted": self.formatted,
@@ -553,16 +624,32 @@ class Order:
             )
         else:
             try:
-                capture_status = response_dict["purchase_units"][0]["payments"][
-                    "captures"
-                ][0]["status"]
+                capture = response_dict["purchase_units"][0]["payments"]["captures"][0]
+                capture_status = capture["status"]
             except (KeyError, IndexError) as exc:
                 capture_status = None
+            else:
+                return_val["captureId"] = capture["id"]
             finally:
                 return_val["captureStatus"] = capture_status
         finally:
             return return_val
 
+    def authorize(self):
+        """Authorize the order without capturing it (see `auth_and_capture`)."""
+        if not self.order_id:
+            raise ValueError
+
+        self._authorize()
+
+        return_val = {
+            "formatted": self.formatted,
+            "authHeader": self.auth_header,
+        }
+        if self.auth_id is not None:
+            return_val["authId"] = self.auth_id
+        return return_val
+
     def _authorize(self):
         """Authorize the order using the POST /v2/checkout/orders/{order_id}/authorize endpoint.
 
@@ -587,7 +674,7 @@ class Order:
         if payment_source:
             data["payment_source"] = payment_source
 
-        response = requests.post(endpoint, headers=headers, json=data)
+        response = upstream.post(endpoint, headers=headers, json=data)
         self.formatted["authorize-order"] = format_request_and_response(response)
 
         try:
@@ -616,7 +703,7 @@ class Order:
         if payment_instruction:
             data["payment_instruction"] = payment_instruction
 
-        response = requests.post(endpoint, headers=headers, json=data)
+        response = upstream.post(endpoint, headers=headers, json=data)
         self.formatted["capture-authorization"] = format_request_and_response(response)
 
         try:
@@ -627,13 +714,14 @@ class Order:
             )
             return
 
+        # This endpoint returns the capture itself rather than the order.
         try:
-            capture_status = response_dict["purchase_units"][0]["payments"]["captures"][
-                0
-            ]["status"]
-        except (KeyError, IndexError) as exc:
+            capture_id = response_dict["id"]
+            capture_status = response_dict["status"]
+        except KeyError as exc:
             return
 
+        self.capture_id = capture_id
         return capture_status
 
     def auth_and_capture(self):
@@ -643,8 +731,10 @@ class Order:
 
         return_val = dict()
         if self.auth_id is not None:
+            return_val["authId"] = self.auth_id
             capture_status = self._capture_authorization()
             if capture_status is not None:
+                return_val["captureId"] = self.capture_id
                 return_val["captureStatus"] = capture_status
 
         return_val |= {
@@ -669,13 +759,21 @@ class Order:
 
         endpoint = build_endpoint(f"/v2/checkout/orders/{self.order_id}")
 
-        response = requests.get(endpoint, headers=headers)
+        response = upstream.get(endpoint, headers=headers)
         self.formatted["order-details"] = format_request_and_response(response)
 
         return_val = {
             "formatted": self.formatted,
             "authHeader": self.auth_header,
         }
+        try:
+            status = response.json()["status"]
+        except Exception as exc:
+            current_app.logger.error(
+                f"Encountered exception unpacking order status: {exc}"
+            )
+        else:
+            return_val["orderStatus"] = status
         return return_val
 
 
@@ -702,6 +800,85 @@ def create_order():
     return jsonify(resp)
 
 
+def expand_order_options(data):
+    """Yield the options for each order described by a batch request.
+
+    Either `data["orders"]` lists per-order options, or each combination of the
+    values in `data["matrix"]` is repeated `data["count"]` times. In both cases,
+    the remaining top-level options are shared by every order.
+    """
+    shared_options = {
+        key: value
+        for key, value in data.items()
+        if key not in ("orders", "matrix", "count", "concurrency")
+    }
+
+    if "orders" in data:
+        for order_options in data["orders"]:
+            yield shared_options | order_options
+        return
+
+    matrix = data.get("matrix", {})
+    keys = list(matrix)
+    for values in itertools.product(*(matrix[key] for key in keys)):
+        order_options = shared_options | dict(zip(keys, values))
+        for _ in range(int(data.get("count", 1))):
+            yield order_options
+
+
+def validate_order_options(data):
+    """Return why a batch request's orders can't be expanded, or None if they can."""
+    if "orders" in data:
+        orders = data["orders"]
+        if not isinstance(orders, list) or not all(
+            isinstance(order_options, dict) for order_options in orders
+        ):
+            return '"orders" must be a list of objects'
+        return None
+
+    if parse_positive_int(data.get("count", 1)) is None:
+        return '"count" must be a positive integer'
+    matrix = data.get("matrix", {})
+    if not isinstance(matrix, dict) or not all(
+        isinstance(values, list) for values in matrix.values()
+    ):
+        return '"matrix" must map options to lists of values'
+    return None
+
+
+@bp.route("/batch", methods=("POST",))
+def create_orders():
+    """Create many orders concurrently, streaming each result as a line of NDJSON.
+
+    Wrapper for Order.create. See `expand_order_options` for the request format.
+    """
+    data = request.get_json()
+    if error := validate_order_options(data):
+        return jsonify({"error": error}), 400
+    current_app.logger.info(
+        f"Creating a batch of orders with options {sorted(data.get('matrix', {}))}"
+    )
+
+    concurrency, error_response = prepare_batch(Order(**data), data)
+    if error_response is not None:
+        return error_response
+
+    def create(order_options):
+        return Order(**order_options).create()
+
+    def generate():
+        results = map_concurrently(create, expand_order_options(data), concurrency)
+        for index, future in results:
+            try:
+                resp = future.result()
+            except Exception as exc:
+                current_app.logger.error(f"Encountered exception creating order: {exc}")
+                resp = {"error": str(exc)}
+            yield to_ndjson_line({"index": index} | resp)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @bp.route("/<order_id>/capture", methods=("POST",))
 def capture_order(order_id):
     """Capture the order with the given ID.
@@ -1,11 +1,14 @@
 import json
-import requests
+import time
 
+from contextlib import closing
 from flask import Blueprint, request, current_app, jsonify
 
+from . import upstream
 from .identity import build_headers
 from .utils import (
     build_endpoint,
+    connect_instance_db,
     format_request_and_response,
     random_alphanumeric_string,
 )
@@ -13,6 +16,48 @@ from .utils import (
 
 bp = Blueprint("partner", __name__, url_prefix="/partner")
 
+DATABASE = "partner.db"
+
+# Tracking IDs are recorded when a referral is created, and their merchant IDs
+# once they're known (i.e., once the seller has onboarded), since those never change.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS tracked_sellers (
+    partner_id TEXT NOT NULL,
+    tracking_id TEXT NOT NULL,
+    merchant_id TEXT,
+    referred_at REAL,
+    indexed_at REAL NOT NULL,
+    PRIMARY KEY (partner_id, tracking_id)
+);
+"""
+
+
+def lookup_merchant_id(partner_id, tracking_id):
+    """Return the merchant ID indexed for the partner's tracking ID, if any."""
+    with closing(connect_instance_db(DATABASE, SCHEMA)) as con:
+        row = con.execute(
+            "SELECT merchant_id FROM tracked_sellers"
+            " WHERE partner_id = ? AND tracking_id = ?",
+            (partner_id, tracking_id),
+        ).fetchone()
+    return row and row["merchant_id"]
+
+
+def index_tracking_id(partner_id, tracking_id, merchant_id=None, referred=False):
+    """Record the partner's tracking ID and, if known, the seller's merchant ID."""
+    now = time.time()
+    with closing(connect_instance_db(DATABASE, SCHEMA)) as con:
+        con.execute(
+            """
+            INSERT INTO tracked_sellers VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (partner_id, tracking_id) DO UPDATE SET
+                merchant_id = COALESCE(excluded.merchant_id, merchant_id),
+                referred_at = COALESCE(excluded.referred_at, referred_at),
+                indexed_at = excluded.indexed_at
+            """,
+            (partner_id, tracking_id, merchant_id, now if referred else None, now),
+        )
+
 
 def extract_action_url(links):
     for link in links:
@@ -209,12 +254,14 @@ class Referral:
         if self.tracking_id:
             data["tracking_id"] = self.tracking_id
 
-        response = requests.post(
+        response = upstream.post(
             endpoint,
             headers=headers,
             json=data,
         )
         self.formatted["create-referral"] = format_request_and_response(response)
+        if response.ok and self.tracking_id and self.partner_id:
+            index_tracking_id(self.partner_id, self.tracking_id, referred=True)
         return_val = {
             "formatted": self.formatted,
             "authHeader": self.auth_header,
@@ -249,26 +296,37 @@ class Referral:
         except KeyError:
             return {"formatted": self.formatted}
 
-        resp = requests.get(endpoint, headers=headers)
+        resp = upstream.get(endpoint, headers=headers)
         self.formatted["get-merchant-id"] = format_request_and_response(resp)
 
         merchant_id = resp.json()["merchant_id"]
         return merchant_id
 
-    def seller_status(self):
-        if self.partner_id is None:
-            raise ValueError
+    def resolve_merchant_id(self):
+        """Return the seller's merchant ID, finding it from the tracking ID if needed.
 
+        The tracking ID is looked up in the index first, and only then asked of
+        PayPal, indexing the answer. Raises KeyError if the seller hasn't onboarded.
+        """
         if self.merchant_id is None:
             if self.tracking_id is None:
                 raise ValueError
-            try:
-                self.merchant_id = self.get_merchant_id()
-            except KeyError as exc:
-                current_app.logger.error(
-                    f"Encountered error getting merchant ID: {exc}"
-                )
-                return {"formatted": self.formatted}
+            self.merchant_id = lookup_merchant_id(self.partner_id, self.tracking_id)
+
+        if self.merchant_id is None:
+            self.merchant_id = self.get_merchant_id()
+            index_tracking_id(self.partner_id, self.tracking_id, self.merchant_id)
+        return self.merchant_id
+
+    def seller_status(self):
+        if self.partner_id is None:
+            raise ValueError
+
+        try:
+            self.resolve_merchant_id()
+        except KeyError as exc:
+            current_app.logger.error(f"Encountered error getting merchant ID: {exc}")
+            return {"formatted": self.formatted}
 
         endpoint = build_endpoint(
             f"/v1/customer/partners/{self.partner_id}/merchant-integrations/{self.merchant_id}"
@@ -278,13 +336,29 @@ class Referral:
         except KeyError:
             return {"formatted": self.formatted}
 
-        response = requests.get(endpoint, headers=headers)
+        response = upstream.get(endpoint, headers=headers)
         self.formatted["seller-status"] = format_request_and_response(response)
 
         return_val = {
             "formatted": self.formatted,
             "authHeader": self.auth_header,
         }
+        try:
+            integration = response.json()
+        except json.decoder.JSONDecodeError:
+            return return_val
+        if not response.ok:
+            return return_val
+
+        # Only write the seller's row when it's missing or out of date.
+        tracking_id = integration.get("tracking_id")
+        if tracking_id and (
+            lookup_merchant_id(self.partner_id, tracking_id) != self.merchant_id
+        ):
+            index_tracking_id(self.partner_id, tracking_id, self.merchant_id)
+        return_val["merchantId"] = self.merchant_id
+        return_val["paymentsReceivable"] = integration.get("payments_receivable")
+        return_val["primaryEmailConfirmed"] = integration.get("primary_email_confirmed")
         return return_val
 
     def referral_status(self):
@@ -296,13 +370,20 @@ class Referral:
         except KeyError:
             return {"formatted": self.formatted}
 
-        response = requests.get(endpoint, headers=headers)
+        response = upstream.get(endpoint, headers=headers)
         self.formatted["referral-status"] = format_request_and_response(response)
 
         return_val = {
             "formatted": self.formatted,
             "authHeader": self.auth_header,
         }
+        try:
+            referral_data = response.json()["referral_data"]
+        except Exception as exc:
+            current_app.logger.error(f"Encountered exception unpacking referral: {exc}")
+        else:
+            if tracking_id := referral_data.get("tracking_id"):
+                return_val["trackingId"] = tracking_id
         return return_val
 
 
@@ -0,0 +1,190 @@
+import click
+import hashlib
+import json
+import random
+import time
+
+from contextlib import closing
+from flask import Flask, Response, current_app, request
+from urllib.parse import parse_qsl, urlsplit
+
+from ..metrics import normalize_path
+from .utils import connect_instance_db
+
+DATABASE = "recordings.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    method TEXT NOT NULL,
+    path TEXT NOT NULL,
+    body_key TEXT NOT NULL,
+    route TEXT NOT NULL,
+    status INTEGER NOT NULL,
+    headers TEXT NOT NULL,
+    body BLOB NOT NULL,
+    latency REAL NOT NULL,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (method, path, body_key)
+);
+"""
+
+# The response headers worth replaying; the rest describe the original connection.
+RECORDED_HEADERS = ("Content-Type", "PayPal-Debug-Id")
+
+
+def normalize_body(body):
+    """Return a canonical form of a request body, so equivalent bodies share a key.
+
+    JSON objects are re-serialized with sorted keys, and form-encoded bodies with
+    sorted parameters.
+    """
+    if body is None:
+        return ""
+    if isinstance(body, bytes):
+        body = body.decode("utf-8", errors="replace")
+
+    try:
+        return json.dumps(json.loads(body), sort_keys=True, separators=(",", ":"))
+    except json.decoder.JSONDecodeError:
+        pass
+
+    params = parse_qsl(body, keep_blank_values=True)
+    if params:
+        return "&".join(f"{key}={value}" for key, value in sorted(params))
+    return body
+
+
+def recording_key(method, path, body):
+    """Return the (method, path, body key) under which a request is recorded."""
+    body_key = hashlib.sha256(normalize_body(body).encode("utf-8")).hexdigest()
+    return method.upper(), path, body_key
+
+
+def to_route(method, path):
+    """Return the method and path with IDs replaced, e.g., "GET /v2/.../{id}"."""
+    return f"{method.upper()} {normalize_path(urlsplit(path).path)}"
+
+
+def record(response, latency):
+    """Persist the request/response pair of an upstream `response` for replaying."""
+    prepared = response.request
+    path = prepared.path_url
+    method, path, body_key = recording_key(prepared.method, path, prepared.body)
+    headers = {
+        header: response.headers[header]
+        for header in RECORDED_HEADERS
+        if header in response.headers
+    }
+
+    with closing(connect_instance_db(DATABASE, SCHEMA)) as con:
+        con.execute(
+            "INSERT OR REPLACE INTO recordings VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                method,
+                path,
+                body_key,
+                to_route(method, path),
+                response.status_code,
+                json.dumps(headers),
+                response.content,
+                latency,
+                time.time(),
+            ),
+        )
+
+
+def parse_latency(spec):
+    """Return a function sampling latencies (in seconds) from the distribution `spec`.
+
+    - "recorded": the latency of the recorded response,
+    - "fixed:<seconds>",
+    - "uniform:<low>,<high>",
+    - "lognormal:<median>,<sigma>", which has the long tail of real APIs.
+    """
+    name, _, params = spec.partition(":")
+    params = [float(param) for param in params.split(",") if param]
+
+    if name == "recorded":
+        return lambda recorded_latency: recorded_latency
+    if name == "fixed":
+        (seconds,) = params
+        return lambda _: seconds
+    if name == "uniform":
+        low, high = params
+        return lambda _: random.uniform(low, high)
+    if name == "lognormal":
+        median, sigma = params
+        return lambda _: median * random.lognormvariate(0, sigma)
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def create_stand_in_app(recordings, latency="recorded"):
+    """Return an app replaying the recorded responses in place of the PayPal API.
+
+    A request is answered with the response recorded for the same method, path and
+    (normalized) body or, failing that, the latest one recorded for the same route
+    (with IDs ignored), after a delay sampled from the `latency` distribution.
+    Requests that were never recorded get a 404.
+    """
+    sample_latency = parse_latency(latency)
+
+    by_key = dict()
+    by_route = dict()
+    for row in sorted(recordings, key=lambda row: row["recorded_at"]):
+        by_key[(row["method"], row["path"], row["body_key"])] = row
+        by_route[row["route"]] = row
+
+    app = Flask(__name__)
+
+    @app.route("/", defaults={"path": ""}, methods=("GET", "POST", "PATCH", "DELETE"))
+    @app.route("/<path:path>", methods=("GET", "POST", "PATCH", "DELETE"))
+    def replay(path):
+        full_path = request.full_path.rstrip("?")
+        key = recording_key(request.method, full_path, request.get_data())
+        row = by_key.get(key) or by_route.get(to_route(request.method, request.path))
+        if row is None:
+            return {"name": "NOT_RECORDED", "message": f"{key[0]} {key[1]}"}, 404
+
+        time.sleep(max(sample_latency(row["latency"]), 0))
+        return Response(row["body"], row["status"], json.loads(row["headers"]))
+
+    return app
+
+
+def load_recordings():
+    with closing(connect_instance_db(DATABASE, SCHEMA)) as con:
+        return con.execute("SELECT * FROM recordings").fetchall()
+
+
+@click.command("stand-in")
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=8001)
+@click.option(
+    "--latency",
+    default="recorded",
+    help='"recorded", "fixed:<s>", "uniform:<low>,<high>" or "lognormal:<median>,<sigma>"',
+)
+def stand_in_command(host, port, latency):
+    """Serve the recorded upstream responses in place of the PayPal API.
+
+    Record responses by running Alice with UPSTREAM_MODE=record, then run it with
+    UPSTREAM_MODE=replay to send every upstream call to this server instead.
+    """
+    from werkzeug.serving import run_simple
+
+    recordings = load_recordings()
+    click.echo(f"Replaying {len(recordings)} recorded responses")
+    app = create_stand_in_app(recordings, latency)
+    run_simple(host, port, app, threaded=True)
+
+
+def get_replay_url(url):
+    """Return the URL of the stand-in server corresponding to a PayPal API URL.
+
+    Other URLs (e.g., of webhook signing certificates) are returned unchanged.
+    """
+    endpoint_prefix = current_app.config["ENDPOINT_PREFIX"]
+    path = url.removeprefix(endpoint_prefix)
+    if path == url or path[:1] not in ("", "/", "?"):
+        return url
+    return current_app.config["UPSTREAM_REPLAY_URL"] + path
@@ -0,0 +1,78 @@
+import json
+
+from flask import Blueprint, current_app, jsonify, request
+
+from .flows import ACTIONS
+from .orders import Order
+from .utils import map_concurrently
+
+bp = Blueprint("statuses", __name__, url_prefix="/statuses")
+
+
+# The flow action used to fetch the status of each kind of ID, and the option
+# that the ID is passed to it as.
+STATUS_ACTIONS = {
+    "order-id": ("get-order", "order-id"),
+    "auth-id": ("get-authorization", "auth-id"),
+    "capture-id": ("get-capture", "capture-id"),
+    "payment-token-id": ("get-payment-token", "payment-token-id"),
+    "seller-merchant-id": ("get-seller", "merchant-id"),
+    "referral-token": ("get-referral", "referral-token"),
+}
+
+
+@bp.route("/", methods=("POST",))
+def get_statuses():
+    """Retrieve the statuses of any combination of orders, authorizations, captures, etc.
+
+    The statuses are fetched concurrently, sharing a single access token. Their
+    transcripts are merged into one "formatted" object, and the fields parsed from
+    each response (e.g. "orderStatus", "authStatus", "paymentsReceivable") into
+    the result.
+    """
+    data = request.get_json()
+    data_filtered = {key: value for key, value in data.items() if value}
+    current_app.logger.info(
+        f"Getting statuses with (filtered) data = {json.dumps(data_filtered, indent=2)}"
+    )
+
+    order = Order(**data)
+    try:
+        order.build_headers()
+    except KeyError as exc:
+        current_app.logger.error(f"KeyError encountered building headers: {exc}")
+        return jsonify({"formatted": order.formatted})
+
+    shared_options = {
+        key: value for key, value in data.items() if key not in STATUS_ACTIONS
+    }
+    shared_options["auth-header"] = order.auth_header
+
+    lookups = [
+        (action, shared_options | {option: data[key]})
+        for key, (action, option) in STATUS_ACTIONS.items()
+        if data.get(key)
+    ]
+
+    def fetch(lookup):
+        action, options = lookup
+        return ACTIONS[action](options)
+
+    return_val = {
+        "formatted": order.formatted,
+        "authHeader": order.auth_header,
+        "errors": {},
+    }
+    for index, future in map_concurrently(fetch, lookups, len(lookups) or 1):
+        action, _ = lookups[index]
+        try:
+            resp = future.result()
+        except Exception as exc:
+            current_app.logger.error(f"Encountered exception in {action}: {exc}")
+            return_val["errors"][action] = repr(exc)
+        else:
+            return_val["formatted"] |= resp.pop("formatted")
+            resp.pop("authHeader", None)
+            return_val |= resp
+
+    return jsonify(return_val)
@@ -0,0 +1,155 @@
+import fcntl
+import hashlib
+import json
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from flask import current_app
+
+# How often (in seconds) to retry taking a lock file that's held by another worker.
+LOCK_POLL_INTERVAL = 0.01
+
+
+class TokenCache:
+    """A cache of expiring tokens shared by every thread and worker on the host.
+
+    Entries live in memory and in a JSON file (so that gunicorn workers share them),
+    and are treated as stale `refresh_margin` seconds before they actually expire.
+    Concurrent refreshes of the same key are collapsed into a single request:
+    threads wait on a per-key lock and processes on a per-key lock file. Refreshes
+    of different keys don't wait on one another, and the JSON file is only locked
+    while it's rewritten.
+    """
+
+    def __init__(self, path, refresh_margin=0):
+        self.path = path
+        self.refresh_margin = refresh_margin
+
+        self._entries = dict()
+        self._key_locks = dict()
+        self._key_locks_lock = threading.Lock()
+
+    def _key_lock(self, key):
+        with self._key_locks_lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    @contextmanager
+    def _flock(self, path):
+        """Hold an exclusive `fcntl` lock on the file at `path`.
+
+        A blocking `flock` would stall every greenlet of a gevent worker, so the
+        lock is polled for instead, sleeping (which yields under gevent) in between.
+        """
+        with open(path, "a") as lock_file:
+            while True:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    time.sleep(LOCK_POLL_INTERVAL)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _file_lock(self):
+        return self._flock(f"{self.path}.lock")
+
+    def _refresh_lock(self, key):
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+        return self._flock(f"{self.path}.{digest}.lock")
+
+    def _is_fresh(self, entry):
+        return entry["expires_at"] - self.refresh_margin > time.time()
+
+    def _read_file(self):
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return dict()
+
+    def _write_file(self, entries):
+        """Atomically replace the cache file. Must be called with the file lock held."""
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, self.path)
+
+    def _store(self, key, value, expires_in):
+        """Store an entry, pruning expired ones. Must be called with the file lock held."""
+        entry = {"value": value, "expires_at": time.time() + float(expires_in)}
+        self._entries[key] = entry
+
+        entries = {
+            other_key: other_entry
+            for other_key, other_entry in self._read_file().items()
+            if other_entry["expires_at"] > time.time()
+        }
+        entries[key] = entry
+        self._write_file(entries)
+
+    def get(self, key):
+        """Return the cached value for `key`, or None if it is missing or stale."""
+        entry = self._entries.get(key)
+        if entry is None or not self._is_fresh(entry):
+            entry = self._read_file().get(key)
+            if entry is None or not self._is_fresh(entry):
+                return None
+            self._entries[key] = entry
+        return entry["value"]
+
+    def set(self, key, value, expires_in):
+        """Store `value` under `key` for `expires_in` seconds."""
+        with self._file_lock():
+            self._store(key, value, expires_in)
+
+    def get_or_refresh(self, key, refresh):
+        """Return the cached value for `key`, calling `refresh` at most once on a miss.
+
+        `refresh` must return a `(value, expires_in)` pair; a `value` of None is
+        returned to the caller but never cached.
+        """
+        value = self.get(key)
+        if value is not None:
+            return value
+
+        with self._key_lock(key):
+            # Another thread may have refreshed the entry while we waited.
+            value = self.get(key)
+            if value is not None:
+                return value
+
+            with self._refresh_lock(key):
+                # ...or another worker.
+                value = self.get(key)
+                if value is not None:
+                    return value
+
+                value, expires_in = refresh()
+                if value is None or not expires_in:
+                    return value
+
+                self.set(key, value, expires_in)
+
+        return value
+
+
+def get_token_cache(name, refresh_margin=0):
+    """Return the app's token cache with the given name, creating it if necessary."""
+    caches = current_app.extensions.setdefault("alice_token_caches", dict())
+    try:
+        return caches[name]
+    except KeyError:
+        path = os.path.join(current_app.instance_path, f"{name}.json")
+        cache = caches[name] = TokenCache(path, refresh_margin=refresh_margin)
+        return cache
+
+
+def fingerprint(*parts):
+    """Return a short, non-reversible fingerprint of the given strings (e.g., secrets)."""
+    digest = hashlib.sha256("\0".join(str(part) for part in parts).encode("utf-8"))
+    return digest.hexdigest()[:16]
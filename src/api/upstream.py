@@ -0,0 +1,243 @@
+import os
+import random
+import requests
+import threading
+import time
+
+from email.utils import parsedate_to_datetime
+from flask import current_app
+from http.cookiejar import DefaultCookiePolicy
+from requests.adapters import HTTPAdapter
+
+from . import replay
+from ..metrics import normalize_path, record_upstream_request
+
+# Responses to requests that are worth retrying: throttling and transient errors.
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Requests that may be retried even without a PayPal-Request-Id.
+IDEMPOTENT_METHODS = ("GET", "HEAD", "OPTIONS", "PUT", "DELETE")
+
+
+class Response(requests.Response):
+    """A response whose JSON body is parsed at most once, however often it's read."""
+
+    def json(self, **kwargs):
+        if kwargs:
+            return super().json(**kwargs)
+        try:
+            return self._json
+        except AttributeError:
+            self._json = super().json()
+            return self._json
+
+
+class JSONCachingHTTPAdapter(HTTPAdapter):
+    def build_response(self, req, resp):
+        response = super().build_response(req, resp)
+        response.__class__ = Response
+        return response
+
+
+class RetryBudget:
+    """A token bucket limiting retries to a fraction of the requests made.
+
+    Every request deposits `ratio` tokens and every retry withdraws one, so that when
+    an endpoint is failing outright, retries can't multiply the load on it.
+    """
+
+    def __init__(self, ratio, capacity):
+        self.ratio = ratio
+        self.capacity = capacity
+        self.tokens = capacity
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        with self._lock:
+            self.tokens = min(self.tokens + self.ratio, self.capacity)
+
+    def withdraw(self):
+        """Take a token for a retry, returning False if there are none left."""
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def build_session(config):
+    """Return a pooled, keep-alive session configured from the app config.
+
+    The session itself never retries; see `request`.
+    """
+    adapter = JSONCachingHTTPAdapter(
+        pool_connections=config["HTTP_POOL_CONNECTIONS"],
+        pool_maxsize=config["HTTP_POOL_MAXSIZE"],
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    # Requests made through the session must not leak state into one another,
+    # just like the bare `requests.post`/`requests.get` calls this replaces.
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def get_session():
+    """Return this worker's session, creating a new one after a fork."""
+    upstream = current_app.extensions.setdefault("alice_upstream", dict())
+    pid = os.getpid()
+    if upstream.get("pid") != pid:
+        upstream["session"] = build_session(current_app.config)
+        upstream["retry_budgets"] = dict()
+        upstream["pid"] = pid
+    return upstream["session"]
+
+
+def get_retry_budget(method, url):
+    """Return this worker's retry budget for the route (method and path) of `url`."""
+    get_session()
+    budgets = current_app.extensions["alice_upstream"]["retry_budgets"]
+    endpoint_prefix = current_app.config["ENDPOINT_PREFIX"]
+    route = (method, normalize_path(url.split("?")[0].removeprefix(endpoint_prefix)))
+    try:
+        return budgets[route]
+    except KeyError:
+        return budgets.setdefault(
+            route,
+            RetryBudget(
+                current_app.config["HTTP_RETRY_BUDGET_RATIO"],
+                current_app.config["HTTP_RETRY_BUDGET_MIN"],
+            ),
+        )
+
+
+def is_retryable(method, headers):
+    """Whether a failed request may be sent again without duplicating its effects.
+
+    PayPal deduplicates POSTs (and PATCHes) by PayPal-Request-Id, so those are
+    retryable only with one; the retry is sent with the same ID.
+    """
+    if method.upper() in IDEMPOTENT_METHODS:
+        return True
+    return any(header.lower() == "paypal-request-id" for header in headers or {})
+
+
+def should_retry(retryable, attempt, budget):
+    return (
+        retryable and attempt < current_app.config["HTTP_RETRIES"] and budget.withdraw()
+    )
+
+
+def parse_retry_after(response):
+    """Return the delay (in seconds) requested by the Retry-After header, if any."""
+    retry_after = response.headers.get("Retry-After")
+    if retry_after is None:
+        return None
+    try:
+        return max(float(retry_after), 0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(retry_after).timestamp() - time.time(), 0)
+    except (TypeError, ValueError):
+        return None
+
+
+def retry_delay(attempt, response=None):
+    """Return how long to wait before the given retry (the first is attempt 1).
+
+    Backs off exponentially with full jitter, but never less than Retry-After. If
+    Retry-After asks for longer than `HTTP_RETRY_MAX_DELAY`, returns None: the
+    request shouldn't be retried.
+    """
+    max_delay = current_app.config["HTTP_RETRY_MAX_DELAY"]
+    backoff = current_app.config["HTTP_RETRY_BACKOFF"] * 2 ** (attempt - 1)
+    delay = random.uniform(0, backoff)
+    if response is not None:
+        retry_after = parse_retry_after(response)
+        if retry_after is not None:
+            if retry_after > max_delay:
+                return None
+            delay = max(delay, retry_after)
+    return min(delay, max_delay)
+
+
+def request(method, url, **kwargs):
+    """Send a request upstream through the shared session.
+
+    Accepts the same keyword arguments as `requests.request`, and applies the
+    configured connect and read timeouts unless `timeout` is given.
+
+    Connection errors, timeouts, 429s and 5xx gateway errors are retried up to
+    `HTTP_RETRIES` times (see `is_retryable` and `retry_delay`), as long as the
+    route's retry budget allows it.
+
+    With `UPSTREAM_MODE` set to "record", every request/response pair is saved for
+    replaying; with it set to "replay", requests go to the stand-in server instead.
+    """
+    mode = current_app.config["UPSTREAM_MODE"]
+    sent_url = replay.get_replay_url(url) if mode == "replay" else url
+
+    kwargs.setdefault(
+        "timeout",
+        (
+            current_app.config["HTTP_CONNECT_TIMEOUT"],
+            current_app.config["HTTP_READ_TIMEOUT"],
+        ),
+    )
+
+    budget = get_retry_budget(method, url)
+    budget.deposit()
+    retryable = is_retryable(method, kwargs.get("headers"))
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            response = get_session().request(method, sent_url, **kwargs)
+        except (requests.ConnectionError, requests.Timeout) as exc:
+            duration = time.perf_counter() - start
+            record_upstream_request(method, url, type(exc).__name__, duration)
+            if not should_retry(retryable, attempt, budget):
+                raise
+            delay = retry_delay(attempt + 1)
+            current_app.logger.warning(f"Retrying {method} {url} after {exc!r}")
+        except requests.RequestException as exc:
+            duration = time.perf_counter() - start
+            record_upstream_request(method, url, type(exc).__name__, duration)
+            raise
+        else:
+            duration = time.perf_counter() - start
+            debug_id = response.headers.get("PayPal-Debug-Id")
+            record_upstream_request(
+                method, url, response.status_code, duration, debug_id
+            )
+            if response.status_code not in RETRY_STATUSES:
+                break
+            delay = retry_delay(attempt + 1, response)
+            if delay is None or not should_retry(retryable, attempt, budget):
+                break
+            current_app.logger.warning(
+                f"Retrying {method} {url} after a {response.status_code} response"
+            )
+
+        attempt += 1
+        time.sleep(delay)
+
+    if mode == "record":
+        replay.record(response, duration)
+    return response
+
+
+def get(url, **kwargs):
+    return request("GET", url, **kwargs)
+
+
+def post(url, **kwargs):
+    return request("POST", url, **kwargs)
+
+
+def delete(url, **kwargs):
+    return request("DELETE", url, **kwargs)
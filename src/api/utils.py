@@ -1,8 +1,15 @@
+import itertools
 import json
+import os
 import random
+import sqlite3
 import string
+import threading
+import time
 
-from flask import current_app
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from flask import current_app, has_request_context, jsonify, request
+from flask.json.provider import DefaultJSONProvider
 from urllib.parse import urlencode
 from shlex import quote
 
@@ -111,18 +118,64 @@ def format_response(response):
     )
 
 
+class Transcript:
+    """An HTTP request and its response, formatted for output only when serialized.
+
+    The views rendered are chosen by the `formatted` querystring parameter of the
+    current request: a comma-separated subset of "human", "curl", and "raw"
+    (so, e.g., `?formatted=raw` skips formatting and `?formatted=none` omits it).
+    """
+
+    default_views = ("human", "curl")
+
+    def __init__(self, response):
+        self.response = response
+
+    def json(self):
+        return self.response.json()
+
+    def human(self):
+        formatted_request = format_request(self.response.request)
+        formatted_response = format_response(self.response)
+        return "\n\n".join([formatted_request, formatted_response])
+
+    def curl(self):
+        return format_request_as_curl(self.response.request)
+
+    def raw(self):
+        return {
+            "status": self.response.status_code,
+            "body": self.response.text,
+        }
+
+    def render(self, views=None):
+        if views is None:
+            views = requested_transcript_views()
+        return {view: getattr(self, view)() for view in views}
+
+
+def requested_transcript_views():
+    """Return the transcript views requested by the client, or the default views."""
+    if not has_request_context() or not request.args.get("formatted"):
+        return Transcript.default_views
+
+    views = request.args["formatted"].split(",")
+    return tuple(view for view in views if view in ("human", "curl", "raw"))
+
+
+class JSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, extended to render transcripts as they're serialized."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Transcript):
+            return o.render()
+        return DefaultJSONProvider.default(o)
+
+
 def format_request_and_response(response):
-    """Format an HTTP request and response for output."""
-    request = response.request
-    formatted_request = format_request(request)
-    curl_formatted_request = format_request_as_curl(request)
-
-    formatted_response = format_response(response)
-    human_formatted_request = "\n\n".join([formatted_request, formatted_response])
-    return {
-        "human": human_formatted_request,
-        "curl": curl_formatted_request,
-    }
+    """Return a transcript of an HTTP request and response for output."""
+    return Transcript(response)
 
 
 def format_request_as_curl(request):
@@ -160,3 +213,115 @@ def random_alphanumeric_string(length):
     return "".join(
         random.choice(string.ascii_uppercase + string.digits) for _ in range(length)
     )
+
+
+def map_concurrently(func, items, max_workers):
+    """Call `func` on each item in a thread pool, yielding `(index, future)` pairs as they complete.
+
+    Each call runs inside the current app context. At most `max_workers` calls are
+    in flight at once, and `items` is consumed lazily, so it may be a generator.
+    """
+    app = current_app._get_current_object()
+
+    def call(item):
+        with app.app_context():
+            return func(item)
+
+    indexed_items = enumerate(items)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = {
+            executor.submit(call, item): index
+            for index, item in itertools.islice(indexed_items, max_workers)
+        }
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield pending.pop(future), future
+
+            for index, item in itertools.islice(indexed_items, len(done)):
+                pending[executor.submit(call, item)] = index
+
+
+def parse_positive_int(value):
+    """Return `value` as a positive integer, or None if it isn't one."""
+    try:
+        number = int(value)
+    except (TypeError, ValueError):
+        return None
+    return number if number > 0 else None
+
+
+def parse_concurrency(data, default=None):
+    """Return a request's "concurrency", capped at `BATCH_MAX_CONCURRENCY`.
+
+    It defaults to `default`, or to the cap. Returns None if it isn't a positive integer.
+    """
+    max_concurrency = current_app.config["BATCH_MAX_CONCURRENCY"]
+    concurrency = parse_positive_int(
+        data.get("concurrency", default or max_concurrency)
+    )
+    return concurrency and min(concurrency, max_concurrency)
+
+
+def prepare_batch(obj, data):
+    """Validate a batch request's "concurrency" and fetch its access token up front.
+
+    The access token is fetched once with `obj.build_headers()` and stored in `data`
+    as "auth-header", so every item of the batch reuses it. The concurrency defaults
+    to, and is capped at, `BATCH_MAX_CONCURRENCY`.
+
+    Returns `(concurrency, None)`, or `(None, response)` with the error response to
+    return instead.
+    """
+    concurrency = parse_concurrency(data)
+    if concurrency is None:
+        error = {"error": '"concurrency" must be a positive integer'}
+        return None, (jsonify(error), 400)
+
+    try:
+        obj.build_headers()
+    except KeyError as exc:
+        current_app.logger.error(
+            f"Encountered KeyError in {type(obj).__name__}().build_headers: {exc}"
+        )
+        return None, jsonify({"formatted": obj.formatted})
+    data["auth-header"] = obj.auth_header
+
+    return concurrency, None
+
+
+class RateLimiter:
+    """Space out calls to at most `rate` per second, across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate
+        self._next_time = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """Block until the next call is allowed."""
+        with self._lock:
+            now = time.monotonic()
+            wait_until = max(self._next_time, now)
+            self._next_time = wait_until + self.interval
+        time.sleep(wait_until - now)
+
+
+def to_ndjson_line(obj):
+    """Serialize `obj` as one line of newline-delimited JSON."""
+    return current_app.json.dumps(obj) + "\n"
+
+
+def connect_instance_db(filename, schema):
+    """Return a connection to the SQLite database `filename` in the instance folder.
+
+    The database is shared by every thread and worker, so it uses write-ahead logging
+    and waits on locks rather than failing. `schema` must be idempotent (e.g., use
+    `CREATE TABLE IF NOT EXISTS`), since it runs on every connection.
+    """
+    path = os.path.join(current_app.instance_path, filename)
+    con = sqlite3.connect(path, timeout=30, isolation_level=None)
+    con.row_factory = sqlite3.Row
+    con.execute("PRAGMA journal_mode=WAL")
+    con.executescript(schema)
+    return con
@@ -1,22 +1,68 @@
+import itertools
 import json
-import requests
-
-from flask import Blueprint, current_app, jsonify, request
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from flask import (
+    Blueprint,
+    Response,
+    current_app,
+    jsonify,
+    request,
+    stream_with_context,
+)
+from . import upstream
 from .utils import (
     build_endpoint,
+    connect_instance_db,
     format_request_and_response,
+    RateLimiter,
+    map_concurrently,
+    parse_positive_int,
+    prepare_batch,
+    random_alphanumeric_string,
+    to_ndjson_line,
 )
 from .identity import build_headers
 from .orders import default_shipping_address
 
 bp = Blueprint("vault", __name__, url_prefix="/vault")
 
+DATABASE = "vault.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS vaulted_payment_tokens (
+    payment_token_id TEXT PRIMARY KEY,
+    customer_id TEXT,
+    setup_token_id TEXT NOT NULL,
+    merchant_id TEXT,
+    vault_level TEXT,
+    payment_source TEXT NOT NULL,
+    job_id TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS vaulted_payment_tokens_job_id
+    ON vaulted_payment_tokens (job_id);
+CREATE INDEX IF NOT EXISTS vaulted_payment_tokens_customer_id
+    ON vaulted_payment_tokens (customer_id);
+"""
+
+# Vaulted payment tokens are written to the database this many at a time.
+STORE_BATCH_SIZE = 100
+
+# The number of payment tokens requested per page when listing them all, by
+# default and at most (the API's maximum).
+PAYMENT_TOKENS_PAGE_SIZE = 20
+PAYMENT_TOKENS_MAX_PAGE_SIZE = 20
+
 
 class Vault:
     def __init__(self, **kwargs):
         self.auth_header = kwargs.get("auth-header")
         self._set_partner_config(kwargs)
         self._set_billing_address(kwargs)
+        self._set_card(kwargs)
         self.payment_source_type = kwargs.get(
             "payment-source",
             "card",  # If 'payment-source' is undefined, it must be a card transaction!
@@ -73,6 +119,12 @@ class Vault:
             if not val:
                 del self.billing_address[key]
 
+    def _set_card(self, kwargs):
+        """Set the card details, with which a setup token is approved without a buyer."""
+        self.card_number = kwargs.get("card-number")
+        self.card_expiry = kwargs.get("card-expiry")  # YYYY-MM
+        self.card_security_code = kwargs.get("card-security-code")
+
     def build_headers(self):
         """Wrapper for .utils.build_headers."""
         if self.include_auth_assertion:
@@ -129,6 +181,13 @@ class Vault:
                             )
                         if self.cardholder_name:
                             payment_source_body["name"] = self.cardholder_name
+                        if self.card_number:
+                            payment_source_body["number"] = self.card_number
+                            payment_source_body["expiry"] = self.card_expiry
+                            if self.card_security_code:
+                                payment_source_body["security_code"] = (
+                                    self.card_security_code
+                                )
 
                     case _:
                         description = (
@@ -167,7 +226,7 @@ class Vault:
         if self.customer_id:
             data["customer"] = {"id": self.customer_id}
 
-        response = requests.post(
+        response = upstream.post(
             endpoint,
             headers=headers,
             json=data,
@@ -204,7 +263,7 @@ class Vault:
             "payment_source": self.build_payment_source(for_token="payment"),
         }
 
-        response = requests.post(
+        response = upstream.post(
             endpoint,
             headers=headers,
             json=data,
@@ -216,13 +275,17 @@ class Vault:
         }
 
         try:
-            payment_token_id = response.json()["id"]
+            response_dict = response.json()
+            payment_token_id = response_dict["id"]
         except Exception as exc:
             current_app.logger.error(
                 f"Encountered exception unpacking setup token: {exc}"
             )
         else:
             return_val["paymentTokenId"] = payment_token_id
+            customer_id = response_dict.get("customer", {}).get("id")
+            if customer_id:
+                return_val["customerId"] = customer_id
         finally:
             return return_val
 
@@ -237,11 +300,12 @@ class Vault:
         except KeyError:
             return {"formatted": self.formatted}
 
-        response = requests.delete(endpoint, headers=headers)
+        response = upstream.delete(endpoint, headers=headers)
         self.formatted["delete-payment-token"] = format_request_and_response(response)
         return_val = {
             "formatted": self.formatted,
             "authHeader": self.auth_header,
+            "deleted": response.ok,
         }
 
         return return_val
@@ -257,13 +321,25 @@ class Vault:
         except KeyError:
             return {"formatted": self.formatted}
 
-        response = requests.get(endpoint, headers=headers)
+        response = upstream.get(endpoint, headers=headers)
         self.formatted["payment-token-status"] = format_request_and_response(response)
         return_val = {
             "formatted": self.formatted,
             "authHeader": self.auth_header,
         }
 
+        try:
+            response_dict = response.json()
+            payment_token_id = response_dict["id"]
+        except Exception as exc:
+            current_app.logger.error(
+                f"Encountered exception unpacking payment token: {exc}"
+            )
+        else:
+            return_val["paymentTokenId"] = payment_token_id
+            customer_id = response_dict.get("customer", {}).get("id")
+            if customer_id:
+                return_val["customerId"] = customer_id
         return return_val
 
     def get_payment_tokens(self):
@@ -279,7 +355,7 @@ class Vault:
         except KeyError:
             return {"formatted": self.formatted}
 
-        response = requests.get(endpoint, headers=headers)
+        response = upstream.get(endpoint, headers=headers)
         self.formatted["get-payment-tokens"] = format_request_and_response(response)
         return_val = {
             "formatted": self.formatted,
@@ -288,6 +364,42 @@ class Vault:
 
         return return_val
 
+    def get_payment_tokens_page(self, page, page_size, headers):
+        """Return a page of the customer's payment tokens, raising if the request fails.
+
+        Docs: https://developer.paypal.com/docs/api/payment-tokens/v3/#customer_payment-tokens_get
+        """
+        query = {"customer_id": self.customer_id, "page": page, "page_size": page_size}
+        endpoint = build_endpoint("/v3/vault/payment-tokens", query=query)
+        response = upstream.get(endpoint, headers=headers)
+        response.raise_for_status()
+        return response.json()
+
+    def iter_payment_token_pages(self, page_size=PAYMENT_TOKENS_PAGE_SIZE):
+        """Yield `(page, response_dict)` for every page of the customer's payment tokens.
+
+        The next page is requested while the current one is being consumed, and only
+        those two pages are held in memory at a time.
+        """
+        headers = self.build_headers()
+        app = current_app._get_current_object()
+
+        def fetch(page):
+            with app.app_context():
+                return self.get_payment_tokens_page(page, page_size, headers)
+
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            page = 1
+            future = executor.submit(fetch, page)
+            while future is not None:
+                page_dict = future.result()
+                if page < page_dict.get("total_pages", 1):
+                    future = executor.submit(fetch, page + 1)
+                else:
+                    future = None
+                yield page, page_dict
+                page += 1
+
     # def get_payment_tokens_by_merchant_customer_id(self):
     #     """Retrieve all payment tokens for a customer using the GET /v3/vault/payment-tokens endpoint.
 
@@ -302,7 +414,7 @@ class Vault:
     #     except KeyError:
     #         return {"formatted": self.formatted}
 
-    #     response = requests.get(endpoint, headers=headers)
+    #     response = upstream.get(endpoint, headers=headers)
     #     self.formatted["get-payment-tokens-by-mcid"] = format_request_and_response(
     #         response
     #     )
@@ -353,6 +465,124 @@ def create_payment_token(setup_token_id):
     return jsonify(resp)
 
 
+def expand_vault_options(data):
+    """Yield the options of each payment token to vault in bulk.
+
+    `data["cards"]` lists per-card options (e.g., "card-number", "card-expiry",
+    "cardholder-name", "billing-address-line-1"), which are cycled through until
+    `data["count"]` tokens (by default, one per card) have been yielded. The
+    remaining top-level options are shared by every token.
+    """
+    shared_options = {
+        key: value
+        for key, value in data.items()
+        if key not in ("cards", "count", "concurrency")
+    }
+    cards = data.get("cards") or [{}]
+    count = int(data.get("count", len(cards)))
+    for card_options in itertools.islice(itertools.cycle(cards), count):
+        yield shared_options | card_options
+
+
+def vault_payment_token(options):
+    """Create a setup token and, if it's approved, a payment token from it."""
+    vault = Vault(**options)
+    resp = vault.create_setup_token()
+    if "setupTokenId" not in resp:
+        return resp | {"error": "No setup token was created"}
+
+    vault.setup_token = resp["setupTokenId"]
+    return resp | vault.create_payment_token()
+
+
+def store_payment_tokens(rows):
+    with closing(connect_instance_db(DATABASE, SCHEMA)) as con:
+        con.executemany(
+            "INSERT OR REPLACE INTO vaulted_payment_tokens VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            rows,
+        )
+
+
+@bp.route("/bulk", methods=("POST",))
+def vault_payment_tokens():
+    """Vault many payment tokens concurrently, streaming each result as a line of NDJSON.
+
+    Each token's setup token and payment token are created back-to-back, with up to
+    "concurrency" tokens in flight. Vaulted tokens are stored (see `get_bulk_job`)
+    under the job ID included in every line. See `expand_vault_options` for the
+    request format.
+    """
+    data = request.get_json()
+    job_id = random_alphanumeric_string(12)
+    current_app.logger.info(
+        f"Vaulting {data.get('count', len(data.get('cards', [])))} payment tokens as job {job_id}"
+    )
+
+    concurrency, error_response = prepare_batch(Vault(**data), data)
+    if error_response is not None:
+        return error_response
+    options = list(expand_vault_options(data))
+
+    def generate():
+        rows = []
+        results = map_concurrently(vault_payment_token, options, concurrency)
+        for index, future in results:
+            try:
+                resp = future.result()
+            except Exception as exc:
+                current_app.logger.error(
+                    f"Encountered exception vaulting payment token: {exc}"
+                )
+                resp = {"error": str(exc)}
+
+            if "paymentTokenId" in resp:
+                rows.append(
+                    (
+                        resp["paymentTokenId"],
+                        resp.get("customerId"),
+                        resp["setupTokenId"],
+                        options[index].get("merchant-id"),
+                        options[index].get("vault-level"),
+                        options[index].get("payment-source", "card"),
+                        job_id,
+                        time.time(),
+                    )
+                )
+                if len(rows) >= STORE_BATCH_SIZE:
+                    store_payment_tokens(rows)
+                    rows = []
+            yield to_ndjson_line({"index": index, "jobId": job_id} | resp)
+
+        if rows:
+            store_payment_tokens(rows)
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
+@bp.route("/bulk/<job_id>", methods=("GET",))
+def get_bulk_job(job_id):
+    """Return the payment tokens vaulted by the given bulk job, for later reuse."""
+    with closing(connect_instance_db(DATABASE, SCHEMA)) as con:
+        rows = con.execute(
+            "SELECT * FROM vaulted_payment_tokens WHERE job_id = ? ORDER BY created_at",
+            (job_id,),
+        ).fetchall()
+
+    payment_tokens = [
+        {
+            "paymentTokenId": row["payment_token_id"],
+            "customerId": row["customer_id"],
+            "setupTokenId": row["setup_token_id"],
+            "merchantId": row["merchant_id"],
+            "vaultLevel": row["vault_level"],
+            "paymentSource": row["payment_source"],
+            "createdAt": row["created_at"],
+        }
+        for row in rows
+    ]
+    return jsonify({"jobId": job_id, "paymentTokens": payment_tokens})
+
+
 @bp.route("/payment-tokens/<payment_token_id>", methods=("POST",))
 def get_payment_token_status(payment_token_id):
     """Retrieve the status of the payment token with the given ID.
@@ -393,6 +623,100 @@ def delete_payment_token(payment_token_id):
     return jsonify(resp)
 
 
+def expand_purge_options(data, errors):
+    """Yield the options of each payment token of each customer to purge.
+
+    Each customer's token IDs are all listed before any are deleted, since deleting
+    tokens shifts the later pages. Customers whose tokens can't be listed are
+    reported in `errors` and skipped.
+    """
+    shared_options = {
+        key: value
+        for key, value in data.items()
+        if key not in ("customer-ids", "concurrency", "rate")
+    }
+    for customer_id in data["customer-ids"]:
+        options = shared_options | {"customer-id": customer_id}
+        try:
+            payment_token_ids = [
+                payment_token["id"]
+                for _, page_dict in Vault(**options).iter_payment_token_pages()
+                for payment_token in page_dict.get("payment_tokens", [])
+            ]
+        except Exception as exc:
+            current_app.logger.error(
+                f"Encountered exception listing tokens of {customer_id}: {exc}"
+            )
+            errors.append({"customerId": customer_id, "error": str(exc)})
+            continue
+
+        for payment_token_id in payment_token_ids:
+            yield options | {"payment-token-id": payment_token_id}
+
+
+@bp.route("/purge", methods=("POST",))
+def purge_payment_tokens():
+    """Delete every payment token of the given customers, streaming progress as NDJSON.
+
+    The body lists the "customer-ids" to purge. Deletions share one access token and
+    run with up to "concurrency" in flight, at most "rate" per second. Each deletion
+    is reported on its own line (with its transcript if it failed), followed by a
+    summary line.
+    """
+    data = request.get_json()
+    customer_ids = data.get("customer-ids")
+    if not isinstance(customer_ids, list) or not customer_ids:
+        return jsonify({"error": '"customer-ids" must be a non-empty list'}), 400
+    try:
+        rate = float(data.get("rate", current_app.config["VAULT_PURGE_RATE"]))
+    except (TypeError, ValueError):
+        rate = 0
+    if not rate > 0:
+        return jsonify({"error": '"rate" must be a positive number'}), 400
+    current_app.logger.info(f"Purging the payment tokens of {customer_ids}")
+
+    concurrency, error_response = prepare_batch(Vault(**data), data)
+    if error_response is not None:
+        return error_response
+    rate_limiter = RateLimiter(rate)
+
+    def delete(options):
+        rate_limiter.wait()
+        resp = Vault(**options).delete_payment_token()
+        result = {
+            "customerId": options["customer-id"],
+            "paymentTokenId": options["payment-token-id"],
+            "deleted": resp.get("deleted", False),
+        }
+        if not result["deleted"]:
+            result["formatted"] = resp["formatted"]
+        return result
+
+    def generate():
+        errors = []
+        deleted = failed = 0
+        options = expand_purge_options(data, errors)
+        for index, future in map_concurrently(delete, options, concurrency):
+            try:
+                result = future.result()
+            except Exception as exc:
+                current_app.logger.error(
+                    f"Encountered exception deleting payment token: {exc}"
+                )
+                result = {"deleted": False, "error": str(exc)}
+
+            if result["deleted"]:
+                deleted += 1
+            else:
+                failed += 1
+            yield to_ndjson_line({"index": index} | result)
+
+        summary = {"deleted": deleted, "failed": failed, "customerErrors": errors}
+        yield to_ndjson_line({"summary": summary})
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 @bp.route("/customers/<customer_id>", methods=("POST",))
 def get_payment_tokens(customer_id):
     """Retrieve all payment tokens for the customer with the given ID.
@@ -413,6 +737,36 @@ def get_payment_tokens(customer_id):
     return jsonify(resp)
 
 
+@bp.route("/customers/<customer_id>/payment-tokens", methods=("POST",))
+def stream_payment_tokens(customer_id):
+    """Stream every payment token of the customer with the given ID as NDJSON.
+
+    Unlike `get_payment_tokens`, this walks all pages (see
+    Vault.iter_payment_token_pages) and emits one line per payment token, without
+    transcripts. If a page can't be retrieved, the last line holds the "error".
+    """
+    data = request.get_json()
+    data["customer-id"] = customer_id
+    page_size = parse_positive_int(data.get("page-size", PAYMENT_TOKENS_PAGE_SIZE))
+    if page_size is None:
+        return jsonify({"error": '"page-size" must be a positive integer'}), 400
+    page_size = min(page_size, PAYMENT_TOKENS_MAX_PAGE_SIZE)
+    current_app.logger.info(f"Streaming the payment tokens of customer {customer_id}")
+
+    vault = Vault(**data)
+
+    def generate():
+        try:
+            for page, page_dict in vault.iter_payment_token_pages(page_size):
+                for payment_token in page_dict.get("payment_tokens", []):
+                    yield to_ndjson_line({"page": page, "paymentToken": payment_token})
+        except Exception as exc:
+            current_app.logger.error(f"Encountered exception listing tokens: {exc}")
+            yield to_ndjson_line({"error": str(exc)})
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+
 # @bp.route("/merchant-customers/<merchant_customer_id>", methods=("POST",))
 # def get_payment_tokens_by_merchant_customer_id(merchant_customer_id):
 #     """Retrieve all payment tokens for the customer with the given ID.
@@ -1,27 +1,94 @@
+import base64
 import json
-import requests
+import math
+import os
+import threading
+import time
+import zlib
 
-from flask import Blueprint, current_app, request
-from .utils import build_endpoint
+from contextlib import closing
+from datetime import datetime, timezone
+from flask import Blueprint, current_app, jsonify, request
+from requests.certs import where as default_ca_bundle
+from urllib.parse import urlsplit
+from werkzeug.datastructures import Headers
+from . import upstream
+from .utils import build_endpoint, connect_instance_db, parse_positive_int
 from .identity import build_headers
 
+try:
+    from cryptography import x509
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+except ImportError:
+    x509 = None
+
 bp = Blueprint("webhooks", __name__, url_prefix="/webhooks")
 
+DATABASE = "webhooks.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS webhook_events (
+    transmission_id TEXT PRIMARY KEY,
+    received_at REAL NOT NULL,
+    event_type TEXT,
+    headers TEXT NOT NULL,
+    body TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL DEFAULT 0,
+    claimed_at REAL,
+    verified_at REAL,
+    verification TEXT
+);
+CREATE INDEX IF NOT EXISTS webhook_events_status
+    ON webhook_events (status, received_at);
+CREATE INDEX IF NOT EXISTS webhook_events_event_type
+    ON webhook_events (event_type, received_at);
+"""
+
+# Events claimed by a worker that died mid-batch are retried after this many seconds.
+CLAIM_TIMEOUT = 300
+
+# Verification is retried after 10, 20, 40... seconds.
+RETRY_DELAY = 10
+
+# The hash algorithms of the `PayPal-Auth-Algo`s that can be verified locally.
+SIGNATURE_HASHES = {"SHA256withRSA": "SHA256"}
+
+# The most intermediate certificates between a signing certificate and its root CA.
+MAX_CHAIN_DEPTH = 4
 
-def verify_webhook_signature(verification_dict):
+_queue_lock = threading.Lock()
+_certificate_cache_lock = threading.Lock()
+
+
+def connect():
+    return connect_instance_db(DATABASE, SCHEMA)
+
+
+def verify_webhook_signature(verification_dict, headers=None):
     """Verify the signature of the webhook with the /v1/notifications API.
 
     Docs: https://developer.paypal.com/api/webhooks/v1/#verify-webhook-signature_post
     """
     endpoint = build_endpoint("/v1/notifications/verify-webhook-signature")
+    if headers is None:
+        headers = build_verification_headers()
+
+    response = upstream.post(endpoint, headers=headers, json=verification_dict)
+    response_dict = response.json()
+    return response_dict
+
+
+def build_verification_headers():
     client_id = current_app.config["PARTNER_CLIENT_ID"]
     secret = current_app.config["PARTNER_SECRET"]
     bn_code = current_app.config["PARTNER_BN_CODE"]
     headers = build_headers(client_id=client_id, secret=secret, bn_code=bn_code)
-
-    response = requests.post(endpoint, headers=headers, data=verification_dict)
-    response_dict = response.json()
-    return response_dict
+    del headers["formatted"]
+    return headers
 
 
 def to_verification_dict(webhook_headers, webhook_body):
@@ -49,18 +116,412 @@ def to_verification_dict(webhook_headers, webhook_body):
     return verification_dict
 
 
+class WebhookQueue:
+    """Background threads that verify queued webhooks, a batch at a time.
+
+    Webhooks are queued in the instance database by `listener`. Every gunicorn
+    worker runs its own threads; a batch is claimed in a single transaction, so
+    each event is verified by one thread only. Events whose verification raises
+    are retried up to `WEBHOOK_VERIFY_MAX_ATTEMPTS` times.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.wakeup = threading.Event()
+        self.threads = [
+            threading.Thread(target=self.run, name=f"webhook-verifier-{i}", daemon=True)
+            for i in range(app.config["WEBHOOK_VERIFY_THREADS"])
+        ]
+        for thread in self.threads:
+            thread.start()
+
+    def notify(self):
+        self.wakeup.set()
+
+    def run(self):
+        with self.app.app_context():
+            while True:
+                try:
+                    batch = self.claim_batch()
+                except Exception as exc:
+                    current_app.logger.error(f"Failed to claim webhooks: {exc}")
+                    batch = []
+
+                if not batch:
+                    self.wakeup.wait(current_app.config["WEBHOOK_POLL_INTERVAL"])
+                    self.wakeup.clear()
+                    continue
+
+                self.verify_batch(batch)
+
+    def claim_batch(self):
+        """Mark a batch of pending events as being processed, and return them."""
+        now = time.time()
+        with closing(connect()) as con:
+            con.execute("BEGIN IMMEDIATE")
+            rows = con.execute(
+                """
+                SELECT transmission_id, headers, body, attempts FROM webhook_events
+                WHERE (status = 'pending' AND available_at <= ?)
+                    OR (status = 'processing' AND claimed_at < ?)
+                ORDER BY received_at
+                LIMIT ?
+                """,
+                (
+                    now,
+                    now - CLAIM_TIMEOUT,
+                    current_app.config["WEBHOOK_VERIFY_BATCH_SIZE"],
+                ),
+            ).fetchall()
+            con.executemany(
+                """
+                UPDATE webhook_events
+                SET status = 'processing', claimed_at = ?, attempts = attempts + 1
+                WHERE transmission_id = ?
+                """,
+                [(now, row["transmission_id"]) for row in rows],
+            )
+            con.execute("COMMIT")
+        return rows
+
+    def verify_batch(self, batch):
+        """Verify each event in the batch, locally if possible and otherwise with the API.
+
+        Events verified with the API share one set of headers (and access token).
+        """
+        headers = None
+        results = []
+        failures = []
+        for row in batch:
+            try:
+                webhook_headers = Headers(json.loads(row["headers"]))
+                if current_app.config["WEBHOOK_LOCAL_VERIFICATION"] and verify_locally(
+                    webhook_headers, row["body"]
+                ):
+                    resp = {"verification_status": "SUCCESS", "verifiedLocally": True}
+                else:
+                    if headers is None:
+                        headers = build_verification_headers()
+                    if "Authorization" not in headers:
+                        raise Exception("No access token to verify webhooks with")
+                    verification_dict = to_verification_dict(
+                        webhook_headers, json.loads(row["body"])
+                    )
+                    resp = verify_webhook_signature(verification_dict, headers=headers)
+            except Exception as exc:
+                current_app.logger.error(
+                    f"Failed to verify webhook {row['transmission_id']}: {exc}"
+                )
+                attempts = row["attempts"] + 1
+                if attempts >= current_app.config["WEBHOOK_VERIFY_MAX_ATTEMPTS"]:
+                    status = "error"
+                else:
+                    status = "pending"
+                available_at = time.time() + RETRY_DELAY * 2 ** (attempts - 1)
+                failures.append((status, available_at, row["transmission_id"]))
+                continue
+
+            if resp.get("verification_status") == "SUCCESS":
+                current_app.logger.debug("Verification successful!")
+                status = "verified"
+            else:
+                current_app.logger.error("Verification unsuccessful. Response dict:")
+                current_app.logger.error(json.dumps(resp, indent=2))
+                status = "unverified"
+            results.append(
+                (status, time.time(), json.dumps(resp), row["transmission_id"])
+            )
+
+        with closing(connect()) as con:
+            con.executemany(
+                """
+                UPDATE webhook_events
+                SET status = ?, verified_at = ?, verification = ?, claimed_at = NULL
+                WHERE transmission_id = ?
+                """,
+                results,
+            )
+            con.executemany(
+                """
+                UPDATE webhook_events
+                SET status = ?, available_at = ?, claimed_at = NULL
+                WHERE transmission_id = ?
+                """,
+                failures,
+            )
+
+
+class CertificateCache:
+    """PayPal's webhook signing certificates, downloaded once per URL.
+
+    Certificates are only downloaded over HTTPS from `allowed_hosts` (or their
+    subdomains), must be issued to one of those hosts, must chain up to one of the
+    `trusted` CA certificates (through the intermediates served with them), and are
+    kept until they expire or for `ttl` seconds, whichever comes first.
+    """
+
+    def __init__(self, allowed_hosts, ttl, trusted):
+        self.allowed_hosts = allowed_hosts
+        self.ttl = ttl
+        self.trusted = dict()
+        for ca in trusted:
+            self.trusted.setdefault(ca.subject, []).append(ca)
+
+        self._certificates = dict()
+        self._lock = threading.Lock()
+
+    def is_allowed_host(self, host):
+        return any(
+            host == allowed or host.endswith(f".{allowed}")
+            for allowed in self.allowed_hosts
+        )
+
+    def verify_chain(self, certificate, intermediates):
+        """Raise ValueError unless the certificate chains up to a trusted CA."""
+        for _ in range(MAX_CHAIN_DEPTH + 1):
+            if not is_currently_valid(certificate):
+                raise ValueError(f"{certificate.subject} isn't currently valid")
+
+            for ca in self.trusted.get(certificate.issuer, []):
+                if is_issued_by(certificate, ca) and is_currently_valid(ca):
+                    return
+
+            for intermediate in intermediates:
+                if is_issued_by(certificate, intermediate) and is_ca(intermediate):
+                    certificate = intermediate
+                    break
+            else:
+                raise ValueError(f"{certificate.subject} isn't issued by a trusted CA")
+
+        raise ValueError(f"{certificate.subject} is too far from a trusted CA")
+
+    def add(self, cert_url, pem):
+        """Check and cache the PEM-encoded certificate (and its chain), returning it."""
+        certificate, *intermediates = x509.load_pem_x509_certificates(pem)
+
+        try:
+            self.verify_chain(certificate, intermediates)
+        except ValueError as exc:
+            raise ValueError(f"Certificate from {cert_url} isn't trusted: {exc}")
+
+        common_names = certificate.subject.get_attributes_for_oid(
+            x509.NameOID.COMMON_NAME
+        )
+        if not any(self.is_allowed_host(name.value) for name in common_names):
+            raise ValueError(f"Certificate from {cert_url} isn't issued to PayPal")
+
+        expires_at = min(
+            time.time() + self.ttl, certificate.not_valid_after_utc.timestamp()
+        )
+        with self._lock:
+            self._certificates[cert_url] = (certificate, expires_at)
+        return certificate
+
+    def get(self, cert_url):
+        """Return the certificate at `cert_url`, downloading it if necessary."""
+        with self._lock:
+            certificate, expires_at = self._certificates.get(cert_url, (None, 0))
+        if expires_at > time.time():
+            return certificate
+
+        url = urlsplit(cert_url)
+        if url.scheme != "https" or not self.is_allowed_host(url.hostname or ""):
+            raise ValueError(f"Refusing to download a certificate from {cert_url}")
+
+        response = upstream.get(cert_url)
+        response.raise_for_status()
+        return self.add(cert_url, response.content)
+
+
+def get_certificate_cache():
+    extension = current_app.extensions.setdefault("alice_webhooks", dict())
+    with _certificate_cache_lock:
+        if "certificates" not in extension:
+            ca_bundle = current_app.config["WEBHOOK_CERT_CA_BUNDLE"]
+            with open(ca_bundle or default_ca_bundle(), "rb") as f:
+                trusted = x509.load_pem_x509_certificates(f.read())
+            extension["certificates"] = CertificateCache(
+                current_app.config["WEBHOOK_CERT_HOSTS"],
+                current_app.config["WEBHOOK_CERT_CACHE_TTL"],
+                trusted,
+            )
+    return extension["certificates"]
+
+
+def is_currently_valid(certificate):
+    now = datetime.now(timezone.utc)
+    return certificate.not_valid_before_utc <= now <= certificate.not_valid_after_utc
+
+
+def is_issued_by(certificate, issuer):
+    """Whether `issuer` signed the certificate."""
+    try:
+        certificate.verify_directly_issued_by(issuer)
+    except (ValueError, TypeError, InvalidSignature):
+        return False
+    return True
+
+
+def is_ca(certificate):
+    try:
+        constraints = certificate.extensions.get_extension_for_class(
+            x509.BasicConstraints
+        )
+    except x509.ExtensionNotFound:
+        return False
+    return constraints.value.ca
+
+
+def verify_locally(webhook_headers, body):
+    """Verify the webhook's signature with its certificate, without calling the API.
+
+    The signature is over `<transmission ID>|<transmission time>|<webhook ID>|<CRC32
+    of the body>`. Returns False if the webhook can't be verified locally (e.g., the
+    `cryptography` package isn't installed), so it should be verified with the API.
+
+    Docs: https://developer.paypal.com/api/rest/webhooks/rest/#link-selfverificationmethod
+    """
+    hash_name = SIGNATURE_HASHES.get(webhook_headers.get("PayPal-Auth-Algo"))
+    webhook_id = current_app.config["WEBHOOK_ID"]
+    if x509 is None or hash_name is None or not webhook_id:
+        return False
+
+    try:
+        certificate = get_certificate_cache().get(webhook_headers["PayPal-Cert-Url"])
+    except Exception as exc:
+        current_app.logger.error(f"Failed to get webhook certificate: {exc}")
+        return False
+
+    crc = zlib.crc32(body.encode("utf-8"))
+    message = "|".join(
+        [
+            webhook_headers["PayPal-Transmission-Id"],
+            webhook_headers["PayPal-Transmission-Time"],
+            webhook_id,
+            str(crc),
+        ]
+    )
+    try:
+        certificate.public_key().verify(
+            base64.b64decode(webhook_headers["PayPal-Transmission-Sig"]),
+            message.encode("utf-8"),
+            padding.PKCS1v15(),
+            getattr(hashes, hash_name)(),
+        )
+    except (InvalidSignature, ValueError):
+        return False
+    return True
+
+
+def get_webhook_queue():
+    """Return this worker's webhook queue, starting its threads (e.g., after a fork)."""
+    extension = current_app.extensions.setdefault("alice_webhooks", dict())
+    pid = os.getpid()
+    with _queue_lock:
+        if extension.get("pid") != pid:
+            extension["queue"] = WebhookQueue(current_app._get_current_object())
+            extension["pid"] = pid
+    return extension["queue"]
+
+
 @bp.route("/", methods=("POST",))
 def listener():
-    webhook_body = request.json()
+    """Queue the webhook for verification and acknowledge it immediately.
+
+    Redeliveries (with the same PayPal-Transmission-Id) are acknowledged but not
+    queued again.
+    """
+    transmission_id = request.headers.get("PayPal-Transmission-Id")
+    if not transmission_id:
+        return jsonify({"error": "Missing PayPal-Transmission-Id header"}), 400
+
+    body = request.get_data(as_text=True)
+    try:
+        webhook_body = json.loads(body)
+    except json.decoder.JSONDecodeError:
+        return jsonify({"error": "Invalid JSON body"}), 400
+    if not isinstance(webhook_body, dict):
+        return jsonify({"error": "The JSON body must be an object"}), 400
     current_app.logger.debug(f"Webhook received:\n{json.dumps(webhook_body, indent=2)}")
 
-    webhook_headers = request.headers
+    with closing(connect()) as con:
+        con.execute(
+            """
+            INSERT OR IGNORE INTO webhook_events
+                (transmission_id, received_at, event_type, headers, body)
+            VALUES (?, ?, ?, ?, ?)
+            """,
+            (
+                transmission_id,
+                time.time(),
+                webhook_body.get("event_type"),
+                json.dumps(dict(request.headers)),
+                body,
+            ),
+        )
+
+    get_webhook_queue().notify()
+    return "", 202
+
 
-    verification_dict = to_verification_dict(webhook_headers, webhook_body)
-    resp = verify_webhook_signature(verification_dict)
+@bp.route("/events", methods=("GET",))
+def list_events():
+    """Return the most recently received webhooks, newest first.
 
-    if resp.get("verification_status") == "SUCCESS":
-        current_app.logger.debug("Verification successful!")
-    else:
-        current_app.logger.error("Verification unsuccessful. Response dict:")
-        current_app.logger.error(json.dumps(resp, indent=2))
+    Filter with the `status` (pending, processing, verified, unverified, error) and
+    `event-type` querystring parameters, and page with `limit` and `before` (a
+    `receivedAt` timestamp).
+    """
+    try:
+        before = float(request.args.get("before", "inf"))
+    except ValueError:
+        before = math.nan
+    if math.isnan(before):
+        return jsonify({"error": '"before" must be a timestamp'}), 400
+    limit = parse_positive_int(request.args.get("limit", 50))
+    if limit is None:
+        return jsonify({"error": '"limit" must be a positive integer'}), 400
+
+    query = "SELECT * FROM webhook_events WHERE received_at < ?"
+    params = [before]
+    if status := request.args.get("status"):
+        query += " AND status = ?"
+        params.append(status)
+    if event_type := request.args.get("event-type"):
+        query += " AND event_type = ?"
+        params.append(event_type)
+    query += " ORDER BY received_at DESC LIMIT ?"
+    params.append(min(limit, 500))
+
+    with closing(connect()) as con:
+        rows = con.execute(query, params).fetchall()
+
+    # Verify any events queued before a restart, even if no new webhooks arrive.
+    get_webhook_queue()
+    return jsonify({"events": [to_event_dict(row) for row in rows]})
+
+
+@bp.route("/events/<transmission_id>", methods=("GET",))
+def get_event(transmission_id):
+    with closing(connect()) as con:
+        row = con.execute(
+            "SELECT * FROM webhook_events WHERE transmission_id = ?",
+            (transmission_id,),
+        ).fetchone()
+
+    if row is None:
+        return jsonify({"error": f"No webhook {transmission_id}"}), 404
+    return jsonify(to_event_dict(row))
+
+
+def to_event_dict(row):
+    return {
+        "transmissionId": row["transmission_id"],
+        "receivedAt": row["received_at"],
+        "eventType": row["event_type"],
+        "status": row["status"],
+        "attempts": row["attempts"],
+        "verifiedAt": row["verified_at"],
+        "verification": row["verification"] and json.loads(row["verification"]),
+        "event": json.loads(row["body"]),
+    }
@@ -0,0 +1,177 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+
+import click
+from flask import current_app, request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Browsers never revalidate fingerprinted assets; a new build gets new names.
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+# The suffixes of precompressed files, by content encoding, preferred first.
+ENCODING_SUFFIXES = {"br": ".br", "gzip": ".gz"}
+
+# Relative ES module imports, e.g., `} from './utils.js'` or `import('./tabs.js')`.
+RELATIVE_IMPORT = re.compile(r"""((?:\bfrom|\bimport)\s*\(?\s*)(['"])\./([^'"/]+)\2""")
+
+
+class Assets:
+    """The static files, fingerprinted and precompressed into `build_folder`.
+
+    Each file is written as `<name>.<hash>.<ext>` (plus `.gz` and, if the `brotli`
+    package is installed, `.br` variants), and `manifest` maps original names to
+    fingerprinted ones. Relative imports between JS modules are rewritten to the
+    fingerprinted names as well, so that a module's hash covers its dependencies
+    and every page shares a single instance of each module.
+    """
+
+    def __init__(self, static_folder, build_folder):
+        self.static_folder = static_folder
+        self.build_folder = build_folder
+        self.manifest = dict()
+        self.encodings = dict()
+
+    def build(self):
+        os.makedirs(self.build_folder, exist_ok=True)
+        for filename in sorted(os.listdir(self.static_folder)):
+            if os.path.isfile(os.path.join(self.static_folder, filename)):
+                self._build_file(filename, visiting=set())
+
+        path = os.path.join(self.build_folder, "manifest.json")
+        self._write(path, json.dumps(self.manifest, indent=2).encode("utf-8"))
+        return self.manifest
+
+    def _build_file(self, filename, visiting):
+        """Fingerprint the file after (recursively) fingerprinting what it imports."""
+        if filename in self.manifest:
+            return self.manifest[filename]
+        if filename in visiting:
+            raise ValueError(f"Circular import of static file {filename}")
+        visiting.add(filename)
+
+        with open(os.path.join(self.static_folder, filename), "rb") as f:
+            content = f.read()
+
+        if filename.endswith(".js"):
+
+            def rewrite_import(match):
+                prefix, quote, dependency = match.groups()
+                if not os.path.isfile(os.path.join(self.static_folder, dependency)):
+                    return match.group(0)
+                built = self._build_file(dependency, visiting)
+                return f"{prefix}{quote}./{built}{quote}"
+
+            text = content.decode("utf-8")
+            content = RELATIVE_IMPORT.sub(rewrite_import, text).encode("utf-8")
+
+        digest = hashlib.sha256(content).hexdigest()[:12]
+        name, ext = os.path.splitext(filename)
+        built = f"{name}.{digest}{ext}"
+
+        path = os.path.join(self.build_folder, built)
+        self._write(path, content)
+        self.encodings[built] = self._precompress(path, content)
+        self.manifest[filename] = built
+        return built
+
+    def _precompress(self, path, content):
+        """Write the compressed variants of the file, returning their encodings."""
+        compressed = {"gzip": gzip.compress(content, compresslevel=9, mtime=0)}
+        if brotli is not None:
+            compressed["br"] = brotli.compress(content)
+
+        encodings = dict()
+        for encoding, data in compressed.items():
+            if len(data) < len(content):
+                suffix = ENCODING_SUFFIXES[encoding]
+                self._write(f"{path}{suffix}", data)
+                encodings[encoding] = suffix
+        return encodings
+
+    def _write(self, path, content):
+        """Atomically write the file, since every worker builds the same files."""
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
+
+
+def get_assets():
+    """Return the app's built assets, building them on first use.
+
+    Returns None if fingerprinting is disabled or the app is in debug mode, in which
+    case static files are served as they are.
+    """
+    if not current_app.config.get("HASHED_ASSETS") or current_app.debug:
+        return None
+
+    extension = current_app.extensions.setdefault("alice_assets", dict())
+    if "assets" not in extension:
+        build_folder = os.path.join(current_app.instance_path, "assets")
+        assets = Assets(current_app.static_folder, build_folder)
+        assets.build()
+        extension["assets"] = assets
+    return extension["assets"]
+
+
+def url_for(endpoint, **values):
+    """Like `flask.url_for`, but pointing static files to their fingerprinted names."""
+    if endpoint == "static" and "filename" in values:
+        assets = get_assets()
+        if assets is not None:
+            values["filename"] = assets.manifest.get(
+                values["filename"], values["filename"]
+            )
+    return current_app.url_for(endpoint, **values)
+
+
+def send_static_file(filename):
+    """Serve fingerprinted files precompressed and cached forever, others as usual."""
+    assets = get_assets()
+    if assets is None or filename not in assets.encodings:
+        return current_app.send_static_file(filename)
+
+    mimetype = mimetypes.guess_type(filename)[0] or "application/octet-stream"
+    encodings = assets.encodings[filename]
+    for encoding, suffix in ENCODING_SUFFIXES.items():
+        if encoding in encodings and request.accept_encodings[encoding]:
+            response = send_from_directory(
+                assets.build_folder,
+                f"{filename}{suffix}",
+                mimetype=mimetype,
+                max_age=IMMUTABLE_MAX_AGE,
+            )
+            response.headers["Content-Encoding"] = encoding
+            break
+    else:
+        response = send_from_directory(
+            assets.build_folder, filename, mimetype=mimetype, max_age=IMMUTABLE_MAX_AGE
+        )
+
+    response.cache_control.immutable = True
+    response.cache_control.public = True
+    response.vary.add("Accept-Encoding")
+    return response
+
+
+@click.command("build-assets")
+def build_assets_command():
+    """Fingerprint and precompress the static files."""
+    build_folder = os.path.join(current_app.instance_path, "assets")
+    assets = Assets(current_app.static_folder, build_folder)
+    for filename, built in assets.build().items():
+        click.echo(f"{filename} -> {built}")
+
+
+def init_app(app):
+    app.jinja_env.globals["url_for"] = url_for
+    app.view_functions["static"] = send_static_file
+    app.cli.add_command(build_assets_command)
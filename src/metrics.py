@@ -0,0 +1,264 @@
+import atexit
+import fcntl
+import glob
+import json
+import math
+import os
+import re
+import threading
+import time
+
+from contextlib import contextmanager
+from flask import Blueprint, Response, current_app, g, request
+
+bp = Blueprint("metrics", __name__, url_prefix="/")
+
+# Upper bounds (in seconds) of the latency histogram buckets.
+BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    math.inf,
+)
+
+# Path segments that look like IDs (e.g., order IDs) are replaced with "{id}"
+# to keep the number of label values bounded.
+ID_SEGMENT = re.compile(r"^(?=[^/]*\d)[A-Za-z0-9-]{8,}$")
+
+# The merged histograms of workers that have exited.
+ARCHIVE = "archive.json"
+
+
+class Metrics:
+    """Latency histograms recorded in this process and shared with the other workers.
+
+    Each worker periodically writes its histograms to its own file in `directory`,
+    and `render` merges every worker's file (and those of exited workers, see
+    `archive_worker_metrics`) into the Prometheus text format.
+    """
+
+    def __init__(self, directory, flush_interval):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._histograms = dict()
+        self._last_flush = 0
+        self.pid = os.getpid()
+
+        # A file under this PID was left by an exited worker whose PID was reused.
+        archive_worker_metrics(directory, self.pid)
+        atexit.register(self._flush_at_exit)
+
+    def observe(self, name, labels, value):
+        key = json.dumps([name, labels], sort_keys=True)
+        with self._lock:
+            histogram = self._histograms.setdefault(
+                key, {"buckets": [0] * len(BUCKETS), "sum": 0, "count": 0}
+            )
+            for i, bound in enumerate(BUCKETS):
+                if value <= bound:
+                    histogram["buckets"][i] += 1
+                    break
+            histogram["sum"] += value
+            histogram["count"] += 1
+
+            should_flush = time.monotonic() - self._last_flush >= self.flush_interval
+
+        if should_flush:
+            self.flush()
+
+    def flush(self):
+        """Write this process's histograms to its file in the metrics directory."""
+        with self._lock:
+            self._last_flush = time.monotonic()
+            data = json.dumps({"histograms": self._histograms})
+
+        path = os.path.join(self.directory, f"{os.getpid()}.json")
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def _flush_at_exit(self):
+        # Forked processes inherit this handler, but not this worker's histograms.
+        if os.getpid() == self.pid:
+            self.flush()
+
+    def collect(self):
+        """Return the histograms of every worker, merged."""
+        histograms = dict()
+        with archive_lock(self.directory, fcntl.LOCK_SH):
+            for path in glob.glob(os.path.join(self.directory, "*.json")):
+                data = read_metrics_file(path)
+                if data is not None:
+                    merge_histograms(histograms, data["histograms"])
+        return histograms
+
+    def render(self):
+        """Return every worker's metrics in the Prometheus text exposition format."""
+        self.flush()
+        histograms = self.collect()
+
+        lines = []
+        seen_names = set()
+        for key in sorted(histograms):
+            name, labels = json.loads(key)
+            histogram = histograms[key]
+            if name not in seen_names:
+                seen_names.add(name)
+                lines.append(f"# TYPE {name} histogram")
+
+            cumulative = 0
+            for bound, count in zip(BUCKETS, histogram["buckets"]):
+                cumulative += count
+                le = "+Inf" if bound == math.inf else str(bound)
+                lines.append(
+                    f"{name}_bucket{format_labels(labels | {'le': le})} {cumulative}"
+                )
+            lines.append(f"{name}_sum{format_labels(labels)} {histogram['sum']}")
+            lines.append(f"{name}_count{format_labels(labels)} {histogram['count']}")
+
+        return "\n".join(lines) + "\n"
+
+
+def merge_histograms(histograms, other):
+    """Add the counts of the histograms in `other` to those in `histograms`."""
+    for key, histogram in other.items():
+        merged = histograms.setdefault(
+            key, {"buckets": [0] * len(BUCKETS), "sum": 0, "count": 0}
+        )
+        merged["buckets"] = [
+            a + b for a, b in zip(merged["buckets"], histogram["buckets"])
+        ]
+        merged["sum"] += histogram["sum"]
+        merged["count"] += histogram["count"]
+
+
+def read_metrics_file(path):
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.decoder.JSONDecodeError):
+        return None
+
+
+@contextmanager
+def archive_lock(directory, operation):
+    """Hold a lock on the archive, so that no scrape sees a worker's counts twice."""
+    with open(os.path.join(directory, f"{ARCHIVE}.lock"), "a") as lock_file:
+        fcntl.flock(lock_file, operation)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def archive_worker_metrics(directory, pid):
+    """Fold the histograms of an exited worker into the archive, and remove its file.
+
+    Counters must never go backwards, so an exited worker's counts are kept rather
+    than dropped, and a new worker that reuses its PID starts from a fresh file.
+    Called by gunicorn's `child_exit` hook (see gunicorn.conf.py).
+    """
+    path = os.path.join(directory, f"{pid}.json")
+    if not os.path.exists(path):
+        return
+
+    with archive_lock(directory, fcntl.LOCK_EX):
+        data = read_metrics_file(path)
+        if data is not None:
+            archive_path = os.path.join(directory, ARCHIVE)
+            archive = read_metrics_file(archive_path) or {"histograms": dict()}
+            merge_histograms(archive["histograms"], data["histograms"])
+
+            tmp_path = f"{archive_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(archive, f)
+            os.replace(tmp_path, archive_path)
+        os.remove(path)
+
+
+def escape_label_value(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def format_labels(labels):
+    formatted = ",".join(
+        f'{key}="{escape_label_value(value)}"' for key, value in sorted(labels.items())
+    )
+    return f"{{{formatted}}}"
+
+
+def get_metrics():
+    """Return this worker's metrics, creating them (e.g., after a fork) if necessary."""
+    extension = current_app.extensions.setdefault("alice_metrics", dict())
+    pid = os.getpid()
+    if extension.get("pid") != pid:
+        directory = os.path.join(current_app.instance_path, "metrics")
+        extension["metrics"] = Metrics(
+            directory, current_app.config["METRICS_FLUSH_INTERVAL"]
+        )
+        extension["pid"] = pid
+    return extension["metrics"]
+
+
+def normalize_path(path):
+    segments = ["{id}" if ID_SEGMENT.match(s) else s for s in path.split("/")]
+    return "/".join(segments)
+
+
+def record_upstream_request(method, url, status, duration, debug_id=None):
+    """Record the duration of a request to the PayPal API.
+
+    Debug IDs are unique per request, so they're logged rather than used as labels.
+    """
+    endpoint_prefix = current_app.config["ENDPOINT_PREFIX"]
+    path = normalize_path(url.split("?")[0].removeprefix(endpoint_prefix))
+    labels = {"method": method, "path": path, "status": str(status)}
+    get_metrics().observe("alice_upstream_request_duration_seconds", labels, duration)
+    if debug_id is not None:
+        current_app.logger.info(
+            f"{method} {path} -> {status} in {duration:.3f}s (PayPal-Debug-Id: {debug_id})"
+        )
+
+
+def start_timer():
+    g.metrics_start = time.perf_counter()
+
+
+def record_request(response):
+    """Record the duration of the request Alice is responding to."""
+    if request.endpoint in (None, "static", "metrics.metrics"):
+        return response
+
+    duration = time.perf_counter() - g.metrics_start
+    labels = {
+        "method": request.method,
+        "endpoint": request.endpoint,
+        "status": str(response.status_code),
+    }
+    get_metrics().observe("alice_request_duration_seconds", labels, duration)
+    return response
+
+
+def init_app(app):
+    app.before_request(start_timer)
+    app.after_request(record_request)
+    app.register_blueprint(bp)
+
+
+@bp.route("metrics")
+def metrics():
+    """Return the latency histograms of every worker in the Prometheus text format."""
+    return Response(get_metrics().render(), mimetype="text/plain; version=0.0.4")
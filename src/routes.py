@@ -1,8 +1,36 @@
-from flask import Blueprint, current_app, render_template, request
+import hashlib
+
+from flask import Blueprint, current_app, make_response, render_template, request
 
 bp = Blueprint("routes", __name__, url_prefix="/")
 
 
+def render_page(template, **context):
+    """Render the template, reusing its output if it was rendered with the same context.
+
+    Pages only depend on their template and the partner/merchant config they're
+    rendered with, so the config is part of the cache key: reloading the config
+    simply renders (and caches) new pages. Responses carry an ETag so that browsers
+    can revalidate them with `If-None-Match`. Nothing is cached while templates are
+    auto-reloaded (e.g., in debug mode).
+    """
+    if current_app.debug or current_app.jinja_env.auto_reload:
+        return render_template(template, **context)
+
+    pages = current_app.extensions.setdefault("alice_rendered_pages", dict())
+    key = (template, request.script_root, tuple(sorted(context.items())))
+    try:
+        page, etag = pages[key]
+    except KeyError:
+        page = render_template(template, **context)
+        etag = hashlib.sha256(page.encode("utf-8")).hexdigest()[:32]
+        pages[key] = (page, etag)
+
+    response = make_response(page)
+    response.set_etag(etag)
+    return response.make_conditional(request)
+
+
 def get_partner_and_merchant_config(is_fastlane=False, is_direct_merchant=False):
     if is_fastlane:
         if is_direct_merchant:
@@ -36,7 +64,7 @@ def onboarding():
     partner_config = get_partner_and_merchant_config()
     del partner_config["merchant_id"]
 
-    return render_template(
+    return render_page(
         template,
         **partner_config,
         favicon=current_app.config["favicon"],
@@ -52,7 +80,7 @@ def checkout_branded():
     template = "checkout-branded.html"
     partner_and_merchant_config = get_partner_and_merchant_config()
 
-    return render_template(
+    return render_page(
         template,
         method="branded",
         **partner_and_merchant_config,
@@ -67,7 +95,7 @@ def checkout_google_pay():
     template = "checkout-google-pay.html"
     partner_and_merchant_config = get_partner_and_merchant_config()
 
-    return render_template(
+    return render_page(
         template,
         method="google-pay",
         **partner_and_merchant_config,
@@ -82,7 +110,7 @@ def checkout_hosted_v1():
     template = "checkout-hf-v1.html"
     partner_and_merchant_config = get_partner_and_merchant_config()
 
-    return render_template(
+    return render_page(
         template,
         method="hosted-v1",
         **partner_and_merchant_config,
@@ -97,7 +125,7 @@ def checkout_hosted_v2():
     template = "checkout-hf-v2.html"
     partner_and_merchant_config = get_partner_and_merchant_config()
 
-    return render_template(
+    return render_page(
         template,
         method="hosted-v2",
         **partner_and_merchant_config,
@@ -116,7 +144,7 @@ def checkout_fastlane():
         is_fastlane=True, is_direct_merchant=is_direct_merchant
     )
 
-    return render_template(
+    return render_page(
         template,
         method="fastlane",
         **partner_and_merchant_config,
@@ -131,7 +159,7 @@ def statuses():
     template = "statuses.html"
     partner_and_merchant_config = get_partner_and_merchant_config()
 
-    return render_template(
+    return render_page(
         template,
         **partner_and_merchant_config,
         favicon=current_app.config["favicon"],
@@ -0,0 +1,126 @@
+import json
+import re
+
+import pytest
+import requests
+from requests.adapters import BaseAdapter
+from requests.structures import CaseInsensitiveDict
+from urllib.parse import urlsplit
+
+from config import FastlaneMerchantConfig, FastlanePartnerConfig
+from config import MerchantConfig, PartnerConfig
+from src import create_app
+from src.api import upstream
+
+PARTNER_OPTIONS = {
+    "partner-id": "TESTPARTNER01",
+    "partner-client-id": "test-client-id",
+    "partner-secret": "test-secret",
+    "partner-bn-code": "TEST_BN_CODE",
+    "merchant-id": "TESTMERCHANT1",
+}
+
+
+class FakePayPal(BaseAdapter):
+    """A transport answering upstream requests from handlers registered by route.
+
+    Handlers receive the prepared request and the groups matched in its path, and
+    return a `(status, body)` pair, where a body of bytes is sent as it is and any
+    other is sent as JSON, optionally followed by a dict of extra headers. Unknown
+    routes get a 404.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.routes = []
+        self.calls = []
+        self.route("POST", "/v1/oauth2/token", self.issue_access_token)
+
+    def route(self, method, pattern, handler):
+        self.routes.insert(0, (method, re.compile(pattern), handler))
+
+    def issue_access_token(self, request):
+        token = f"A21AA-test-{len(self.calls)}"
+        return 200, {"access_token": token, "token_type": "Bearer", "expires_in": 32400}
+
+    def paths(self, method=None):
+        return [
+            urlsplit(call.url).path
+            for call in self.calls
+            if method is None or call.method == method
+        ]
+
+    def send(self, request, **kwargs):
+        self.calls.append(request)
+        path = urlsplit(request.url).path
+        for method, pattern, handler in self.routes:
+            match = pattern.fullmatch(path)
+            if method == request.method and match:
+                status, body, *headers = handler(request, *match.groups())
+                break
+        else:
+            status, body, headers = 404, {"name": "RESOURCE_NOT_FOUND"}, []
+
+        response = upstream.Response()
+        response.status_code = status
+        response.reason = "OK" if status < 400 else "Error"
+        response.headers = CaseInsensitiveDict(
+            {
+                "Content-Type": "application/json",
+                "PayPal-Debug-Id": f"f{len(self.calls):012x}",
+            }
+        )
+        if isinstance(body, bytes):
+            response.headers["Content-Type"] = "application/octet-stream"
+            response._content = body
+        else:
+            response._content = json.dumps(body).encode("utf-8")
+        for extra_headers in headers:
+            response.headers.update(extra_headers)
+        response.encoding = "utf-8"
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def app(tmp_path):
+    app = create_app()
+    app.config.from_object(PartnerConfig)
+    app.config.from_object(MerchantConfig)
+    app.config.from_object(FastlanePartnerConfig)
+    app.config.from_object(FastlaneMerchantConfig)
+    app.config.update(
+        TESTING=True,
+        PARTNER_ID=PARTNER_OPTIONS["partner-id"],
+        PARTNER_CLIENT_ID=PARTNER_OPTIONS["partner-client-id"],
+        PARTNER_SECRET=PARTNER_OPTIONS["partner-secret"],
+        PARTNER_BN_CODE=PARTNER_OPTIONS["partner-bn-code"],
+        HTTP_RETRY_BACKOFF=0,
+        favicon="",
+    )
+    app.instance_path = str(tmp_path)
+    return app
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def paypal(monkeypatch):
+    """Answer every upstream request with a `FakePayPal`."""
+    fake = FakePayPal()
+
+    def build_session(config):
+        session = requests.Session()
+        session.mount("https://", fake)
+        session.mount("http://", fake)
+        return session
+
+    monkeypatch.setattr(upstream, "build_session", build_session)
+    return fake
@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from conftest import PARTNER_OPTIONS
+
+BATCH_ROUTES = [
+    ("/api/orders/batch", {"count": 1}),
+    ("/api/vault/bulk", {"count": 1}),
+    ("/api/vault/purge", {"customer-ids": ["CUSTOMER1"]}),
+    ("/api/flows/", {"steps": ["get-order"], "order-id": "ORDER1"}),
+]
+
+
+@pytest.mark.parametrize("url, options", BATCH_ROUTES)
+@pytest.mark.parametrize("concurrency", [0, -1, "abc", None])
+def test_invalid_concurrency_is_rejected(client, paypal, url, options, concurrency):
+    response = client.post(
+        url, json=PARTNER_OPTIONS | options | {"concurrency": concurrency}
+    )
+
+    assert response.status_code == 400
+    assert "concurrency" in response.get_json()["error"]
+    assert paypal.calls == []
+
+
+@pytest.mark.parametrize("url, options", BATCH_ROUTES)
+def test_access_token_is_fetched_once_per_batch(client, paypal, url, options):
+    response = client.post(
+        url, json=PARTNER_OPTIONS | options | {"count": 3, "concurrency": 99}
+    )
+    response.get_data()
+
+    assert response.status_code == 200
+    assert paypal.paths().count("/v1/oauth2/token") == 1
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"orders": 5},
+        {"orders": [{"intent": "CAPTURE"}, "AUTHORIZE"]},
+        {"count": "abc"},
+        {"count": 0},
+        {"matrix": {"intent": "CAPTURE"}},
+        {"matrix": ["intent"]},
+    ],
+)
+def test_invalid_batch_orders_are_rejected(client, paypal, options):
+    response = client.post("/api/orders/batch", json=PARTNER_OPTIONS | options)
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+    assert paypal.calls == []
+
+
+def test_batch_orders_cover_the_matrix(client, paypal):
+    paypal.route("POST", r"/v2/checkout/orders", lambda request: (201, {"id": "1"}))
+    matrix = {"intent": ["CAPTURE", "AUTHORIZE"], "payment-source": ["paypal"]}
+
+    options = {"item-price": "10.00", "item-tax": "0.00", "matrix": matrix, "count": 2}
+
+    response = client.post("/api/orders/batch", json=PARTNER_OPTIONS | options)
+
+    lines = response.get_data(as_text=True).splitlines()
+    assert len(lines) == 4
+    intents = [json.loads(call.body)["intent"] for call in paypal.calls[1:]]
+    assert sorted(intents) == ["AUTHORIZE"] * 2 + ["CAPTURE"] * 2
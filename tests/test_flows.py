@@ -0,0 +1,128 @@
+import json
+
+import pytest
+
+from conftest import PARTNER_OPTIONS
+
+ORDER_OPTIONS = PARTNER_OPTIONS | {
+    "intent": "AUTHORIZE",
+    "payment-source": "paypal",
+    "item-price": "100.00",
+    "item-tax": "7.50",
+    "item-category": "PHYSICAL_GOODS",
+}
+
+
+@pytest.fixture
+def payments(paypal):
+    """PayPal's order, authorization and capture endpoints."""
+
+    def create_order(request):
+        return 201, {"id": "ORDER0000001", "status": "CREATED"}
+
+    def authorize_order(request, order_id):
+        authorization = {"id": f"AUTH-{order_id}", "status": "CREATED"}
+        return 201, {
+            "id": order_id,
+            "status": "COMPLETED",
+            "purchase_units": [{"payments": {"authorizations": [authorization]}}],
+        }
+
+    def capture_authorization(request, auth_id):
+        return 201, {"id": f"CAPTURE-{auth_id}", "status": "COMPLETED"}
+
+    def get_authorization(request, auth_id):
+        return 200, {"id": auth_id, "status": "CAPTURED"}
+
+    def refund_capture(request, capture_id):
+        return 201, {"id": f"REFUND-{capture_id}", "status": "COMPLETED"}
+
+    paypal.route("POST", r"/v2/checkout/orders", create_order)
+    paypal.route("POST", r"/v2/checkout/orders/([^/]+)/authorize", authorize_order)
+    paypal.route(
+        "POST", r"/v2/payments/authorizations/([^/]+)/capture", capture_authorization
+    )
+    paypal.route("GET", r"/v2/payments/authorizations/([^/]+)", get_authorization)
+    paypal.route("POST", r"/v2/payments/captures/([^/]+)/refund", refund_capture)
+    return paypal
+
+
+def run_flow(client, steps, **options):
+    response = client.post(
+        "/api/flows/", json={"steps": steps} | ORDER_OPTIONS | options
+    )
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+
+
+def test_authorize_intent_flow_threads_ids_through_every_step(client, payments):
+    steps = [
+        "create-order",
+        "authorize-order",
+        "capture-order",
+        "get-authorization",
+        "refund-capture",
+    ]
+    (iteration,) = run_flow(client, steps)
+
+    results = iteration["steps"]
+    assert [result["action"] for result in results] == steps
+    assert not [result for result in results if "error" in result]
+    assert results[1]["authId"] == "AUTH-ORDER0000001"
+    assert results[2]["captureId"] == "CAPTURE-AUTH-ORDER0000001"
+    assert payments.paths() == [
+        "/v1/oauth2/token",
+        "/v2/checkout/orders",
+        "/v2/checkout/orders/ORDER0000001/authorize",
+        "/v2/payments/authorizations/AUTH-ORDER0000001/capture",
+        "/v2/payments/authorizations/AUTH-ORDER0000001",
+        "/v2/payments/captures/CAPTURE-AUTH-ORDER0000001/refund",
+    ]
+
+
+def test_capturing_an_authorize_intent_order_returns_its_authorization(
+    client, payments
+):
+    (iteration,) = run_flow(
+        client, ["create-order", "capture-order", "get-authorization"]
+    )
+
+    results = iteration["steps"]
+    assert not [result for result in results if "error" in result]
+    assert results[1]["authId"] == "AUTH-ORDER0000001"
+    assert payments.paths("GET") == ["/v2/payments/authorizations/AUTH-ORDER0000001"]
+
+
+def test_flow_stops_at_unknown_action(client, payments):
+    (iteration,) = run_flow(client, ["create-order", "settle-order", "capture-order"])
+
+    results = iteration["steps"]
+    assert [result["action"] for result in results] == ["create-order", "settle-order"]
+    assert results[1]["error"] == "Unknown action: settle-order"
+
+
+def test_iterations_are_streamed_as_separate_lines(client, payments):
+    iterations = run_flow(client, ["create-order"], iterations=3, concurrency=2)
+
+    assert sorted(iteration["iteration"] for iteration in iterations) == [0, 1, 2]
+    assert all(iteration["steps"][0]["orderId"] for iteration in iterations)
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {"steps": None},
+        {"steps": []},
+        {"steps": "create-order"},
+        {"steps": [{"options": {}}]},
+        {"steps": [{"action": "create-order", "options": []}]},
+        {"steps": ["create-order"], "iterations": 0},
+        {"steps": ["create-order"], "iterations": "abc"},
+    ],
+)
+def test_invalid_flows_are_rejected(client, payments, options):
+    response = client.post("/api/flows/", json=ORDER_OPTIONS | options)
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+    assert payments.calls == []
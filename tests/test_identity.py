@@ -0,0 +1,123 @@
+import pytest
+
+from conftest import PARTNER_OPTIONS
+
+
+@pytest.fixture
+def client_tokens(paypal):
+    """PayPal's generate-token endpoint, answering with the appended statuses in turn.
+
+    The last status is repeated; it's 200 if none were appended.
+    """
+    statuses = []
+
+    def generate_token(request):
+        status = statuses.pop(0) if len(statuses) > 1 else (statuses or [200])[0]
+        if status != 200:
+            return status, {"name": "INTERNAL_SERVICE_ERROR"}
+        return 200, {
+            "client_token": f"CLIENT-TOKEN-{len(paypal.calls)}",
+            "expires_in": 3600,
+        }
+
+    paypal.route("POST", r"/v1/identity/generate-token", generate_token)
+    return statuses
+
+
+def get_client_token(client, query="", **options):
+    response = client.post(
+        f"/api/identity/client-token{query}", json=PARTNER_OPTIONS | options
+    )
+    return response.get_json()
+
+
+def get_sdk_token(client, query="", **options):
+    response = client.post(
+        f"/api/identity/sdk-token{query}", json=PARTNER_OPTIONS | options
+    )
+    return response.get_json()
+
+
+def sdk_token_requests(paypal):
+    return [call for call in paypal.calls if "sdk_init" in (call.body or "")]
+
+
+def test_client_token_is_served_from_the_cache(client, paypal, client_tokens):
+    first = get_client_token(client)
+    second = get_client_token(client)
+
+    assert first["clientToken"] == second["clientToken"]
+    assert "client-token" in first["formatted"]
+    assert second["formatted"] == {}
+    assert paypal.paths().count("/v1/identity/generate-token") == 1
+
+
+def test_ignore_cache_bypasses_the_cache(client, paypal, client_tokens):
+    first = get_client_token(client)
+    second = get_client_token(client, "?ignore-cache=true")
+
+    assert first["clientToken"] != second["clientToken"]
+    assert "client-token" in second["formatted"]
+    assert "expiresIn" not in second
+    assert paypal.paths().count("/v1/identity/generate-token") == 2
+
+
+def test_client_tokens_are_cached_per_merchant(client, paypal, client_tokens):
+    first = get_client_token(client, **{"merchant-id": "SELLER1"})
+    second = get_client_token(client, **{"merchant-id": "SELLER2"})
+
+    assert first["clientToken"] != second["clientToken"]
+    assert get_client_token(client, **{"merchant-id": "SELLER1"}) == first | {
+        "formatted": {}
+    }
+
+
+def test_failed_client_token_isnt_cached(client, paypal, client_tokens):
+    client_tokens.extend([500, 200])
+
+    failed = get_client_token(client)
+    retried = get_client_token(client)
+
+    assert "clientToken" not in failed
+    assert retried["clientToken"]
+    assert "client-token" in retried["formatted"]
+    assert paypal.paths().count("/v1/identity/generate-token") == 2
+
+
+def test_sdk_tokens_are_cached_per_merchant_and_auth_assertion(client, paypal):
+    tokens = [
+        get_sdk_token(client, **{"merchant-id": "SELLER1"}),
+        get_sdk_token(client, **{"merchant-id": "SELLER2"}),
+        get_sdk_token(
+            client, "?include-auth-assertion=true", **{"merchant-id": "SELLER1"}
+        ),
+    ]
+    cached = [
+        get_sdk_token(client, **{"merchant-id": "SELLER1"}),
+        get_sdk_token(
+            client, "?include-auth-assertion=true", **{"merchant-id": "SELLER1"}
+        ),
+    ]
+
+    assert len({token["sdkToken"] for token in tokens}) == 3
+    assert [token["sdkToken"] for token in cached] == [
+        tokens[0]["sdkToken"],
+        tokens[2]["sdkToken"],
+    ]
+    assert all(token["formatted"] == {} for token in cached)
+    assert len(sdk_token_requests(paypal)) == 3
+    assert "PayPal-Auth-Assertion" in sdk_token_requests(paypal)[2].headers
+
+
+def test_failed_sdk_token_isnt_cached(client, paypal):
+    paypal.route(
+        "POST", "/v1/oauth2/token", lambda request: (401, {"error": "invalid_client"})
+    )
+
+    failed = get_sdk_token(client, **{"merchant-id": "SELLER1"})
+    paypal.routes.pop(0)
+    retried = get_sdk_token(client, **{"merchant-id": "SELLER1"})
+
+    assert "sdkToken" not in failed
+    assert retried["sdkToken"]
+    assert len(sdk_token_requests(paypal)) == 2
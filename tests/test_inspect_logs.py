@@ -0,0 +1,121 @@
+import json
+import sqlite3
+
+import pytest
+
+from logs import inspect_logs
+
+ROUTES = ["/api/orders/", "/api/vault/bulk"]
+
+
+def log_line(i):
+    """Return the i-th line of a log spanning two hours, with every 7th request failing."""
+    seconds = i * 37 % 7200
+    return json.dumps(
+        {
+            "date_time": f"[30/Aug/2023:{13 + seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d} -0400]",
+            "remote_address": "127.0.0.1",
+            "referer": "-",
+            "method": "POST",
+            "url_path": ROUTES[i % len(ROUTES)],
+            "status": 500 if i % 7 == 0 else 200,
+            "user_agent": "curl/8.4.0",
+            "request_time_in_seconds": i % 100 / 40,
+        }
+    )
+
+
+def write_log(path, lines, mode="w"):
+    with open(path, mode) as f:
+        f.write("".join(f"{line}\n" for line in lines))
+
+
+def dump(con):
+    """Return the contents of the access table and every rollup table."""
+    tables = ["access", "access_latency_histogram"]
+    tables += [f"access_rollup_{name}" for name in inspect_logs.ROLLUP_RESOLUTIONS]
+    return {
+        table: sorted(con.execute(f"SELECT * FROM {table}").fetchall())
+        for table in tables
+    }
+
+
+@pytest.fixture
+def load(tmp_path):
+    """Ingest a log into a new database, returning its connection."""
+
+    def load(log_file, **kwargs):
+        con = sqlite3.connect(tmp_path / f"{len(list(tmp_path.glob('*.db')))}.db")
+        inspect_logs.load_logs(con, str(log_file), **kwargs)
+        return con
+
+    return load
+
+
+def test_rollups_dont_depend_on_the_chunk_size(tmp_path, load):
+    log_file = tmp_path / "access_log.log"
+    write_log(log_file, map(log_line, range(1000)))
+
+    tables = dump(load(log_file))
+
+    assert dump(load(log_file, chunk_size=7)) == tables
+    hours = tables["access_rollup_hour"]
+    assert sum(count for _, _, count, *_ in hours) == 1000
+    assert sum(error_count for _, _, _, error_count, *_ in hours) == 143
+
+
+def test_rollups_are_added_to_by_later_runs(tmp_path, load):
+    log_file = tmp_path / "access_log.log"
+    write_log(log_file, map(log_line, range(1000)))
+    expected = dump(load(log_file))
+
+    write_log(log_file, map(log_line, range(600)))
+    con = load(log_file, chunk_size=100)
+    write_log(log_file, map(log_line, range(600, 1000)), mode="a")
+    inspect_logs.load_logs(con, str(log_file), chunk_size=100)
+
+    assert dump(con) == expected
+
+
+def test_rollup_percentiles_are_exact(tmp_path, load):
+    log_file = tmp_path / "access_log.log"
+    write_log(log_file, map(log_line, range(1000)))
+
+    con = load(log_file, chunk_size=10)
+
+    rows = con.execute(
+        "SELECT date_time - date_time % 3600, url_path, request_time_in_seconds"
+        " FROM access"
+    ).fetchall()
+    for bucket, url_path, count, _, p50, p95, p99 in con.execute(
+        "SELECT * FROM access_rollup_hour"
+    ):
+        latencies = sorted(row[2] for row in rows if row[:2] == (bucket, url_path))
+        assert len(latencies) == count
+        assert (p50, p95, p99) == tuple(
+            inspect_logs.percentile(latencies, q) for q in (0.5, 0.95, 0.99)
+        )
+
+
+def test_parallel_ingestion_matches_serial_ingestion(tmp_path, load):
+    log_file = tmp_path / "access_log.log"
+    write_log(log_file, map(log_line, range(300)))
+    with open(log_file, "a") as f:
+        f.write(log_line(300)[:50])  # A line still being written.
+    range_size = 1000
+    content = log_file.read_bytes()
+    boundaries = range(range_size, len(content), range_size)
+    assert any(content[boundary - 1] != ord("\n") for boundary in boundaries)
+
+    serial = load(log_file)
+    parallel = sqlite3.connect(tmp_path / "parallel.db")
+    inspect_logs.create_table(parallel)
+    offset = inspect_logs.ingest_file_in_parallel(
+        parallel, str(log_file), "access_log.log", 0, 1, 2, range_size=range_size
+    )
+    inspect_logs.update_percentiles(parallel)
+
+    assert dump(parallel) == dump(serial)
+    assert len(dump(parallel)["access"]) == 300
+    assert offset == content.rindex(b"\n") + 1
+    assert serial.execute("SELECT offset FROM ingest_state").fetchone() == (offset,)
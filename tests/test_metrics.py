@@ -0,0 +1,56 @@
+import json
+import os
+
+from src.metrics import Metrics, archive_worker_metrics
+
+LABELS = {"method": "GET", "endpoint": "routes.checkout", "status": "200"}
+
+
+def write_worker_file(directory, pid, count):
+    """Write the file a worker with the given PID would have flushed."""
+    key = json.dumps(["alice_request_duration_seconds", LABELS], sort_keys=True)
+    buckets = [count] + [0] * 12
+    histogram = {"buckets": buckets, "sum": 0.001 * count, "count": count}
+    with open(os.path.join(directory, f"{pid}.json"), "w") as f:
+        json.dump({"histograms": {key: histogram}}, f)
+
+
+def total_count(metrics):
+    return sum(histogram["count"] for histogram in metrics.collect().values())
+
+
+def test_exited_workers_counts_are_kept_once_their_file_is_gone(tmp_path):
+    metrics = Metrics(str(tmp_path), flush_interval=0)
+    metrics.observe("alice_request_duration_seconds", LABELS, 0.002)
+    write_worker_file(tmp_path, 999991, count=5)
+    write_worker_file(tmp_path, 999992, count=7)
+    assert total_count(metrics) == 13
+
+    archive_worker_metrics(str(tmp_path), 999991)
+    archive_worker_metrics(str(tmp_path), 999992)
+    archive_worker_metrics(str(tmp_path), 999992)  # Exit hooks may be repeated.
+
+    assert not (tmp_path / "999991.json").exists()
+    assert not (tmp_path / "999992.json").exists()
+    assert total_count(metrics) == 13
+
+
+def test_reused_pid_doesnt_make_counters_go_backwards(tmp_path):
+    write_worker_file(tmp_path, os.getpid(), count=50)
+
+    metrics = Metrics(str(tmp_path), flush_interval=0)
+    metrics.observe("alice_request_duration_seconds", LABELS, 0.002)
+
+    assert total_count(metrics) == 51
+
+
+def test_debug_ids_are_not_labels(app, paypal):
+    paypal.route("GET", r"/v2/checkout/orders/([^/]+)", lambda request, _: (200, {}))
+    with app.app_context():
+        from src.api import upstream
+
+        upstream.get(f"{app.config['ENDPOINT_PREFIX']}/v2/checkout/orders/5O190127TN")
+
+    text = app.test_client().get("/metrics").get_data(as_text=True)
+    assert 'path="/v2/checkout/orders/{id}"' in text
+    assert "debug_id" not in text
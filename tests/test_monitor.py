@@ -0,0 +1,132 @@
+import json
+import time
+
+from contextlib import closing
+
+import pytest
+
+from conftest import PARTNER_OPTIONS
+from src.api import monitor
+
+PARTNER_ID = PARTNER_OPTIONS["partner-id"]
+
+
+def test_diff_returns_only_the_changed_leaves():
+    old = {"payments_receivable": False, "products": [{"name": "PPCP_CUSTOM"}]}
+    new = {
+        "payments_receivable": True,
+        "products": [{"name": "PPCP_CUSTOM"}, {"name": "PAYMENT_METHODS"}],
+    }
+
+    assert monitor.diff(old, new) == {
+        "payments_receivable": [False, True],
+        "products.1.name": [None, "PAYMENT_METHODS"],
+    }
+    assert monitor.diff(None, {"merchant_id": "SELLER1"}) == {
+        "merchant_id": [None, "SELLER1"]
+    }
+    assert monitor.diff(new, new) == {}
+
+
+def test_next_interval_backs_off_until_a_change(app):
+    app.config.update(
+        SELLER_MONITOR_MIN_INTERVAL=30,
+        SELLER_MONITOR_MAX_INTERVAL=100,
+        SELLER_MONITOR_ONBOARDED_INTERVAL=1000,
+    )
+    with app.app_context():
+        intervals = [None]
+        for _ in range(4):
+            intervals.append(monitor.next_interval(intervals[-1], "pending", False))
+
+        assert intervals[1:] == [30, 60, 100, 100]
+        assert monitor.next_interval(100, "pending", True) == 30
+        assert monitor.next_interval(30, "onboarded", True) == 1000
+
+
+@pytest.fixture
+def integrations(paypal):
+    """PayPal's merchant integration endpoints, serving the integrations by merchant ID."""
+    integrations = {}
+
+    def get_merchant_id(request):
+        tracking_id = request.url.split("tracking_id=")[1]
+        for merchant_id, integration in integrations.items():
+            if integration.get("tracking_id") == tracking_id:
+                return 200, {"merchant_id": merchant_id}
+        return 404, {"name": "RESOURCE_NOT_FOUND"}
+
+    def get_integration(request, merchant_id):
+        return 200, integrations[merchant_id]
+
+    paypal.route(
+        "GET", r"/v1/customer/partners/[^/]+/merchant-integrations", get_merchant_id
+    )
+    paypal.route(
+        "GET",
+        r"/v1/customer/partners/[^/]+/merchant-integrations/([^/]+)",
+        get_integration,
+    )
+    return integrations
+
+
+@pytest.fixture
+def seller_monitor(app):
+    """A seller monitor without its thread, which polls the due sellers on `poll`."""
+    with app.app_context():
+        seller_monitor = monitor.SellerMonitor.__new__(monitor.SellerMonitor)
+
+        def add(merchant_id=None, tracking_id=None):
+            with closing(monitor.connect()) as con:
+                con.execute(
+                    "INSERT INTO monitored_sellers"
+                    " (partner_id, merchant_id, tracking_id, added_at) VALUES (?, ?, ?, ?)",
+                    (PARTNER_ID, merchant_id, tracking_id, time.time()),
+                )
+
+        def poll():
+            with closing(monitor.connect()) as con:
+                con.execute("UPDATE monitored_sellers SET next_check_at = 0")
+            seller_monitor.poll_batch(seller_monitor.claim_batch())
+
+        seller_monitor.add = add
+        seller_monitor.poll = poll
+        yield seller_monitor
+
+
+def get_seller(client, seller_id):
+    return client.get(f"/api/monitor/sellers/{seller_id}").get_json()
+
+
+def test_only_changes_are_stored(client, integrations, seller_monitor):
+    integrations["SELLER1"] = {"merchant_id": "SELLER1", "payments_receivable": False}
+    seller_monitor.add(merchant_id="SELLER1")
+
+    seller_monitor.poll()
+    seller_monitor.poll()
+    integrations["SELLER1"] = integrations["SELLER1"] | {"payments_receivable": True}
+    seller_monitor.poll()
+
+    seller = get_seller(client, "SELLER1")
+    assert seller["status"] == "onboarded"
+    changes = [change["changes"] for change in seller["changes"]]
+    assert changes == [
+        {"merchant_id": [None, "SELLER1"], "payments_receivable": [None, False]},
+        {"payments_receivable": [False, True]},
+    ]
+
+
+def test_seller_added_by_both_ids_is_merged(client, integrations, seller_monitor):
+    integrations["SELLER1"] = {"merchant_id": "SELLER1", "tracking_id": "TRACKING1"}
+    seller_monitor.add(merchant_id="SELLER1")
+    seller_monitor.poll()
+    seller_monitor.add(tracking_id="TRACKING1")
+
+    seller_monitor.poll()
+
+    with closing(monitor.connect()) as con:
+        rows = con.execute("SELECT merchant_id, tracking_id FROM monitored_sellers")
+        assert [tuple(row) for row in rows] == [("SELLER1", "TRACKING1")]
+    seller = get_seller(client, "TRACKING1")
+    assert seller["merchantId"] == "SELLER1"
+    assert len(seller["changes"]) == 2  # The duplicate's, and the seller's own.
@@ -0,0 +1,73 @@
+import copy
+import itertools
+
+import pytest
+
+from conftest import PARTNER_OPTIONS
+from src.api import orders
+
+OPTION_SETS = [
+    {"intent": "CAPTURE"},
+    {"intent": "CAPTURE", "item-category": "None"},
+    {
+        "intent": "AUTHORIZE",
+        "item-category": "PHYSICAL_GOODS",
+        "include-shipping-address": True,
+        "include-shipping-options": True,
+    },
+    {
+        "intent": "CAPTURE",
+        "item-category": "DIGITAL_GOODS",
+        "include-shipping-options": True,
+        "disbursement-mode": "DELAYED",
+        "partner-fee": "1.50",
+        "reference-id": "REFERENCE-1",
+        "include-custom-purchase-unit-field": True,
+        "custom-purchase-unit-key": "invoice_id",
+        "custom-purchase-unit-value": '"INVOICE-1"',
+    },
+]
+
+AMOUNTS = [
+    {"item-price": "100.00", "item-tax": "7.50"},
+    {"item-price": "0.99"},
+    {"item-price": "12345.67", "item-tax": "0.01"},
+]
+
+
+def build_purchase_unit(options):
+    return orders.Order(**PARTNER_OPTIONS | options).build_purchase_unit()
+
+
+@pytest.mark.parametrize("options", OPTION_SETS)
+def test_cached_purchase_units_equal_uncached_ones(app, monkeypatch, options):
+    monkeypatch.setattr(orders, "purchase_unit_templates", dict())
+    with app.app_context():
+        uncached = []
+        for amounts in AMOUNTS:
+            orders.purchase_unit_templates.clear()
+            uncached.append(build_purchase_unit(options | amounts))
+
+        # Build every amount twice over, each from the template the previous built.
+        cached = [
+            copy.deepcopy(build_purchase_unit(options | amounts))
+            for amounts in itertools.chain(AMOUNTS, AMOUNTS)
+        ]
+
+    assert len(orders.purchase_unit_templates) == 1
+    assert cached == uncached + uncached
+    assert len({purchase_unit["amount"]["value"] for purchase_unit in cached}) == 3
+
+
+def test_option_sets_get_their_own_templates(app, monkeypatch):
+    monkeypatch.setattr(orders, "purchase_unit_templates", dict())
+    with app.app_context():
+        purchase_units = [
+            build_purchase_unit(options | AMOUNTS[0]) for options in OPTION_SETS
+        ]
+
+    assert len(orders.purchase_unit_templates) == len(OPTION_SETS)
+    assert "category" not in purchase_units[1]["items"][0]
+    assert purchase_units[2]["shipping"]["options"][0]["id"] == "shipping-default"
+    assert "shipping" in purchase_units[2]["amount"]["breakdown"]
+    assert purchase_units[3]["invoice_id"] == "INVOICE-1"
@@ -0,0 +1,66 @@
+import pytest
+
+from conftest import PARTNER_OPTIONS
+from src.api import partner
+
+MERCHANT_ID = "SELLER1"
+TRACKING_ID = "TRACKING1"
+
+
+@pytest.fixture
+def merchant_integrations(paypal):
+    """PayPal's merchant integration endpoints, for a single onboarded seller."""
+    integration = {
+        "merchant_id": MERCHANT_ID,
+        "tracking_id": TRACKING_ID,
+        "payments_receivable": True,
+    }
+    paypal.route(
+        "GET",
+        r"/v1/customer/partners/[^/]+/merchant-integrations",
+        lambda request: (200, {"merchant_id": MERCHANT_ID}),
+    )
+    paypal.route(
+        "GET",
+        r"/v1/customer/partners/[^/]+/merchant-integrations/[^/]+",
+        lambda request: (200, integration),
+    )
+    return integration
+
+
+@pytest.fixture
+def writes(monkeypatch):
+    """The arguments of every call to `index_tracking_id`."""
+    calls = []
+    index_tracking_id = partner.index_tracking_id
+
+    def record(*args, **kwargs):
+        calls.append(args)
+        index_tracking_id(*args, **kwargs)
+
+    monkeypatch.setattr(partner, "index_tracking_id", record)
+    return calls
+
+
+def test_seller_is_indexed_only_when_missing_or_changed(
+    client, paypal, merchant_integrations, writes
+):
+    def get_seller_status(**options):
+        response = client.post("/api/partner/sellers", json=PARTNER_OPTIONS | options)
+        assert response.get_json()["merchantId"] == MERCHANT_ID
+
+    get_seller_status(**{"merchant-id": None, "tracking-id": TRACKING_ID})
+    assert writes == [(PARTNER_OPTIONS["partner-id"], TRACKING_ID, MERCHANT_ID)]
+
+    get_seller_status(**{"merchant-id": None, "tracking-id": TRACKING_ID})
+    get_seller_status(**{"merchant-id": MERCHANT_ID})
+    assert len(writes) == 1
+    # After the first call, the merchant ID is looked up from the index.
+    lookup = (
+        f"/v1/customer/partners/{PARTNER_OPTIONS['partner-id']}/merchant-integrations"
+    )
+    assert paypal.paths("GET").count(lookup) == 1
+
+    merchant_integrations["tracking_id"] = "TRACKING2"
+    get_seller_status(**{"merchant-id": MERCHANT_ID})
+    assert writes[1:] == [(PARTNER_OPTIONS["partner-id"], "TRACKING2", MERCHANT_ID)]
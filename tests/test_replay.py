@@ -0,0 +1,30 @@
+import pytest
+
+from src.api.replay import get_replay_url
+
+
+@pytest.mark.parametrize(
+    "url, expected",
+    [
+        (
+            "https://api-m.sandbox.paypal.com/v2/checkout/orders?page=2",
+            "http://127.0.0.1:8001/v2/checkout/orders?page=2",
+        ),
+        (
+            "https://api.paypal.com/v1/notifications/certs/CERT-1",
+            "https://api.paypal.com/v1/notifications/certs/CERT-1",
+        ),
+        (
+            "https://api-m.sandbox.paypal.com.example.com/v2/checkout/orders",
+            "https://api-m.sandbox.paypal.com.example.com/v2/checkout/orders",
+        ),
+    ],
+)
+def test_only_paypal_api_urls_are_replayed(app, url, expected):
+    app.config.update(
+        ENDPOINT_PREFIX="https://api-m.sandbox.paypal.com",
+        UPSTREAM_REPLAY_URL="http://127.0.0.1:8001",
+    )
+
+    with app.app_context():
+        assert get_replay_url(url) == expected
@@ -0,0 +1,70 @@
+from conftest import PARTNER_OPTIONS
+
+
+def test_statuses_include_each_parsed_status(client, paypal):
+    paypal.route(
+        "GET",
+        r"/v2/checkout/orders/([^/]+)",
+        lambda request, order_id: (200, {"id": order_id, "status": "COMPLETED"}),
+    )
+    paypal.route(
+        "GET",
+        r"/v2/payments/authorizations/([^/]+)",
+        lambda request, auth_id: (200, {"id": auth_id, "status": "CAPTURED"}),
+    )
+    paypal.route(
+        "GET",
+        r"/v2/payments/captures/([^/]+)",
+        lambda request, capture_id: (200, {"id": capture_id, "status": "REFUNDED"}),
+    )
+    paypal.route(
+        "GET",
+        r"/v1/customer/partners/([^/]+)/merchant-integrations/([^/]+)",
+        lambda request, partner_id, merchant_id: (
+            200,
+            {
+                "merchant_id": merchant_id,
+                "payments_receivable": True,
+                "primary_email_confirmed": False,
+            },
+        ),
+    )
+    paypal.route(
+        "GET",
+        r"/v2/customer/partner-referrals/([^/]+)",
+        lambda request, _: (200, {"referral_data": {"tracking_id": "TRACKING1"}}),
+    )
+
+    response = client.post(
+        "/api/statuses/",
+        json=PARTNER_OPTIONS
+        | {
+            "order-id": "ORDER1",
+            "auth-id": "AUTH1",
+            "capture-id": "CAPTURE1",
+            "seller-merchant-id": "SELLER1",
+            "referral-token": "REFERRAL1",
+        },
+    )
+
+    data = response.get_json()
+    assert data["errors"] == {}
+    assert data["orderStatus"] == "COMPLETED"
+    assert data["authStatus"] == "CAPTURED"
+    assert data["captureStatus"] == "REFUNDED"
+    assert data["merchantId"] == "SELLER1"
+    assert data["paymentsReceivable"] is True
+    assert data["primaryEmailConfirmed"] is False
+    assert data["trackingId"] == "TRACKING1"
+    assert {"order-details", "get-auth", "get-capture"} <= set(data["formatted"])
+    assert paypal.paths().count("/v1/oauth2/token") == 1
+
+
+def test_statuses_omit_fields_of_failed_lookups(client, paypal):
+    response = client.post(
+        "/api/statuses/", json=PARTNER_OPTIONS | {"order-id": "UNKNOWN"}
+    )
+
+    data = response.get_json()
+    assert "orderStatus" not in data
+    assert "order-details" in data["formatted"]
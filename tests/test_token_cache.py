@@ -0,0 +1,63 @@
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+
+from src.api.token_cache import TokenCache
+
+
+def test_refreshes_of_different_keys_run_concurrently(tmp_path):
+    cache = TokenCache(str(tmp_path / "tokens.json"))
+    # Each refresh waits for the other to start, so it times out if they're serialized.
+    both_refreshing = threading.Barrier(2, timeout=5)
+
+    def refresh(value):
+        both_refreshing.wait()
+        return value, 3600
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = [
+            executor.submit(cache.get_or_refresh, key, lambda key=key: refresh(key))
+            for key in ("client-a", "client-b")
+        ]
+        assert [future.result() for future in futures] == ["client-a", "client-b"]
+
+    assert cache.get("client-a") == "client-a"
+    assert cache.get("client-b") == "client-b"
+
+
+def test_concurrent_refreshes_of_one_key_are_collapsed(tmp_path):
+    cache = TokenCache(str(tmp_path / "tokens.json"))
+    calls = []
+    refreshing = threading.Event()
+    release = threading.Event()
+
+    def refresh():
+        calls.append(None)
+        refreshing.set()
+        release.wait(5)
+        return "token", 3600
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [
+            executor.submit(cache.get_or_refresh, "client", refresh) for _ in range(4)
+        ]
+        refreshing.wait(5)
+        release.set()
+        assert [future.result() for future in futures] == ["token"] * 4
+
+    assert len(calls) == 1
+
+
+def test_entries_are_shared_through_the_file(tmp_path):
+    path = str(tmp_path / "tokens.json")
+    TokenCache(path).get_or_refresh("client", lambda: ("token", 3600))
+
+    other_worker = TokenCache(path)
+    assert other_worker.get_or_refresh("client", lambda: ("new-token", 3600)) == "token"
+
+
+def test_stale_and_uncacheable_values_are_refreshed(tmp_path):
+    cache = TokenCache(str(tmp_path / "tokens.json"), refresh_margin=300)
+    cache.set("client", "stale-token", 60)
+    assert cache.get_or_refresh("client", lambda: (None, None)) is None
+    assert cache.get_or_refresh("client", lambda: ("token", 3600)) == "token"
@@ -0,0 +1,101 @@
+import time
+
+from email.utils import formatdate
+
+import pytest
+
+from src.api import upstream
+
+
+@pytest.fixture
+def orders(app, paypal):
+    """PayPal's orders endpoint, answering with the appended responses in turn.
+
+    Each response is a `(status, headers)` pair; the last one is repeated.
+    """
+    responses = []
+
+    def answer(request):
+        status, headers = responses.pop(0) if len(responses) > 1 else responses[0]
+        return status, {"id": "ORDER0000001"}, headers
+
+    paypal.route("POST", r"/v2/checkout/orders", answer)
+    paypal.route("GET", r"/v2/checkout/orders", answer)
+    return responses
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """The delays slept for between retries, which are skipped."""
+    delays = []
+    monkeypatch.setattr(time, "sleep", delays.append)
+    return delays
+
+
+def send(app, method, **kwargs):
+    with app.app_context():
+        url = f"{app.config['ENDPOINT_PREFIX']}/v2/checkout/orders"
+        return upstream.request(method, url, **kwargs)
+
+
+def order_calls(paypal):
+    return [call for call in paypal.calls if call.url.endswith("/orders")]
+
+
+def test_post_with_request_id_is_retried_with_the_same_id(app, paypal, orders, sleeps):
+    orders.extend([(503, {}), (201, {})])
+
+    response = send(app, "POST", headers={"PayPal-Request-Id": "REQUEST-1"})
+
+    assert response.status_code == 201
+    calls = order_calls(paypal)
+    assert len(calls) == 2
+    assert [call.headers["PayPal-Request-Id"] for call in calls] == ["REQUEST-1"] * 2
+    assert len(sleeps) == 1
+
+
+def test_post_without_request_id_isnt_retried(app, paypal, orders, sleeps):
+    orders.extend([(503, {}), (201, {})])
+
+    response = send(app, "POST", headers={"Content-Type": "application/json"})
+
+    assert response.status_code == 503
+    assert len(order_calls(paypal)) == 1
+    assert sleeps == []
+
+
+def test_retries_stop_when_the_budget_runs_out(app, paypal, orders, sleeps):
+    app.config.update(HTTP_RETRY_BUDGET_RATIO=0, HTTP_RETRY_BUDGET_MIN=1)
+    orders.append((503, {}))
+
+    assert send(app, "GET").status_code == 503
+    assert len(order_calls(paypal)) == 2  # One retry, instead of HTTP_RETRIES.
+    assert send(app, "GET").status_code == 503
+    assert len(order_calls(paypal)) == 3
+
+
+@pytest.mark.parametrize(
+    "retry_after, expected",
+    [
+        (lambda: "3", (3, 3)),
+        (lambda: formatdate(time.time() + 5, usegmt=True), (3, 5)),
+    ],
+)
+def test_retry_after_is_honoured(app, paypal, orders, sleeps, retry_after, expected):
+    orders.extend([(429, {"Retry-After": retry_after()}), (200, {})])
+
+    response = send(app, "GET")
+
+    assert response.status_code == 200
+    (delay,) = sleeps
+    assert expected[0] <= delay <= expected[1]
+
+
+def test_retry_after_beyond_the_max_delay_isnt_waited_for(app, paypal, orders, sleeps):
+    orders.extend([(429, {"Retry-After": "60"}), (200, {})])
+
+    response = send(app, "GET")
+
+    assert response.status_code == 429
+    assert len(order_calls(paypal)) == 1
+    assert sleeps == []
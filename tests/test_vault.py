@@ -0,0 +1,122 @@
+import json
+
+import pytest
+
+from urllib.parse import parse_qs, urlsplit
+
+from conftest import PARTNER_OPTIONS
+
+# Payment tokens by customer ID.
+CUSTOMERS = {
+    "CUSTOMER1": [f"TOKEN1-{i}" for i in range(5)],
+    "CUSTOMER2": [f"TOKEN2-{i}" for i in range(2)],
+}
+
+
+@pytest.fixture
+def payment_tokens(paypal):
+    """PayPal's payment token endpoints, listing tokens two per page."""
+    deleted = []
+
+    def list_payment_tokens(request):
+        query = parse_qs(urlsplit(request.url).query)
+        customer_id = query["customer_id"][0]
+        if customer_id not in CUSTOMERS:
+            return 404, {"name": "RESOURCE_NOT_FOUND"}
+
+        page = int(query["page"][0])
+        tokens = CUSTOMERS[customer_id]
+        page_tokens = tokens[(page - 1) * 2 : page * 2]
+        return 200, {
+            "customer": {"id": customer_id},
+            "payment_tokens": [{"id": token} for token in page_tokens],
+            "total_items": len(tokens),
+            "total_pages": (len(tokens) + 1) // 2,
+        }
+
+    def delete_payment_token(request, payment_token_id):
+        deleted.append(payment_token_id)
+        return 204, {}
+
+    paypal.route("GET", r"/v3/vault/payment-tokens", list_payment_tokens)
+    paypal.route("DELETE", r"/v3/vault/payment-tokens/([^/]+)", delete_payment_token)
+    return deleted
+
+
+def purge(client, **options):
+    response = client.post("/api/vault/purge", json=PARTNER_OPTIONS | options)
+    if response.mimetype != "application/x-ndjson":
+        return response, None
+    lines = response.get_data(as_text=True).splitlines()
+    return response, [json.loads(line) for line in lines]
+
+
+def test_purge_deletes_every_token_of_each_customer(client, payment_tokens):
+    response, lines = purge(
+        client, **{"customer-ids": ["CUSTOMER1", "UNKNOWN", "CUSTOMER2"]}
+    )
+
+    assert response.status_code == 200
+    *results, summary = lines
+    assert sorted(payment_tokens) == sorted(
+        CUSTOMERS["CUSTOMER1"] + CUSTOMERS["CUSTOMER2"]
+    )
+    assert all(result["deleted"] for result in results)
+    assert summary["summary"]["deleted"] == 7
+    assert summary["summary"]["failed"] == 0
+    errors = summary["summary"]["customerErrors"]
+    assert [error["customerId"] for error in errors] == ["UNKNOWN"]
+
+
+@pytest.mark.parametrize(
+    "options",
+    [
+        {},
+        {"customer-ids": []},
+        {"customer-ids": "CUSTOMER1"},
+        {"customer-ids": ["CUSTOMER1"], "rate": 0},
+        {"customer-ids": ["CUSTOMER1"], "rate": -5},
+        {"customer-ids": ["CUSTOMER1"], "rate": "fast"},
+    ],
+)
+def test_purge_rejects_invalid_options(client, payment_tokens, options):
+    response, _ = purge(client, **options)
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+    assert payment_tokens == []
+
+
+def stream_payment_tokens(client, customer_id, **options):
+    response = client.post(
+        f"/api/vault/customers/{customer_id}/payment-tokens",
+        json=PARTNER_OPTIONS | options,
+    )
+    if response.mimetype != "application/x-ndjson":
+        return response, None
+    lines = response.get_data(as_text=True).splitlines()
+    return response, [json.loads(line) for line in lines]
+
+
+def test_payment_tokens_are_streamed_across_pages(client, paypal, payment_tokens):
+    response, lines = stream_payment_tokens(client, "CUSTOMER1", **{"page-size": 100})
+
+    assert response.status_code == 200
+    assert [line["page"] for line in lines] == [1, 1, 2, 2, 3]
+    assert [line["paymentToken"]["id"] for line in lines] == CUSTOMERS["CUSTOMER1"]
+    queries = [
+        parse_qs(urlsplit(call.url).query)
+        for call in paypal.calls
+        if "page_size" in call.url
+    ]
+    assert [query["page"] for query in queries] == [["1"], ["2"], ["3"]]
+    assert all(query["page_size"] == ["20"] for query in queries)  # The API's maximum.
+
+
+@pytest.mark.parametrize("page_size", [0, -1, "abc", None])
+def test_invalid_page_size_is_rejected(client, paypal, payment_tokens, page_size):
+    response, _ = stream_payment_tokens(client, "CUSTOMER1", **{"page-size": page_size})
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+    assert paypal.calls == []
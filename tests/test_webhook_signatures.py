@@ -0,0 +1,185 @@
+import base64
+import datetime
+import json
+import zlib
+
+import pytest
+
+x509 = pytest.importorskip("cryptography.x509")
+
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from cryptography.x509.oid import NameOID
+from werkzeug.datastructures import Headers
+
+from src.api.webhooks import verify_locally
+
+WEBHOOK_ID = "1JE4291016473214C"
+CERT_URL = "https://api.paypal.com/v1/notifications/certs/CERT-360caa42-fca2a594"
+
+EVENT = {
+    "id": "WH-58D329510W468432D-8HN650336L201105X",
+    "event_type": "PAYMENT.CAPTURE.COMPLETED",
+    "resource": {"id": "3C679366HH908993F", "status": "COMPLETED"},
+}
+
+
+def issue_certificate(
+    common_name, key, issuer=None, issuer_key=None, ca=False, expired=False
+):
+    """Return a certificate for `key`, signed by `issuer_key` (or self-signed)."""
+    now = datetime.datetime.now(datetime.timezone.utc)
+    if expired:
+        now -= datetime.timedelta(days=400)
+    subject = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    return (
+        x509.CertificateBuilder()
+        .subject_name(subject)
+        .issuer_name(issuer.subject if issuer else subject)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - datetime.timedelta(days=1))
+        .not_valid_after(now + datetime.timedelta(days=365))
+        .add_extension(x509.BasicConstraints(ca=ca, path_length=None), critical=True)
+        .sign(issuer_key or key, hashes.SHA256())
+    )
+
+
+def to_pem(*certificates):
+    return b"".join(
+        certificate.public_bytes(serialization.Encoding.PEM)
+        for certificate in certificates
+    )
+
+
+def generate_key():
+    return rsa.generate_private_key(public_exponent=65537, key_size=2048)
+
+
+@pytest.fixture(scope="module")
+def pki():
+    """A root CA, an intermediate CA and PayPal's signing key, as PayPal's chain has."""
+    root_key, intermediate_key, signing_key = (generate_key() for _ in range(3))
+    root = issue_certificate("Test Root CA", root_key, ca=True)
+    intermediate = issue_certificate(
+        "Test Intermediate CA", intermediate_key, root, root_key, ca=True
+    )
+    return {
+        "root": root,
+        "intermediate": intermediate,
+        "intermediate_key": intermediate_key,
+        "signing_key": signing_key,
+    }
+
+
+@pytest.fixture
+def certificates(app, paypal, pki, tmp_path):
+    """Serve certificates at their URLs, trusting only the test root CA."""
+    ca_bundle = tmp_path / "ca.pem"
+    ca_bundle.write_bytes(to_pem(pki["root"]))
+    app.config.update(WEBHOOK_ID=WEBHOOK_ID, WEBHOOK_CERT_CA_BUNDLE=str(ca_bundle))
+
+    served = dict()
+    paypal.route(
+        "GET",
+        r"/v1/notifications/certs/([^/]+)",
+        lambda request, _: (200, served[request.url]),
+    )
+
+    def serve(url, signing_certificate):
+        served[url] = to_pem(signing_certificate, pki["intermediate"])
+
+    return serve
+
+
+def signing_certificate(pki, common_name="messageverificationcerts.paypal.com", **kw):
+    return issue_certificate(
+        common_name,
+        pki["signing_key"],
+        pki["intermediate"],
+        pki["intermediate_key"],
+        **kw,
+    )
+
+
+def sign(body, signing_key, cert_url=CERT_URL):
+    """Return the headers PayPal would send with the webhook `body`."""
+    transmission_id = "69cd13f0-d67a-11e5-baa3-778b53f4ae55"
+    transmission_time = "2016-02-18T20:01:35Z"
+    message = f"{transmission_id}|{transmission_time}|{WEBHOOK_ID}|{zlib.crc32(body.encode('utf-8'))}"
+    signature = signing_key.sign(
+        message.encode("utf-8"), padding.PKCS1v15(), hashes.SHA256()
+    )
+    return Headers(
+        {
+            "PayPal-Auth-Algo": "SHA256withRSA",
+            "PayPal-Cert-Url": cert_url,
+            "PayPal-Transmission-Id": transmission_id,
+            "PayPal-Transmission-Sig": base64.b64encode(signature).decode("ascii"),
+            "PayPal-Transmission-Time": transmission_time,
+        }
+    )
+
+
+def test_valid_signature_is_verified(app, certificates, pki):
+    certificates(CERT_URL, signing_certificate(pki))
+    body = json.dumps(EVENT)
+
+    with app.app_context():
+        assert verify_locally(sign(body, pki["signing_key"]), body)
+
+
+def test_tampered_body_fails_the_crc_check(app, certificates, pki):
+    certificates(CERT_URL, signing_certificate(pki))
+    body = json.dumps(EVENT)
+    tampered = body.replace("COMPLETED", "REFUNDED")
+
+    with app.app_context():
+        assert not verify_locally(sign(body, pki["signing_key"]), tampered)
+
+
+def test_expired_certificate_is_rejected(app, certificates, pki):
+    certificates(CERT_URL, signing_certificate(pki, expired=True))
+    body = json.dumps(EVENT)
+
+    with app.app_context():
+        assert not verify_locally(sign(body, pki["signing_key"]), body)
+
+
+def test_self_signed_certificate_is_rejected(app, certificates, pki, paypal):
+    self_signed = issue_certificate(
+        "messageverificationcerts.paypal.com", pki["signing_key"]
+    )
+    paypal.route(
+        "GET", r"/v1/notifications/certs/([^/]+)", lambda *_: (200, to_pem(self_signed))
+    )
+    body = json.dumps(EVENT)
+
+    with app.app_context():
+        assert not verify_locally(sign(body, pki["signing_key"]), body)
+
+
+def test_certificate_issued_to_another_host_is_rejected(app, certificates, pki):
+    certificates(CERT_URL, signing_certificate(pki, common_name="example.com"))
+    body = json.dumps(EVENT)
+
+    with app.app_context():
+        assert not verify_locally(sign(body, pki["signing_key"]), body)
+
+
+@pytest.mark.parametrize(
+    "cert_url",
+    [
+        "https://paypal.com.example.com/v1/notifications/certs/CERT-1",
+        "http://api.paypal.com/v1/notifications/certs/CERT-1",
+    ],
+)
+def test_certificate_from_disallowed_url_isnt_downloaded(
+    app, certificates, pki, paypal, cert_url
+):
+    certificates(cert_url, signing_certificate(pki))
+    body = json.dumps(EVENT)
+
+    with app.app_context():
+        assert not verify_locally(sign(body, pki["signing_key"], cert_url), body)
+    assert paypal.calls == []
@@ -0,0 +1,203 @@
+import json
+import time
+
+import pytest
+
+from src.api import webhooks
+
+WEBHOOK_HEADERS = {
+    "PayPal-Transmission-Id": "69cd13f0-d67a-11e5-baa3-778b53f4ae55",
+    "PayPal-Transmission-Time": "2016-02-18T20:01:35Z",
+    "PayPal-Transmission-Sig": "c2lnbmF0dXJl",
+    "PayPal-Cert-Url": "https://api.paypal.com/v1/notifications/certs/CERT-1",
+    "PayPal-Auth-Algo": "SHA256withRSA",
+}
+
+EVENT = {
+    "id": "WH-58D329510W468432D-8HN650336L201105X",
+    "event_type": "PAYMENT.CAPTURE.COMPLETED",
+    "resource": {"id": "3C679366HH908993F", "status": "COMPLETED"},
+}
+
+
+@pytest.fixture
+def queue(app):
+    """A webhook queue without threads, processed by calling `process`."""
+    app.config.update(
+        WEBHOOK_ID="1JE4291016473214C",
+        WEBHOOK_LOCAL_VERIFICATION=False,
+        WEBHOOK_VERIFY_THREADS=0,
+    )
+    with app.app_context():
+        queue = webhooks.get_webhook_queue()
+
+        def process():
+            batch = queue.claim_batch()
+            queue.verify_batch(batch)
+            return len(batch)
+
+        queue.process = process
+        yield queue
+
+
+@pytest.fixture
+def verification(paypal):
+    """PayPal's verify-webhook-signature endpoint.
+
+    It answers with the appended responses in turn, then repeats the last one.
+    """
+    responses = []
+
+    def verify(request):
+        return responses.pop(0) if len(responses) > 1 else responses[0]
+
+    paypal.route("POST", r"/v1/notifications/verify-webhook-signature", verify)
+    return responses
+
+
+def deliver(client, event=EVENT, **headers):
+    return client.post(
+        "/api/webhooks/",
+        data=json.dumps(event),
+        headers=WEBHOOK_HEADERS | headers,
+        content_type="application/json",
+    )
+
+
+def get_event(client, transmission_id=WEBHOOK_HEADERS["PayPal-Transmission-Id"]):
+    return client.get(f"/api/webhooks/events/{transmission_id}").get_json()
+
+
+def test_webhook_is_acknowledged_and_queued(client, queue):
+    response = deliver(client)
+
+    assert response.status_code == 202
+    event = get_event(client)
+    assert event["status"] == "pending"
+    assert event["eventType"] == "PAYMENT.CAPTURE.COMPLETED"
+    assert event["event"] == EVENT
+
+
+def test_redelivered_webhook_is_queued_once(client, queue):
+    assert deliver(client).status_code == 202
+    assert deliver(client).status_code == 202
+
+    assert len(client.get("/api/webhooks/events").get_json()["events"]) == 1
+
+
+@pytest.mark.parametrize(
+    "data, headers",
+    [
+        (json.dumps(EVENT), {}),
+        ("not json", WEBHOOK_HEADERS),
+        ("[]", WEBHOOK_HEADERS),
+    ],
+)
+def test_malformed_webhook_is_rejected(client, queue, data, headers):
+    response = client.post("/api/webhooks/", data=data, headers=headers)
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+    assert client.get("/api/webhooks/events").get_json()["events"] == []
+
+
+def test_queued_webhooks_are_verified_in_batches(client, queue, verification, paypal):
+    verification.append((200, {"verification_status": "SUCCESS"}))
+    for i in range(3):
+        deliver(client, **{"PayPal-Transmission-Id": f"transmission-{i}"})
+
+    assert queue.process() == 3
+    assert queue.process() == 0
+
+    events = client.get("/api/webhooks/events").get_json()["events"]
+    assert [event["status"] for event in events] == ["verified"] * 3
+    assert events[0]["verification"] == {"verification_status": "SUCCESS"}
+    calls = [call for call in paypal.calls if call.url.endswith("signature")]
+    assert len(calls) == 3
+    assert json.loads(calls[0].body)["webhook_event"] == EVENT
+
+
+def test_failed_verification_is_recorded(client, queue, verification):
+    verification.append((200, {"verification_status": "FAILURE"}))
+    deliver(client)
+
+    queue.process()
+
+    assert get_event(client)["status"] == "unverified"
+
+
+def test_verification_errors_are_retried_with_backoff(
+    client, queue, verification, monkeypatch
+):
+    verification.append((502, b"<html>Bad Gateway</html>"))
+    deliver(client)
+    now = time.time()
+
+    assert queue.process() == 1
+    event = get_event(client)
+    assert (event["status"], event["attempts"]) == ("pending", 1)
+    assert queue.process() == 0  # Not until the retry delay has passed.
+
+    monkeypatch.setattr(time, "time", lambda: now + webhooks.RETRY_DELAY + 1)
+    assert queue.process() == 1
+    assert get_event(client)["attempts"] == 2
+    assert queue.process() == 0
+
+    monkeypatch.setattr(time, "time", lambda: now + 3 * webhooks.RETRY_DELAY + 2)
+    assert queue.process() == 1
+    event = get_event(client)
+    assert (event["status"], event["attempts"]) == ("error", 3)
+
+    monkeypatch.setattr(time, "time", lambda: now + 3600)
+    assert queue.process() == 0  # Given up after WEBHOOK_VERIFY_MAX_ATTEMPTS.
+
+
+def test_abandoned_claims_are_retried(client, queue, verification, monkeypatch):
+    verification.append((200, {"verification_status": "SUCCESS"}))
+    deliver(client)
+    now = time.time()
+    assert len(queue.claim_batch()) == 1  # ...by a worker that then dies.
+
+    assert queue.process() == 0
+    monkeypatch.setattr(time, "time", lambda: now + webhooks.CLAIM_TIMEOUT + 1)
+    assert queue.process() == 1
+    assert get_event(client)["status"] == "verified"
+
+
+def test_events_are_filtered_and_paged(client, queue, verification):
+    verification.append((200, {"verification_status": "SUCCESS"}))
+    deliver(client, **{"PayPal-Transmission-Id": "completed"})
+    refunded = EVENT | {"event_type": "PAYMENT.CAPTURE.REFUNDED"}
+    deliver(client, event=refunded, **{"PayPal-Transmission-Id": "refunded"})
+    queue.process()
+    deliver(client, **{"PayPal-Transmission-Id": "pending"})
+
+    def list_ids(**params):
+        response = client.get("/api/webhooks/events", query_string=params)
+        return [event["transmissionId"] for event in response.get_json()["events"]]
+
+    assert list_ids() == ["pending", "refunded", "completed"]
+    assert list_ids(status="verified") == ["refunded", "completed"]
+    assert list_ids(**{"event-type": "PAYMENT.CAPTURE.REFUNDED"}) == ["refunded"]
+    assert list_ids(limit=1) == ["pending"]
+
+    (newest,) = client.get("/api/webhooks/events?limit=1").get_json()["events"]
+    assert list_ids(before=newest["receivedAt"]) == ["refunded", "completed"]
+
+
+def test_unknown_event_is_not_found(client, queue):
+    response = client.get("/api/webhooks/events/unknown")
+
+    assert response.status_code == 404
+    assert "error" in response.get_json()
+
+
+@pytest.mark.parametrize(
+    "params",
+    [{"before": "yesterday"}, {"before": "nan"}, {"limit": "all"}, {"limit": 0}],
+)
+def test_invalid_paging_is_rejected(client, queue, params):
+    response = client.get("/api/webhooks/events", query_string=params)
+
+    assert response.status_code == 400
+    assert "error" in response.get_json()